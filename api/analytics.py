@@ -0,0 +1,111 @@
+import atexit
+import threading
+import traceback
+from collections import Counter
+from typing import Callable
+
+from .util import MEAL_TO_PERIOD
+
+# Visit/error counters are buffered in memory and flushed in the background, so the request path
+# never waits on Firebase for analytics and concurrent requests don't overwrite each other's counts.
+# On serverless instances (which can be frozen or recycled as soon as a response is sent) there's no flush thread,
+# and the handler flushes after its response has gone out instead (see background=False).
+
+
+class AnalyticsBuffer:
+    '''
+    Buffers counter increments and hands them to flush_fn as {path tuple: amount} every `interval` seconds,
+    or sooner once `threshold` requests have been recorded. flush_fn should apply all of them in one atomic write.
+    With background=False there's no flush thread and record_request never flushes, the caller has to call flush()
+    itself (the handler does once its response is sent, so the client never waits on it).
+    '''
+
+    def __init__(self, flush_fn: Callable[[dict], None], interval: float = 30, threshold: int = 50, background: bool = True):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.threshold = threshold
+        self.background = background
+        self._counts = Counter()
+        self._recorded = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record_request(self, location: str = None, meal: int = None, status: int = 200, cache: str = None, visit: bool = True) -> None:
+        'Count one request. Never blocks on the network.'
+        with self._lock:
+            if visit:
+                self._counts[('visitcount',)] += 1
+            if status >= 500:
+                self._counts[('errorcount',)] += 1
+            self._counts[('status', str(status))] += 1
+            if location is not None:
+                self._counts[('locations', location)] += 1
+            if meal in MEAL_TO_PERIOD:
+                self._counts[('meals', MEAL_TO_PERIOD[meal][1])] += 1
+            if cache is not None:
+                self._counts[('cache', cache)] += 1
+            self._recorded += 1
+            full = self._recorded >= self.threshold
+        if not self.background:
+            return
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        'Send everything buffered so far. If the write fails the counts are put back for the next flush.'
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+                self._recorded = 0
+            if not counts:
+                return
+            try:
+                self.flush_fn(dict(counts))
+            except Exception:
+                traceback.print_exc()
+                with self._lock:
+                    self._counts.update(counts)
+
+    def pending(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def apply_counts(current, counts: dict) -> dict:
+    'Adds the buffered counts to the current analytics tree (as stored in Firebase) and returns it'
+    current = _as_dict(current)
+    for path, amount in counts.items():
+        node = current
+        for key in path[:-1]:
+            node[key] = _as_dict(node.get(key))
+            node = node[key]
+        node[path[-1]] = (node.get(path[-1]) or 0) + amount
+    return current
+
+
+def _as_dict(node) -> dict:
+    # Firebase turns objects with mostly-numeric keys into lists when you read them back
+    if node is None:
+        return {}
+    if isinstance(node, list):
+        return {str(i): value for i, value in enumerate(node) if value is not None}
+    return node
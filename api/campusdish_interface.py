@@ -1,11 +1,22 @@
 import traceback
-import requests
-import bs4
 import re
+import os
+import threading
+import time
 from datetime import datetime
-from bs4 import BeautifulSoup as bs
+from . import upstream, tracing
+from .extraction import extract_location_page, LocationPage
 from .util import normalize_time_from_str, parse_date, get_irvine_time, get_date_str, MEAL_TO_PERIOD, EVENTS_PLACEHOLDER, LOCATION_INFO
 
+# how long a downloaded + extracted location page is reused before we fetch it again (seconds).
+# the schedule and themed events both come from this page, so this also makes sure a single
+# request only downloads and parses it once. Set to 0 to only dedupe within a request.
+LOCATION_PAGE_TTL = float(os.getenv("LOCATION_PAGE_TTL", 300))
+
+_location_page_cache = {}  # url -> (fetched_at, LocationPage)
+_location_page_locks = {}  # url -> lock, so concurrent callers wait for one download instead of each doing their own
+_location_page_locks_guard = threading.Lock()
+
 def get_menu_data(location, meal_id, date):
     '''
     Given a valid location, meal_id, and date,
@@ -15,9 +26,34 @@ def get_menu_data(location, meal_id, date):
     period_id = MEAL_TO_PERIOD[meal_id][0]
 
     #https://uci-campusdish-com.translate.goog/api/menu/GetMenus?locationId=3314&mode=Daily&date=12/14/2023
-    response = requests.get(f'https://uci-campusdish-com.translate.goog/api/menu/GetMenus?locationId={location_id}&date={date}&periodId={period_id}')
+    with tracing.phase('upstream'):
+        response = upstream.get(f'https://uci-campusdish-com.translate.goog/api/menu/GetMenus?locationId={location_id}&date={date}&periodId={period_id}')
+    if response.status_code == 200:
+        with tracing.phase('parse'):
+            payload = response.json()
+        if 'Menu' in payload:
+            return payload['Menu']
+        else:
+            raise KeyError(
+                f'Key "Menu" not found in campusdish response object. Response payload below:\n{payload}')
+    else:
+        print("Response error message: ", response.json())
+        response.raise_for_status()
+
+
+def get_week_menu_data(location, meal_id, start_date):
+    '''
+    Like get_menu_data, but asks campusdish for the whole week starting at start_date (mode=Weekly) in one call.
+    Use split_menu_by_day to get the per-day menu data back out.
+    '''
+    location_id = LOCATION_INFO[location]['id']
+    period_id = MEAL_TO_PERIOD[meal_id][0]
+
+    with tracing.phase('upstream'):
+        response = upstream.get(f'https://uci-campusdish-com.translate.goog/api/menu/GetMenus?locationId={location_id}&mode=Weekly&date={start_date}&periodId={period_id}')
     if response.status_code == 200:
-        payload = response.json()
+        with tracing.phase('parse'):
+            payload = response.json()
         if 'Menu' in payload:
             return payload['Menu']
         else:
@@ -28,34 +64,86 @@ def get_menu_data(location, meal_id, date):
         response.raise_for_status()
 
 
-def get_schedule_data(restaurant: str) -> dict:
+# keys for the day a product is served on in weekly menu data, AssignedDate first since that's the one
+# campusdish's own weekly view reads. if none of them is there, get_week_menus goes back to daily calls for good
+PRODUCT_DATE_KEYS = ('AssignedDate', 'MenuDate', 'Date')
+
+
+def split_menu_by_day(menu_data: dict) -> dict:
+    '''
+    Splits weekly menu data into {date (mm/dd/yyyy): menu data for that day}, each shaped like the daily get_menu_data result.
+    Products without a date are skipped, so callers should fall back to daily calls for days that are missing.
+    '''
+    by_day = {}
+    for product in menu_data["MenuProducts"]:
+        raw_date = next((product[key] for key in PRODUCT_DATE_KEYS if product.get(key)), None)
+        if raw_date is None:
+            continue
+        date = datetime.strptime(raw_date[:10], '%Y-%m-%d').strftime('%m/%d/%Y')
+        if date not in by_day:
+            by_day[date] = {"MenuStations": menu_data["MenuStations"], "MenuProducts": []}
+        by_day[date]["MenuProducts"].append(product)
+    return by_day
+
+
+def get_location_url(restaurant: str) -> str:
+    'Returns the campusdish page for the restaurant, which has the schedule and the themed events on it'
+    url = 'https://uci.campusdish.com/LocationsAndMenus/'
+    if restaurant == 'Anteatery':
+        url += 'TheAnteatery'
+    else:
+        url += restaurant
+    return url
+
+
+def get_location_page(restaurant: str, max_age: float = None) -> LocationPage:
+    '''
+    Download the location page for the restaurant and extract the parts we use from it, reusing the extracted page if it's younger than max_age seconds
+    (defaults to LOCATION_PAGE_TTL). Only one download per page happens at a time, other callers wait for it and share the result.
+    Raises if the download fails, so callers can fall back to their defaults.
+    '''
+    if max_age is None:
+        max_age = LOCATION_PAGE_TTL
+    url = get_location_url(restaurant)
+
+    with _location_page_locks_guard:
+        lock = _location_page_locks.setdefault(url, threading.Lock())
+
+    with lock:
+        cached = _location_page_cache.get(url)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        with tracing.phase('upstream'):
+            response = upstream.get(url)
+            response.raise_for_status() # don't cache an error page
+            html = response.text
+        with tracing.phase('parse'):
+            page = extract_location_page(html)
+        _location_page_cache[url] = (time.monotonic(), page)
+        return page
+
+
+def get_schedule_data(restaurant: str, page: LocationPage = None) -> dict:
     '''
-    Given the restaurant name,
-    perform get request, then parse the HTML code using BeautifulSoup 4
+    Given the restaurant name (and optionally the already extracted location page),
+    get the location page, then read the meal periods and times from it
     return a dictionary
     schedule time use int because frontend work with int
     schedule time is (100*hours)+minutes, where hours is in 24-hour time
     '''
 
     try:
-        url = 'https://uci.campusdish.com/LocationsAndMenus/'
-        if restaurant == 'Anteatery':
-            url += 'TheAnteatery'
-        else:
-            url += restaurant
         schedule = {}
-        soup = bs(requests.get(url).text, 'html.parser')
-        meal_period = soup.select('.mealPeriod')
-
-        location_times = soup.select('span[class=location__times]')
+        if page is None:
+            page = get_location_page(restaurant)
         times = []
         meals = []
 
-        for time in location_times:
-            times.append(time.getText().split(' - '))
+        for time in page.location_times:
+            times.append(time.split(' - '))
         times.append([times[-2][0],times[-1][1]]) #extended dinner
-        for meal in meal_period:
-            meals.append(meal.getText().lower())
+        for meal in page.meal_periods:
+            meals.append(meal.lower())
         # print(times)
         # Hard coded to match the UCI website schedule
         weekday = [(meals[0], times[0]), #Breakfast
@@ -100,51 +188,47 @@ def get_schedule_data(restaurant: str) -> dict:
                 }
         return schedule
     except:
-        # return hardcoded schedule
-        day_of_week = get_irvine_time().tm_wday # 0-6 inclusive, 0=monday
-        schedule = {
-            "breakfast": {
-                "start": 715,
-                "end": 1100
-            },
-            "lunch": {
-                "start":1100,
-                "end":1630
-            },
-            "dinner": {
-                "start": 1630,
-                "end": 2300
-            }
+        return get_default_schedule()
+
+
+def get_default_schedule() -> dict:
+    'Hardcoded schedule, used when we can\'t get the real one from campusdish'
+    day_of_week = get_irvine_time().tm_wday # 0-6 inclusive, 0=monday
+    schedule = {
+        "breakfast": {
+            "start": 715,
+            "end": 1100
+        },
+        "lunch": {
+            "start":1100,
+            "end":1630
+        },
+        "dinner": {
+            "start": 1630,
+            "end": 2300
         }
-        if day_of_week >= 4: # if friday or later, there's no latenight
-            schedule["dinner"]["end"] = 2000
-            if day_of_week >= 5: # if it's the weekend, lunch is brunch, and breakfast starts later
-                schedule["brunch"] = schedule["lunch"]
-                del schedule["lunch"]
-                schedule["breakfast"]["start"] = 900
-        return schedule
+    }
+    if day_of_week >= 4: # if friday or later, there's no latenight
+        schedule["dinner"]["end"] = 2000
+        if day_of_week >= 5: # if it's the weekend, lunch is brunch, and breakfast starts later
+            schedule["brunch"] = schedule["lunch"]
+            del schedule["lunch"]
+            schedule["breakfast"]["start"] = 900
+    return schedule
 
 
-def get_themed_event_data(restaurant: str) -> list[dict]:
+def get_themed_event_data(restaurant: str, page: LocationPage = None) -> list[dict]:
     '''
-    Given a valid restaurant name,
-    perform get request, then parse the HTML code for the event_json using BeautifulSoup 4
+    Given a valid restaurant name (and optionally the already extracted location page),
+    get the location page, then read the event_json from its event table rows
     '''
-    url = 'https://uci.campusdish.com/LocationsAndMenus/'
-    if restaurant == 'Anteatery':
-        url += 'TheAnteatery'
-    else:
-        url += restaurant
-
     try:
-        soup = bs(requests.get(url).text, 'html.parser')
-        table_rows = soup.find_all('tr', attrs={"style": "height: 10pt;"})
+        if page is None:
+            page = get_location_page(restaurant)
 
-        def event_from_soup(soup_object: bs4.element.Tag):
-            text_list = [td.getText().strip()
-                         for td in soup_object.find_all("td")]
+        def event_from_row(text_list: list):
             try:
-                if text_list[0] == '':
+                if not text_list or text_list[0] == '':
                     return False
                 event_date = parse_date(text_list[0])
                 if event_date < get_irvine_time():
@@ -161,6 +245,6 @@ def get_themed_event_data(restaurant: str) -> list[dict]:
                 }
             except Exception as e:
                 traceback.print_exc()
-        return list(filter(None, (event_from_soup(row) for row in table_rows)))
+        return list(filter(None, (event_from_row(row) for row in page.event_rows)))
     except:
         return EVENTS_PLACEHOLDER
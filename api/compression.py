@@ -0,0 +1,65 @@
+import gzip
+from typing import Optional
+
+try:
+    import brotli  # optional, install it (pip install brotli) to serve br to clients that ask for it
+except ImportError:
+    brotli = None
+
+# bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 512
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def supported_encodings() -> tuple:
+    'Content-Encodings we can produce, best first'
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _parse_accept_encoding(accept_encoding: str) -> dict:
+    'Accept-Encoding header -> {coding: q value}. Codings with a q value that isn\'t a number are left out'
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, *params = part.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = None
+        if name.strip() and quality is not None:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def accepts_identity(accept_encoding: Optional[str]) -> bool:
+    'False if the client said it won\'t take an uncompressed body (identity;q=0, or *;q=0 without identity)'
+    if not accept_encoding:
+        return True
+    accepted = _parse_accept_encoding(accept_encoding)
+    return accepted.get('identity', accepted.get('*', 1)) > 0
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    '''
+    Pick the best encoding the client accepts from its Accept-Encoding header, or None to send the body as-is.
+    '''
+    if not accept_encoding:
+        return None
+    accepted = _parse_accept_encoding(accept_encoding)
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Unsupported encoding {encoding}")
@@ -0,0 +1,121 @@
+'''
+Normalized storage for cached menus. Most dishes show up in most meals and days, so instead of storing every dish
+in every location/date/meal node, each dish is stored once at dishes/<id> (the id is a hash of its content),
+and the menu nodes only hold the ids:
+    {..., "dishRefs": true, "all": [{"station": ..., "menu": [{"category": ..., "items": ["<id>", ...]}]}]}
+Reads put the full dishes back in through DishCache, which keeps every dish it has seen
+(a dish's content never changes under its id, so there's nothing to invalidate). A cold instance reads the whole
+dish table in one request instead of each of a menu's dishes on its own, which also warms it up for the other menus.
+'''
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple
+
+from .util import EMPTY_MENU_OBJECT, MENU_DATA_ERROR_OBJECT
+
+DISH_FETCH_WORKERS = 16
+
+
+def get_dish_id(dish: dict) -> str:
+    'Content hash of a dish, so the same dish always gets the same id'
+    return hashlib.sha1(json.dumps(dish, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:20]
+
+
+def is_packed(node: dict) -> bool:
+    return bool(node) and bool(node.get('dishRefs'))
+
+
+def pack_body(data: dict) -> Tuple[dict, dict]:
+    '''
+    Split a response body into the body with dish ids in place of the dishes, and the dishes by id.
+    The placeholder menus (errors and empty menus) are left as they are, so they can be checked without a join.
+    '''
+    if data.get('all') in (MENU_DATA_ERROR_OBJECT, EMPTY_MENU_OBJECT):
+        return data, {}
+    dishes = {}
+    stations = []
+    for station in data['all']:
+        categories = []
+        for category in station['menu']:
+            ids = []
+            for dish in category['items']:
+                dish_id = get_dish_id(dish)
+                dishes[dish_id] = dish
+                ids.append(dish_id)
+            categories.append({'category': category['category'], 'items': ids})
+        stations.append({'station': station['station'], 'menu': categories})
+    return {**data, 'all': stations, 'dishRefs': True}, dishes
+
+
+def unpack_body(node: dict, dishes: dict) -> dict:
+    'The full response body for a packed node, given the dishes by id'
+    data = {key: value for key, value in node.items() if key != 'dishRefs'}
+    data['all'] = [
+        {
+            'station': station['station'],
+            'menu': [
+                {'category': category['category'], 'items': [dishes[dish_id] for dish_id in category.get('items') or []]}
+                for category in station.get('menu') or []
+            ]
+        }
+        for station in node['all']
+    ]
+    return data
+
+
+def get_dish_ids(node: dict) -> set:
+    return {dish_id for station in node['all'] for category in station.get('menu') or [] for dish_id in category.get('items') or []}
+
+
+class DishCache:
+    '''
+    Dishes by id, fetched the first time they're needed. A few missing dishes (up to DISH_FETCH_WORKERS, e.g. the new ones
+    in a menu another instance refreshed) are fetched with fetch_dish(id), all at the same time. More than that (a cold start)
+    and the whole table is read with fetch_table() instead, so a join never waits on more than one round-trip.
+    Only for reads: it can't tell whether a dish is still stored, since the sweeper removes unreferenced ones.
+    '''
+
+    def __init__(self, fetch_dish: Callable[[str], dict], fetch_table: Callable[[], dict] = None, max_size: int = 20000):
+        self.fetch_dish = fetch_dish
+        self.fetch_table = fetch_table
+        self.max_size = max_size
+        self._dishes = {}
+        self._lock = threading.Lock()
+        self._table_lock = threading.Lock()  # so concurrent cold joins read the table once
+        self._executor = ThreadPoolExecutor(max_workers=DISH_FETCH_WORKERS, thread_name_prefix="dish-fetch")
+
+    def add(self, dishes: dict) -> None:
+        with self._lock:
+            if len(self._dishes) + len(dishes) > self.max_size:
+                self._dishes.clear()  # crude, but the table only grows past this if menus change a lot
+            self._dishes.update(dishes)
+
+    def join(self, node: dict) -> dict:
+        'The full response body for a packed node, fetching the dishes that aren\'t cached yet'
+        ids = get_dish_ids(node)
+        with self._lock:
+            dishes = {dish_id: self._dishes[dish_id] for dish_id in ids if dish_id in self._dishes}
+        missing = [dish_id for dish_id in ids if dish_id not in dishes]
+        if missing:
+            fetched = self._fetch(missing)
+            lost = [dish_id for dish_id, dish in fetched.items() if dish is None]
+            if lost:
+                raise KeyError(f"Dishes missing from the dish table: {lost}")
+            self.add(fetched)
+            dishes.update(fetched)
+        return unpack_body(node, dishes)
+
+    def _fetch(self, missing: list) -> dict:
+        'The missing dishes by id (None for the ones that aren\'t stored)'
+        if self.fetch_table is None or len(missing) <= DISH_FETCH_WORKERS:
+            return dict(zip(missing, self._executor.map(self.fetch_dish, missing)))
+        with self._table_lock:
+            with self._lock:  # another join might have read the table while this one waited
+                fetched = {dish_id: self._dishes.get(dish_id) for dish_id in missing}
+            if None in fetched.values():
+                table = self.fetch_table() or {}
+                self.add(table)
+                fetched = {dish_id: fetched[dish_id] or table.get(dish_id) for dish_id in missing}
+        return fetched
@@ -0,0 +1,134 @@
+import os
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup as bs
+
+# Pulls the few parts of a campusdish location page we use (meal period names, opening times and themed event rows)
+# out of the HTML. The default 'stream' backend picks them out while the page is tokenized, without building a tree.
+# 'soup' builds a full BeautifulSoup tree (with lxml if it's installed) and is kept to check the stream backend against.
+EXTRACTION_BACKEND = os.getenv("HTML_EXTRACTION_BACKEND", "stream")
+
+EVENT_ROW_STYLE = "height: 10pt;"
+
+
+@dataclass
+class LocationPage:
+    meal_periods: list = field(default_factory=list)  # text of each .mealPeriod element
+    location_times: list = field(default_factory=list)  # text of each span[class=location__times], like "7:15AM - 11:00AM"
+    event_rows: list = field(default_factory=list)  # stripped text of each td, for each tr with style "height: 10pt;"
+
+
+class _Capture:
+    'An element we want the text of, open until its end tag'
+
+    def __init__(self, tag: str, target: list, strip: bool = False, is_row: bool = False):
+        self.tag = tag
+        self.is_row = is_row  # event rows only track where the row ends, their text comes from the tds
+        self.depth = 0  # nested elements with the same tag name that have to close first
+        self.parts = []
+        self.strip = strip
+        # reserve the spot now so the results stay in document order even when elements are nested
+        self.target = target
+        self.index = len(target)
+        target.append(None)
+
+    def close(self) -> None:
+        text = ''.join(self.parts)
+        self.target[self.index] = text.strip() if self.strip else text
+
+
+class _LocationPageParser(HTMLParser):
+    '''
+    Collects the text of the elements we care about as the page is tokenized.
+    Open elements are tracked as a stack, and closing one also closes everything opened inside it, like BeautifulSoup does.
+    '''
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.page = LocationPage()
+        self._stack = []  # open captures
+        self._rows = []  # td texts for each open event row
+
+    def handle_starttag(self, tag, attrs):
+        for capture in self._stack:
+            if capture.tag == tag:
+                capture.depth += 1
+
+        attrs = dict(attrs)
+        classes = attrs.get('class') or ''
+        if 'mealPeriod' in classes.split():
+            self._stack.append(_Capture(tag, self.page.meal_periods))
+        if tag == 'span' and classes == 'location__times':
+            self._stack.append(_Capture(tag, self.page.location_times))
+        if tag == 'tr' and attrs.get('style') == EVENT_ROW_STYLE:
+            row = []
+            self.page.event_rows.append(row)
+            self._rows.append(row)
+            self._stack.append(_Capture(tag, [], is_row=True))
+        elif tag == 'td' and self._rows:
+            self._stack.append(_Capture(tag, self._rows[-1], strip=True))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self._stack) - 1, -1, -1):
+            capture = self._stack[i]
+            if capture.tag != tag:
+                continue
+            if capture.depth > 0:
+                capture.depth -= 1
+                return
+            self._close_from(i)
+            return
+
+    def _close_from(self, i: int) -> None:
+        'Close the capture at index i of the stack and everything opened after it'
+        while len(self._stack) > i:
+            capture = self._stack.pop()
+            capture.close()
+            if capture.is_row:
+                self._rows.pop()
+
+    def handle_data(self, data):
+        for capture in self._stack:
+            capture.parts.append(data)
+
+    def close(self):
+        super().close()
+        # close anything that was never closed in the HTML, like BeautifulSoup does at the end of the document
+        self._close_from(0)
+
+
+def _extract_stream(html: str) -> LocationPage:
+    parser = _LocationPageParser()
+    parser.feed(html)
+    parser.close()
+    return parser.page
+
+
+def _soup_parser() -> str:
+    try:
+        import lxml  # noqa: F401 (only checking that it's installed)
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+def _extract_soup(html: str, parser: str = None) -> LocationPage:
+    soup = bs(html, parser or _soup_parser())
+    return LocationPage(
+        meal_periods=[meal.getText() for meal in soup.select('.mealPeriod')],
+        location_times=[time.getText() for time in soup.select('span[class=location__times]')],
+        event_rows=[[td.getText().strip() for td in row.find_all('td')]
+                    for row in soup.find_all('tr', attrs={"style": EVENT_ROW_STYLE})],
+    )
+
+
+BACKENDS = {
+    'stream': _extract_stream,
+    'soup': _extract_soup,
+}
+
+
+def extract_location_page(html: str, backend: str = None) -> LocationPage:
+    'Pull the meal periods, times and event rows out of a location page with the given backend (default EXTRACTION_BACKEND)'
+    return BACKENDS[backend or EXTRACTION_BACKEND](html)
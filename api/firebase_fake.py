@@ -0,0 +1,136 @@
+'''
+In-memory stand-in for firebase_admin.db, for running the server with USE_CACHE but without Firebase
+(offline tests, benchmarks). firebase_utils uses it instead of the real thing when FIREBASE_FAKE is set.
+Only the parts of the Reference API we use are implemented.
+'''
+import copy
+import itertools
+import os
+import threading
+import time
+
+# delay (seconds) added to every call, to make it behave more like the real network round-trip
+LATENCY = float(os.getenv("FIREBASE_FAKE_LATENCY_MS", 0)) / 1000
+
+_root = {}
+_lock = threading.RLock()
+_push_ids = itertools.count()
+
+
+def _split(path: str) -> list:
+    return [part for part in path.split('/') if part]
+
+
+def _prune(node):
+    'Firebase never stores empty objects or nulls'
+    if isinstance(node, dict):
+        pruned = {key: _prune(value) for key, value in node.items()}
+        return {key: value for key, value in pruned.items() if value not in (None, {})} or None
+    if isinstance(node, list):
+        return _prune({str(i): value for i, value in enumerate(node)})
+    return node
+
+
+def _restore_lists(node):
+    'Firebase gives objects back as lists when all their keys are integers and more than half of 0..max key are there'
+    if not isinstance(node, dict):
+        return node
+    node = {key: _restore_lists(value) for key, value in node.items()}
+    if node and all(key.isdigit() for key in node):
+        size = max(map(int, node)) + 1
+        if len(node) * 2 > size:
+            return [node.get(str(i)) for i in range(size)]
+    return node
+
+
+class Reference:
+
+    def __init__(self, path: str = '/'):
+        self._parts = _split(path)
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self) -> str:
+        return '/' + '/'.join(self._parts)
+
+    def child(self, path: str) -> 'Reference':
+        return Reference('/'.join(self._parts + _split(path)))
+
+    def _read(self):
+        node = _root
+        for part in self._parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _write(self, parts: list, value) -> None:
+        value = _prune(copy.deepcopy(value))
+        global _root
+        if not parts:
+            _root = value if isinstance(value, dict) else {}
+            return
+        node = _root
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+
+    def get(self, shallow: bool = False):
+        if LATENCY:
+            time.sleep(LATENCY)
+        with _lock:
+            value = self._read()
+            if shallow and isinstance(value, dict):
+                return {key: True for key in value}
+            return _restore_lists(copy.deepcopy(value))
+
+    def set(self, value) -> None:
+        if LATENCY:
+            time.sleep(LATENCY)
+        with _lock:
+            self._write(self._parts, value)
+
+    def update(self, value: dict) -> None:
+        'Multi-path update: keys can be paths relative to this reference, and None deletes'
+        if LATENCY:
+            time.sleep(LATENCY)
+        with _lock:
+            for path, child_value in value.items():
+                self._write(self._parts + _split(path), child_value)
+
+    def delete(self) -> None:
+        self.set(None)
+
+    def push(self, value=None) -> 'Reference':
+        ref = self.child(f"-fake{next(_push_ids):012d}")
+        if value is not None:
+            ref.set(value)
+        return ref
+
+    def transaction(self, transaction_update):
+        'Runs the update atomically (everything here is in one process, so a lock is enough)'
+        if LATENCY:
+            time.sleep(LATENCY)
+        with _lock:
+            new_value = transaction_update(_restore_lists(copy.deepcopy(self._read())))
+            self._write(self._parts, new_value)
+            return new_value
+
+
+def reference(path: str = '/', app=None, url=None) -> Reference:
+    return Reference(path)
+
+
+def reset() -> None:
+    'Empty the fake database'
+    global _root
+    with _lock:
+        _root = {}
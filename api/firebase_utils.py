@@ -1,19 +1,31 @@
 import json
 import os
-
-import firebase_admin#https://firebase.google.com/docs/database/admin/start
-from firebase_admin import credentials
-from firebase_admin import db
+import time
+import uuid
 
 from .util import get_current_meal, get_irvine_time
+from .analytics import AnalyticsBuffer, apply_counts
+from .dish_table import DishCache, pack_body, is_packed, get_dish_ids
+from .menu_diff import diff_paths, describe_changes, same_shape
+from .freshness import is_expired
 
-cred = credentials.Certificate(json.loads(os.getenv("FIREBASE_ADMIN_CREDENTIALS")))
+if os.getenv("FIREBASE_FAKE"):
+    from . import firebase_fake as db # in-memory stand-in with the same API, for running without firebase
+else:
+    import firebase_admin#https://firebase.google.com/docs/database/admin/start
+    from firebase_admin import credentials
+    from firebase_admin import db
 
-firebase_admin.initialize_app(cred, {
-    'databaseURL': os.getenv("FIREBASE_DATABASE_URL")
-})
+    cred = credentials.Certificate(json.loads(os.getenv("FIREBASE_ADMIN_CREDENTIALS")))
 
-def get_db_reference(location: str, meal: int, date: str) -> db.Reference:
+    firebase_admin.initialize_app(cred, {
+        'databaseURL': os.getenv("FIREBASE_DATABASE_URL")
+    })
+
+# identifies this instance in the build leases below
+INSTANCE_ID = uuid.uuid4().hex
+
+def _get_node_path(location: str, meal: int, date: str) -> str:
     if meal is None:
         meal = get_current_meal()
 
@@ -22,17 +34,154 @@ def get_db_reference(location: str, meal: int, date: str) -> db.Reference:
         date = f"{irvine_time.tm_mon}/{irvine_time.tm_mday}/{irvine_time.tm_year}"
 
     modified_datestring = date.replace("/","|")
-    
+    return f"{location}/{modified_datestring}/{meal}"
+
+def get_reference(path: str = "/") -> db.Reference:
+    return db.reference(path)
+
+def get_children(node) -> dict:
+    'The children of a node read with .get(). Firebase turns nodes with keys 0, 1, 2... into lists, so this turns them back'
+    if isinstance(node, list):
+        return {str(i): child for i, child in enumerate(node) if child is not None}
+    return node or {}
+
+def get_db_reference(location: str, meal: int, date: str) -> db.Reference:
     # .get() returns None if nothing created
-    return db.reference(f"{location}/{modified_datestring}/{meal}")
-
-def updateAnalytics(error=False) -> None:
-    ref = db.reference("analytics")
-    dbdata = ref.get()
-    ref.update({'visitcount': dbdata["visitcount"] + 1})
-    if error:
-        ref.update({'errorcount': dbdata["errorcount"] + 1})
-    return None
+    return db.reference(_get_node_path(location, meal, date))
+
+# store dishes once in dishes/<id> and only their ids in the menu nodes (see dish_table.py).
+# nodes written either way can be read either way, so this can be switched at any time
+DISH_TABLE = os.getenv("FIREBASE_DISH_TABLE", "True") != "False"
+
+DISHES = DishCache(lambda dish_id: db.reference(f"dishes/{dish_id}").get(), lambda: get_children(db.reference("dishes").get()))
+
+# a node without these is left over from a partial write (e.g. the sweeper removed it during a refresh), and counts as missing
+REQUIRED_FIELDS = ('date', 'all')
+
+def get_menu_body(location: str, meal: int, date: str, join: bool = True) -> dict:
+    '''
+    The cached response body for the location, meal and date, or None if there isn't a complete one.
+    Packed nodes get their dishes put back in, unless join=False (for when only the top level fields are needed).
+    '''
+    node = get_db_reference(location, meal, date).get()
+    if not isinstance(node, dict) or any(field not in node for field in REQUIRED_FIELDS):
+        return None
+    return join_menu_body(node) if join else node
+
+def join_menu_body(node: dict) -> dict:
+    'The full response body for a node read with join=False (None if its dishes are gone)'
+    if not is_packed(node):
+        return node
+    try:
+        return DISHES.join(node)
+    except KeyError as e:
+        print(f"Couldn't read the cached menu, treating it as missing: {e}")
+        return None
+
+def set_menu_body(location: str, meal: int, date: str, data: dict, previous: dict = None) -> list:
+    '''
+    Cache a response body. With DISH_TABLE on, the menu's dishes get written to the dish table in the same
+    multi-path update as the menu node.
+    If the node that's cached now is passed in as previous (as read with join=False), what changed gets added to the
+    change log at changes/<location>/<date>/<meal>, and only the parts that changed get written if that's safe (see _claim_node),
+    along with only the dishes previous didn't have. A refresh where nothing changed writes nothing but the claim.
+    If previous can't be joined (the sweeper removed some of its dishes) the whole node and all its dishes are written again.
+    Returns the change log records.
+    '''
+    node_path = _get_node_path(location, meal, date)
+    if DISH_TABLE:
+        node, dishes = pack_body(data)
+    else:
+        node, dishes = data, {}
+    update = {}
+
+    changes = []
+    previous_body = join_menu_body(previous) if previous is not None else None
+    if previous_body is not None:
+        changes = describe_changes(previous_body, data)
+        timestamp = int(time.time() * 1000)
+        for i, change in enumerate(changes):
+            update[f"changes/{node_path}/{timestamp:013d}{i:03d}"] = change
+
+    # previous joined, and the claim shows it's still the cached node, so the dishes it references are still stored
+    # (the sweeper only removes unreferenced ones) and only new ones need writing
+    if previous_body is not None and not is_expired(previous) and same_shape(previous, node) and _claim_node(node_path, previous, node):
+        update.update({f"{node_path}/{path}": value for path, value in diff_paths(previous, node).items() if path != "refreshTime"})
+        stored = get_dish_ids(previous) if is_packed(previous) else set()
+        new_dishes = {dish_id: dish for dish_id, dish in dishes.items() if dish_id not in stored}
+    else:
+        update[node_path] = node
+        new_dishes = dishes
+    update.update({f"dishes/{dish_id}": dish for dish_id, dish in new_dishes.items()})
+
+    if update:
+        db.reference("/").update(update)
+    DISHES.add(dishes)
+    return changes
+
+def _claim_node(node_path: str, previous: dict, node: dict) -> bool:
+    '''
+    Move the node's refreshTime from previous's to node's, but only if it's still previous's. If it isn't (the node was
+    rewritten or removed since previous was read) writing only the changes could leave a mixed or partial node behind.
+    '''
+    if previous.get("refreshTime") is None or node.get("refreshTime") is None:
+        return False
+
+    def claim(current):
+        return node["refreshTime"] if current == previous["refreshTime"] else current
+
+    try:
+        return get_reference(f"{node_path}/refreshTime").transaction(claim) == node["refreshTime"]
+    except Exception as e:
+        print(f"Couldn't claim the cached menu, writing all of it: {e}")
+        return False
+
+def get_menu_changes(location: str, meal: int, date: str) -> list:
+    'The change log for a menu, oldest first'
+    return [change for _key, change in sorted(get_children(db.reference(f"changes/{_get_node_path(location, meal, date)}").get()).items())]
+
+def get_lease_reference(location: str, meal: int, date: str) -> db.Reference:
+    return db.reference(f"leases/{_get_node_path(location, meal, date)}")
+
+def acquire_lease(location: str, meal: int, date: str, ttl: float) -> bool:
+    '''
+    Try to become the one instance building this menu, for ttl seconds. Returns False if another instance
+    holds an unexpired lease, in which case it's expected to write the menu to firebase soon.
+    '''
+    token = uuid.uuid4().hex  # this attempt, in case the transaction function runs more than once
+
+    def take(current):
+        if current and current.get("expires", 0) > time.time():
+            return current
+        return {"owner": INSTANCE_ID, "token": token, "expires": time.time() + ttl}
+
+    try:
+        lease = get_lease_reference(location, meal, date).transaction(take)
+    except Exception as e:
+        print(f"Couldn't get the build lease, building anyways: {e}")
+        return True
+    return bool(lease) and lease.get("token") == token
+
+def release_lease(location: str, meal: int, date: str) -> None:
+    try:
+        get_lease_reference(location, meal, date).delete()
+    except Exception as e:
+        print(f"Couldn't release the build lease (it expires on its own): {e}")
+
+def _flush_analytics(counts: dict) -> None:
+    'Adds the buffered counts to the analytics node in a single transaction, so concurrent instances never lose increments'
+    get_Analytics().transaction(lambda current: apply_counts(current, counts))
+
+# vercel can freeze or recycle the instance right after a response, so there the handler writes each request's
+# counts after its response is sent instead of leaving them in the buffer
+ON_VERCEL = bool(os.getenv("VERCEL"))
+
+ANALYTICS = AnalyticsBuffer(
+    _flush_analytics,
+    interval=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", 30)),
+    threshold=int(os.getenv("ANALYTICS_FLUSH_THRESHOLD", 50)),
+    background=not ON_VERCEL,
+)
 
 def get_Analytics() -> db.Reference:
     return db.reference("analytics")
@@ -0,0 +1,140 @@
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from .util import get_irvine_time, normalize_time, MENU_DATA_ERROR_OBJECT, EMPTY_MENU_OBJECT, EVENTS_PLACEHOLDER
+
+# How long clients (and caches between us and them) can reuse a response, depending on where the menu is in the meal schedule.
+# Menus for days that are over don't change anymore, and menus for later days can still be updated by the dining halls.
+PAST_MAX_AGE = 24 * 60 * 60
+FUTURE_MAX_AGE = 60 * 60
+MIN_MAX_AGE = 60  # today's meal, close to the end of the meal
+
+# How long we keep serving a cached body (in firebase and in memory) before rebuilding it from campusdish.
+# Menus for earlier days are never rebuilt, they only get removed by the sweeper once they're RETENTION_DAYS old.
+CURRENT_MEAL_TTL = float(os.getenv("CACHE_TTL_CURRENT_MEAL", 15 * 60))  # today's meal, while it's being served
+FUTURE_TTL = float(os.getenv("CACHE_TTL_FUTURE", 6 * 60 * 60))  # later days, and today's meals that aren't being served
+ERROR_TTL = float(os.getenv("CACHE_TTL_ERROR", 60))  # bodies where getting the menu failed
+RETENTION_DAYS = int(os.getenv("CACHE_RETENTION_DAYS", 14))
+
+
+def _minutes(hhmm: int) -> int:
+    'Minutes since midnight for a time in the API format ((100*hours)+minutes)'
+    return (hhmm // 100) * 60 + hhmm % 100
+
+
+def _get_meal_status(data: dict) -> str:
+    '''
+    Where the body's meal is relative to now: 'past' (an earlier day), 'over' (today's meal is over), 'current' (being served),
+    'upcoming' (later today) or 'future' (a later day). None if the body has no usable date.
+    '''
+    irvine_time = get_irvine_time()
+    try:
+        day = datetime.strptime(data['date'], '%m/%d/%Y').date()
+    except (KeyError, TypeError, ValueError):
+        return None
+    today = datetime(irvine_time.tm_year, irvine_time.tm_mon, irvine_time.tm_mday).date()
+    if day < today:
+        return 'past'
+    if day > today:
+        return 'future'
+    meal_times = (data.get('schedule') or {}).get(data.get('currentMeal'))
+    if not meal_times:
+        return 'current'
+    now = _minutes(normalize_time(irvine_time))
+    if now >= _minutes(meal_times['end']):
+        return 'over'
+    if now < _minutes(meal_times['start']):
+        return 'upcoming'
+    return 'current'
+
+
+def _has_placeholders(data: dict) -> bool:
+    '''
+    Whether parts of the body are stand-ins for what campusdish didn't give us: an empty menu, the hardcoded schedule
+    (it comes with the placeholder themed events) or the made up ones from "Invalid time" and _fill_defaults
+    (every meal ends before 1am). Those can still be filled in by a rebuild, so they're never kept for good.
+    '''
+    if data.get('all') == EMPTY_MENU_OBJECT or data.get('themed') == EVENTS_PLACEHOLDER:
+        return True
+    schedule = data.get('schedule')
+    if not schedule:
+        return True
+    return all(meal_times.get('end', 0) < 100 for meal_times in schedule.values())
+
+
+def get_cache_ttl(data: dict) -> Optional[float]:
+    '''
+    Seconds a cached body stays valid after its refreshTime, going by the schedule in it.
+    None means it never expires, which is only for complete bodies of earlier days (the menu won't change anymore).
+    Today's meals that are over still get rebuilt now and then, since the schedule they're judged by can be wrong.
+    '''
+    if data.get('all') == MENU_DATA_ERROR_OBJECT:
+        return ERROR_TTL
+    status = _get_meal_status(data)
+    if status == 'past' and not _has_placeholders(data):
+        return None
+    if status in ('past', 'over', 'future', 'upcoming'):
+        return FUTURE_TTL
+    return CURRENT_MEAL_TTL
+
+
+def get_seconds_until_expiry(data: dict, now: float = None) -> Optional[float]:
+    'Seconds left before a cached body expires (0 or less if it already has), None if it never does'
+    ttl = get_cache_ttl(data)
+    if ttl is None:
+        return None
+    return data.get('refreshTime', 0) + ttl - (now or time.time())
+
+
+def is_expired(data: dict, now: float = None) -> bool:
+    remaining = get_seconds_until_expiry(data, now)
+    return remaining is not None and remaining <= 0
+
+
+# times (same format as the schedule) when get_current_meal switches to the next meal. midnight switches the day too
+MEAL_SWITCH_TIMES = (1100, 1630, 2400)
+
+
+def get_seconds_until_meal_switch() -> int:
+    'Seconds until a request without a meal and date gets a different menu (the current meal or the day changes)'
+    irvine_time = get_irvine_time()
+    now = irvine_time.tm_hour * 3600 + irvine_time.tm_min * 60 + irvine_time.tm_sec
+    return next(switch for switch in (_minutes(switch) * 60 for switch in MEAL_SWITCH_TIMES) if switch > now) - now
+
+
+def get_client_max_age(data: dict, pinned: bool = True) -> int:
+    '''
+    Cache-Control max-age (seconds) for a response body.
+    Past days get a long max-age, future days a moderate one, and for today it's the time until the meal ends
+    (clamped between MIN_MAX_AGE and FUTURE_MAX_AGE), going by the schedule in the body.
+    If the request didn't pin the meal and date (pinned=False), it's never longer than the time until the
+    current meal switches, since the same url serves the next meal (or the next day) after that.
+    '''
+    max_age = _get_client_max_age(data)
+    if not pinned:
+        return min(max_age, get_seconds_until_meal_switch())
+    return max_age
+
+
+def _get_client_max_age(data: dict) -> int:
+    irvine_time = get_irvine_time()
+    try:
+        day = datetime.strptime(data['date'], '%m/%d/%Y').date()
+    except (KeyError, ValueError):
+        return MIN_MAX_AGE
+    today = datetime(irvine_time.tm_year, irvine_time.tm_mon, irvine_time.tm_mday).date()
+    if day < today:
+        return PAST_MAX_AGE
+    if day > today:
+        return FUTURE_MAX_AGE
+
+    meal_times = data.get('schedule', {}).get(data.get('currentMeal'))
+    if not meal_times:
+        return MIN_MAX_AGE
+    now = _minutes(normalize_time(irvine_time))
+    end = _minutes(meal_times['end'])
+    if now >= end:  # the meal is over for today, it won't change anymore
+        return FUTURE_MAX_AGE
+    return max(MIN_MAX_AGE, min(FUTURE_MAX_AGE, (end - now) * 60))
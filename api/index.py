@@ -1,22 +1,60 @@
 from http.server import BaseHTTPRequestHandler  # imported to have an http endpoint
 import json
-from typing import Union  # imported to format dict as json string
+from typing import Tuple, Union  # imported to format dict as json string
 import urllib.parse  # imported to help parsing url componenets
 import traceback  # for error handling
 import os  # imported to get environment variables
-from .util import is_valid_location, LOCATION_INFO
-from .parsing import make_response_body
+import time
+from datetime import datetime, timedelta  # for date ranges
+from concurrent.futures import ThreadPoolExecutor  # for refreshing stale in-memory cache entries in the background
+from .util import is_valid_location, get_current_meal, get_irvine_date, get_meals_for_weekday, LOCATION_INFO, MEAL_TO_PERIOD
+from .parsing import make_response_body, make_partial_body
+from .projection import parse_fields, project
+from .response_cache import ResponseCache, CacheEntry
+from .compression import choose_encoding, accepts_identity, compress, supported_encodings, MIN_COMPRESS_SIZE
+from .freshness import get_client_max_age, get_seconds_until_expiry, is_expired, PAST_MAX_AGE
+from .singleflight import SingleFlight
+from .search import SEARCH_INDEX, FLAGS, ensure_refreshing, parse_ranges
+from . import tracing
+from email.utils import formatdate, parsedate_to_datetime  # for Last-Modified/If-Modified-Since
 
 
 USE_CACHE = bool(os.getenv("USE_CACHE"))
 
 print("Using cache" if USE_CACHE else "Not using cache")
 
-# TODO: need to clear Firebase cache of outdated JSONS, should probably implement timer
-# e.g. force refresh of cache every hour
-
+# cached bodies expire going by the meal schedule (see freshness.py), and api/sweeper.py removes old ones from firebase
 if USE_CACHE:
-    from .firebase_utils import get_db_reference, updateAnalytics, get_Analytics
+    from .firebase_utils import get_menu_body, set_menu_body, join_menu_body, get_Analytics, ANALYTICS, acquire_lease, release_lease
+
+# with this on, an instance takes a lease in firebase before building a missing menu, and other instances
+# that miss at the same time wait for it to show up in firebase instead of hitting campusdish too
+BUILD_LEASE = bool(os.getenv("FIREBASE_BUILD_LEASE"))
+BUILD_LEASE_TTL = float(os.getenv("BUILD_LEASE_TTL", 15))  # seconds, also the longest another instance waits
+BUILD_LEASE_POLL = float(os.getenv("BUILD_LEASE_POLL", 0.25))
+
+# in-memory cache in front of Firebase/campusdish, so warm instances can answer repeat requests without a network hop
+RESPONSE_CACHE = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 300)),
+    stale_ttl=float(os.getenv("RESPONSE_CACHE_STALE_TTL", 600)),
+)
+
+# seconds a search request waits for the search index's first refresh. after that it gets what's indexed so far
+# (with "complete": false), or a 503 if nothing is
+SEARCH_WARMUP_TIMEOUT = float(os.getenv("SEARCH_WARMUP_TIMEOUT", 0))
+
+# in-memory entries are rechecked at least this often (and sooner if their body expires sooner), unless their meal is over
+MEMORY_MIN_TTL = 5
+
+_revalidate_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-revalidate")
+
+# concurrent misses for the same (location, meal, date) share one build instead of each going to firebase and campusdish
+IN_FLIGHT = SingleFlight()
+
+# range requests (location=all, meals=..., start/end) fetch their entries on this pool
+RANGE_MAX_DAYS = int(os.getenv("RANGE_MAX_DAYS", 14))
+_range_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RANGE_WORKERS", 8)), thread_name_prefix="range-fetch")
 
 class InvalidQueryException(Exception):
     pass
@@ -26,10 +64,355 @@ class NotFoundException(Exception):
     pass
 
 
+class UnavailableException(Exception):
+    'Something the request needs isn\'t ready yet, the client should retry in a few seconds'
+    pass
+
+
 # to implement redirects see this: https://stackoverflow.com/questions/22701544/redirect-function-with-basehttprequesthandler
 # redirects could be useful to just send the request straight to firebase
 
 
+def _cache_key(location: str, meal: int, date: str) -> tuple:
+    'Key for the in-memory cache, with the meal and date filled in the same way make_response_body does'
+    if meal is None:
+        meal = get_current_meal()
+    return (location, meal, date or get_irvine_date())
+
+
+def _serialize(data: dict, pretty: bool = False) -> bytes:
+    'Compact JSON by default, since most clients never look at the whitespace'
+    with tracing.phase('serialize'):
+        if pretty:
+            return json.dumps(data, ensure_ascii=False, indent=4).encode()
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _load_data(location: str, meal: int, date: str, do_refresh: bool = False) -> dict:
+    """
+    Get the response body from the Firebase cache (if it's on), otherwise build it from campusdish.
+    """
+    if USE_CACHE:
+        print(f"date from query params: {date}")
+        with tracing.phase('cache'):
+            db_data = get_menu_body(location, meal, date, join=False)  # the dishes only get joined in if it's served
+
+        expired = db_data is not None and is_expired(db_data)
+        leased = False
+        if (db_data is None or expired) and BUILD_LEASE and not do_refresh:
+            leased = acquire_lease(location, meal, date, BUILD_LEASE_TTL)
+            if not leased and expired:
+                expired = False  # another instance is rebuilding it, serve the old one until then
+            elif not leased:
+                with tracing.phase('cache'):
+                    db_data = _wait_for_other_instance(location, meal, date)
+
+        if db_data is None or expired or do_refresh:
+            try:
+                data = make_response_body(location, meal, date)
+                with tracing.phase('cache'):
+                    set_menu_body(location, meal, date, data, previous=db_data)  # only writes what changed
+            finally:
+                if leased:
+                    release_lease(location, meal, date)
+
+        else:
+            with tracing.phase('cache'):
+                data = join_menu_body(db_data)
+            if data is None:  # its dishes are gone from the dish table
+                return _load_data(location, meal, date, do_refresh=True)
+
+        return _fill_defaults(data)
+    else:
+        return make_response_body(location, meal, date)
+
+
+def _fill_defaults(data: dict) -> dict:
+    'Cached bodies from before the schedule and themed events were added don\'t have them'
+    mock_schedule = {
+        "breakfast": {
+            "start": 1,
+            "end": 2
+        },
+        "lunch": {
+            "start":2,
+            "end":3
+        },
+        "dinner": {
+            "start": 3,
+            "end": 4
+        }
+    }
+
+    if "schedule" not in data:
+        data["schedule"] = mock_schedule
+
+    if "themed" not in data:
+        data["themed"] = []
+    return data
+
+
+def _wait_for_other_instance(location: str, meal: int, date: str) -> dict:
+    'Poll firebase for a menu another instance holds the build lease for. None if it doesn\'t show up in time.'
+    deadline = time.monotonic() + BUILD_LEASE_TTL
+    while time.monotonic() < deadline:
+        time.sleep(BUILD_LEASE_POLL)
+        db_data = get_menu_body(location, meal, date, join=False)
+        if db_data is not None:
+            return db_data
+    print("Gave up waiting for another instance to build the menu")
+    return None
+
+
+def _build_entry(key: tuple, location: str, meal: int, date: str, do_refresh: bool = False) -> Tuple[CacheEntry, bool]:
+    """
+    Load the data and put it in the in-memory cache, once per key at a time: callers that come in while it's
+    being built wait for that build. Also returns whether the entry came from another caller's build.
+    """
+    flight_key = key + ('refresh',) if do_refresh else key
+    entry, shared = IN_FLIGHT.do(flight_key, lambda: _store(key, *_load_and_serialize(location, meal, date, do_refresh)))
+    if shared:
+        tracing.annotate(coalesced=True)
+    return entry, shared
+
+
+def _store(key: tuple, data: dict, body: bytes) -> CacheEntry:
+    'Put a body in the in-memory cache until it expires (capped at the cache\'s own ttl unless its meal is over)'
+    remaining = get_seconds_until_expiry(data)
+    ttl = PAST_MAX_AGE if remaining is None else max(MEMORY_MIN_TTL, min(RESPONSE_CACHE.ttl, remaining))
+    try:
+        SEARCH_INDEX.update(key[0], key[1], data['date'], data['all'])  # so search sees menus as soon as we have them
+    except Exception:
+        traceback.print_exc()
+    return RESPONSE_CACHE.set(key, data, body, ttl=ttl)
+
+
+def _load_and_serialize(location: str, meal: int, date: str, do_refresh: bool) -> Tuple[dict, bytes]:
+    data = _load_data(location, meal, date, do_refresh)
+    return data, _serialize(data)
+
+
+def _revalidate(key: tuple, location: str, meal: int, date: str) -> None:
+    'Rebuild a stale in-memory cache entry in the background'
+    try:
+        _build_entry(key, location, meal, date)
+    except Exception:
+        RESPONSE_CACHE.end_revalidate(key)
+        traceback.print_exc()
+
+
+def _get_cached(key: tuple, location: str, meal: int, date: str) -> Tuple[CacheEntry, str]:
+    'The in-memory cache entry and its state (fresh, stale or miss). Stale entries get refreshed in the background'
+    with tracing.phase('cache'):
+        entry, state = RESPONSE_CACHE.get(key)
+    if state == 'stale' and RESPONSE_CACHE.begin_revalidate(key):
+        _revalidate_executor.submit(_revalidate, key, location, meal, date)
+    return entry, state
+
+
+def get_response(location: str, meal: int, date: str, do_refresh: bool = False) -> Tuple[CacheEntry, str]:
+    """
+    Get the cached response for the location, meal and date, building it if needed.
+    Stale entries get served right away and refreshed in the background.
+    Also returns how the in-memory cache did: 'fresh', 'stale', 'miss', 'coalesced' (a miss that waited
+    for a build that was already running) or 'refresh'.
+    """
+    key = _cache_key(location, meal, date)
+    state = 'refresh'
+    if not do_refresh:
+        entry, state = _get_cached(key, location, meal, date)
+        if state in ('fresh', 'stale'):
+            return entry, state
+
+    entry, shared = _build_entry(key, location, meal, date, do_refresh)
+    if shared and state == 'miss':
+        state = 'coalesced'
+    return entry, state
+
+
+def get_partial_data(location: str, meal: int, date: str, fields: dict) -> dict:
+    """
+    Get the data for a fields= request without building anything it didn't ask for. If the menu ("all") is wanted
+    it's the full response, same as without fields. Otherwise, in order of preference: the in-memory cache (stale entries
+    get refreshed in the background, like in get_response), the Firebase node without its dishes joined in if it isn't
+    expired, and only the requested sections from campusdish.
+    """
+    key = _cache_key(location, meal, date)
+    if "all" in fields:
+        return get_response(location, meal, date)[0].data
+    entry, state = _get_cached(key, location, meal, date)
+    if state != 'miss':
+        return entry.data
+    if USE_CACHE:
+        with tracing.phase('cache'):
+            db_data = get_menu_body(location, meal, date, join=False)  # the same node _load_data reads
+        if db_data is not None and not is_expired(db_data):
+            return _fill_defaults({section: value for section, value in db_data.items() if section != "dishRefs"})
+    return make_partial_body(*key, sections=tuple(fields))
+
+
+def _read_cached_for_search(location: str, meal: int, date: str) -> dict:
+    'A body from the Firebase cache for the search index to start from, if there\'s one that isn\'t expired'
+    keys = (date, None) if date == get_irvine_date() else (date,)  # today can be cached under the key without a date too
+    for key in keys:
+        node = get_menu_body(location, meal, key, join=False)
+        if node is not None and not is_expired(node):
+            return join_menu_body(node)
+    return None
+
+
+def get_search_response(query: dict) -> dict:
+    """
+    Search the menus of the next few days. search: words that have to be in the dish name, description or station
+    (* for every dish). Optional filters: location, meal (id), date (mm/dd/yyyy), flags (comma separated, like isVegan,isEatWell),
+    and nutrition ranges like maxCalories=500 or minProtein=20. limit caps the number of results.
+    Until the index's first refresh is done, the results only cover what's indexed so far ("complete": false),
+    and it's a 503 if nothing is.
+    """
+    location = query.get("location", [None])[0]
+    if location is not None and not is_valid_location(location):
+        raise InvalidQueryException(f"The location specified is not valid. Valid locations: {list(LOCATION_INFO.keys())}")
+    flags = [flag for flag in query.get("flags", [""])[0].split(",") if flag]
+    if any(flag not in FLAGS for flag in flags):
+        raise InvalidQueryException(f"Valid flags: {list(FLAGS)}")
+    try:
+        meal = int(query["meal"][0]) if "meal" in query else None
+        limit = int(query["limit"][0]) if "limit" in query else None
+        ranges = parse_ranges(query)
+    except ValueError:
+        raise InvalidQueryException("meal, limit and nutrition ranges have to be numbers")
+
+    ready = ensure_refreshing(wait=SEARCH_WARMUP_TIMEOUT, read_cached=_read_cached_for_search if USE_CACHE else None)
+    if not ready and SEARCH_INDEX.stats()["menus"] == 0:
+        raise UnavailableException("The search index is still being built")
+    results = SEARCH_INDEX.search(
+        query["search"][0], location=location, meal=meal, date=query.get("date", [None])[0], flags=flags, ranges=ranges,
+        **({"limit": limit} if limit is not None else {}),
+    )
+    return {"results": results, "count": len(results), "complete": ready, "index": SEARCH_INDEX.stats()}
+
+
+def get_nutrition_response(query: dict) -> dict:
+    """
+    Nutrition reports over the nutrition archive and everything in the Firebase cache. nutrition: station-weekly (column=Calories, ...),
+    protein-per-calorie (top=20) or high-sodium (threshold=1000, in mg). All of them take location, since and until (mm/dd/yyyy).
+    The store is rebuilt in the background, so reports can be up to NUTRITION_STORE_TTL behind the cache, and it's a 503
+    until the first build is done if there's no archive.
+    """
+    if not USE_CACHE:
+        raise InvalidQueryException("Nutrition reports need the Firebase cache, which is turned off")
+    from . import nutrition  # numpy is only loaded by the instances that get asked for reports
+
+    report = query["nutrition"][0]
+    if report not in nutrition.REPORTS:
+        raise InvalidQueryException(f"Valid nutrition reports: {list(nutrition.REPORTS)}")
+    filters = {param: query[param][0] for param in ("location", "since", "until") if param in query}
+    try:
+        for param in ("since", "until"):
+            if param in filters:
+                datetime.strptime(filters[param], "%m/%d/%Y")
+        if report == "station-weekly":
+            column = query.get("column", ["Calories"])[0]
+            if column not in nutrition.NUMERIC_NUTRITION:
+                raise InvalidQueryException(f"Valid columns: {list(nutrition.NUMERIC_NUTRITION)}")
+            args = (column,)
+        elif report == "protein-per-calorie":
+            top = int(query.get("top", [20])[0])
+            if top <= 0:
+                raise InvalidQueryException("top has to be at least 1")
+            args = (top,)
+        else:
+            args = (float(query.get("threshold", [nutrition.SODIUM_ALERT_MG])[0]),)
+    except ValueError:
+        raise InvalidQueryException("top and threshold have to be numbers, and since and until dates formatted like mm/dd/yyyy")
+
+    store = nutrition.get_cached_store()
+    if store is None:
+        raise UnavailableException("The nutrition store is still being built")
+    return {"report": report, "results": nutrition.REPORTS[report](store, *args, **filters), "store": store.summary()}
+
+
+def is_range_query(query: dict) -> bool:
+    return query.get("location") == ["all"] or any(param in query for param in ("meals", "start", "end"))
+
+
+def parse_query_date(value: str, name: str = "date") -> datetime:
+    'Dates in the query have to be formatted like mm/dd/yyyy, anything else never gets near the caches or the search index'
+    try:
+        return datetime.strptime(value, "%m/%d/%Y")
+    except ValueError:
+        raise InvalidQueryException(f"{name} must be formatted like mm/dd/yyyy")
+
+
+def parse_range_query(query: dict) -> list:
+    """
+    Turn the query parameters of a range request into the (location, meal, date) entries it asks for.
+    location: a location or "all". meals: "all" or comma separated meal ids, defaults to the meal parameter or the current meal.
+    Meals are left out on the days they aren't served (brunch on weekdays, lunch on weekends).
+    start/end: mm/dd/yyyy, inclusive, defaults to today.
+    """
+    location = query.get("location", ["all"])[0]
+    if location == "all":
+        locations = list(LOCATION_INFO)
+    elif is_valid_location(location):
+        locations = [location]
+    else:
+        raise InvalidQueryException(
+            f"The location specified is not valid. Valid locations: {list(LOCATION_INFO.keys()) + ['all']}"
+        )
+
+    meals = query.get("meals", query.get("meal", [None]))[0]
+    if meals not in (None, "all"):
+        try:
+            meals = [int(meal) for meal in meals.split(",")]
+        except ValueError:
+            raise InvalidQueryException("meals must be \"all\" or comma separated meal ids")
+        if any(meal not in MEAL_TO_PERIOD for meal in meals):
+            raise InvalidQueryException(f"Valid meal ids: {list(MEAL_TO_PERIOD.keys())}")
+
+    if "start" not in query and "end" not in query:
+        if meals is None:
+            meals = [get_current_meal()]
+        dates = [None]  # today, with the same cache key as requests without a date
+    else:
+        start = parse_query_date(query.get("start", query.get("end"))[0], "start and end")
+        end = parse_query_date(query.get("end", query.get("start"))[0], "start and end")
+        if end < start:
+            raise InvalidQueryException("end can't be before start")
+        if (end - start).days >= RANGE_MAX_DAYS:
+            raise InvalidQueryException(f"Ranges can be at most {RANGE_MAX_DAYS} days long")
+        dates = [(start + timedelta(days=i)).strftime("%m/%d/%Y") for i in range((end - start).days + 1)]
+        if meals is None:
+            meals = "all"
+
+    entries = []
+    for date in dates:
+        weekday = datetime.strptime(date or get_irvine_date(), "%m/%d/%Y").weekday()
+        served = get_meals_for_weekday(weekday)
+        for meal in (served if meals == "all" else [meal for meal in meals if meal in served]):
+            for location in locations:
+                entries.append((location, meal, date))
+    return entries
+
+
+def get_range_response(entries: list, fields: dict = None) -> dict:
+    """
+    Get the responses for all the (location, meal, date) entries at the same time (using the same caches as single requests),
+    combined into {"menus": {location: {date: {meal name: response}}}}. With fields, each response only has those fields.
+    """
+    if fields is None:
+        get_data = lambda entry: get_response(*entry)[0].data
+    else:
+        get_data = lambda entry: get_partial_data(*entry, fields)
+    entries_and_responses = zip(entries, _range_executor.map(tracing.bind(get_data), entries))
+    menus = {}
+    for (location, meal, date), data in entries_and_responses:
+        menus.setdefault(location, {}).setdefault(date or data.get("date") or get_irvine_date(), {})[MEAL_TO_PERIOD[meal][1]] = (
+            data if fields is None else project(data, fields)
+        )
+    return {"menus": menus}
+
+
 class handler(BaseHTTPRequestHandler):
 
     def do_GET(self):
@@ -37,6 +420,9 @@ class handler(BaseHTTPRequestHandler):
         Receive HTTP request and send response
         """
 
+        location = meal = cache_state = None
+        self.pinned = True  # whether the url names the meal and date, see get_client_max_age
+        trace_token = tracing.start()
         try:
             _protocol, _url, path, params, raw_query, _ = urllib.parse.urlparse(
                 "//" + self.path # prepending the // tricks urlparse into parsing correctly since self.path isn't the whole URL
@@ -46,17 +432,42 @@ class handler(BaseHTTPRequestHandler):
         
             if path not in ("/api", "/api/"):
                 raise NotFoundException
+            if "cachestats" in query:
+                stats = RESPONSE_CACHE.stats()
+                stats.update(coalesced=IN_FLIGHT.coalesced, inFlight=IN_FLIGHT.in_flight())
+                self.send_json_response(stats, query)
+                return
+            if "metrics" in query:
+                self.send_json_response(tracing.METRICS.snapshot(), query)
+                return
+
             if USE_CACHE:
                 if "analytics" in query:
                     db_ref = get_Analytics()
                     db_data = db_ref.get()
-                    self.send_response_with_body(
-                        status_code=200,
-                        body=json.dumps(db_data, ensure_ascii=False, indent=4),
-                    )
+                    self.send_json_response(db_data, query)
                     return
 
 
+            if "nutrition" in query:
+                self.send_json_response(get_nutrition_response(query), query)
+                return
+
+            if "search" in query:
+                self.send_json_response(get_search_response(query), query)
+                return
+
+            fields = None
+            if "fields" in query:
+                try:
+                    fields = parse_fields(query["fields"][0])
+                except ValueError as e:
+                    raise InvalidQueryException(e)
+
+            if is_range_query(query):
+                self.send_json_response(get_range_response(parse_range_query(query), fields), query)
+                return
+
             if "location" not in query:
                 raise InvalidQueryException("No location query parameter specified")
 
@@ -72,6 +483,8 @@ class handler(BaseHTTPRequestHandler):
 
             date = query["date"][0] if "date" in query else None
              # note: data gets decoded by urllib, so it will contain slashes.
+            if date is not None:
+                parse_query_date(date)
             do_refresh = dict.get(query, 'refresh', [False])[0]
 
             if meal is None and date is not None:
@@ -79,46 +492,24 @@ class handler(BaseHTTPRequestHandler):
                     "You can't provide the date without the meal."
                 )
 
-            if USE_CACHE:
-                print(f"date from query params: {date}")
-                db_ref = get_db_reference(location, meal, date)
-                db_data = db_ref.get()
-                updateAnalytics()
-
-                if db_data is None or do_refresh=='True':
-                    data = make_response_body(location, meal, date)
-                    db_ref.set(data)
-
-                else:
-                    data = db_data 
-
-                mock_schedule = {
-                    "breakfast": {
-                        "start": 1,
-                        "end": 2
-                    },
-                    "lunch": {
-                        "start":2,
-                        "end":3
-                    },
-                    "dinner": {
-                        "start": 3,
-                        "end": 4
-                    }
-                }
-                
-                if "schedule" not in data:
-                    data["schedule"] = mock_schedule
-                
-                if "themed" not in data:
-                    data["themed"] = []
-            else:
-                data = make_response_body(location, meal, date)
+            if fields is not None and do_refresh != 'True':
+                # only the requested sections get built and sent, so there's no cached body to reuse
+                self.send_json_response(project(get_partial_data(location, meal, date, fields), fields), query)
+                return
 
-            self.send_response_with_body(
-                status_code=200,
-                body=json.dumps(data, ensure_ascii=False, indent=4),
-            )
+            self.pinned = meal is not None and date is not None
+            entry, cache_state = get_response(location, meal, date, do_refresh=='True')
+            tracing.annotate(cache=cache_state)
+
+            if fields is not None:
+                self.send_json_response(project(entry.data, fields), query)
+                return
+
+            if self.is_not_modified(entry):
+                self.send_not_modified(entry)
+                return
+
+            self.send_json_response(entry.data, query, entry)
 
         except NotFoundException:
             self.send_response_with_body(
@@ -132,27 +523,144 @@ class handler(BaseHTTPRequestHandler):
                 body=f"Invalid query parameters. Details: {e}",
             )
 
+        except UnavailableException as e:
+            self.send_response_with_body(
+                status_code=503,
+                body=f"Not ready yet, retry in a few seconds. Details: {e}",
+                headers={"Retry-After": "5"},
+            )
+
         except Exception as e:
-            if USE_CACHE:
-                updateAnalytics(error=True)
             traceback.print_exc()
             self.send_response_with_body(
                 status_code=500,
                 body=f"Internal Server Error. Raise an issue on the github repo: https://github.com/EricPedley/zotmeal-backend. Details: {e}",
             )
 
-    def send_response_with_body(self, status_code: int, body: Union[str, dict]) -> None:
+        finally:
+            if USE_CACHE:
+                # only buffered here, every request counts (range, search, nutrition...) but only valid locations get a per-location count
+                with tracing.phase('analytics'):
+                    ANALYTICS.record_request(
+                        location if location is not None and is_valid_location(location) else None,
+                        meal, getattr(self, "last_status_code", 500), cache_state,
+                    )
+            if trace_token is not None:
+                tracing.annotate(path=self.path, status=getattr(self, "last_status_code", 500), cache=cache_state)
+                tracing.finish(trace_token)
+            if USE_CACHE and not ANALYTICS.background:
+                self.flush_analytics()
+
+    def flush_analytics(self) -> None:
+        '''
+        Without a flush thread (on vercel) the counts get written here, after the response has been sent:
+        the response is flushed to the client first so it never waits on the analytics transaction.
+        '''
+        try:
+            self.wfile.flush()
+        except OSError:
+            pass
+        ANALYTICS.flush()
+
+    def send_json_response(self, data: dict, query: dict, entry: CacheEntry = None) -> None:
+        """
+        Send data as JSON with a 200. Compact unless the query has pretty=1, and compressed if the client accepts gzip or br.
+        If the data came from the cache, pass its entry so the serialized and compressed bodies get reused.
+        """
+        pretty = query.get("pretty", ["0"])[0] not in ("0", "false", "False")
+        if pretty or entry is None:
+            body = _serialize(data, pretty)
+            entry = None  # only the compact body is cached
+        else:
+            body = entry.body
+
+        headers = {"Vary": "Accept-Encoding"}
+        encoding = self.choose_response_encoding(body)
+        if entry is not None:
+            headers.update(self.validator_headers(entry, encoding))
+        if encoding is not None:
+            if entry is not None:
+                if encoding not in entry.encodings:
+                    with tracing.phase('compress'):
+                        entry.encodings[encoding] = compress(body, encoding)
+                body = entry.encodings[encoding]
+            else:
+                with tracing.phase('compress'):
+                    body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+
+        self.send_response_with_body(200, body, headers)
+
+    def choose_response_encoding(self, body: bytes) -> str:
+        'The Content-Encoding to send the body with (None for as-is). Small bodies aren\'t compressed unless the client refuses identity'
+        accept_encoding = self.headers.get("Accept-Encoding")
+        encoding = choose_encoding(accept_encoding)
+        if encoding is not None and len(body) < MIN_COMPRESS_SIZE and accepts_identity(accept_encoding):
+            return None
+        return encoding
+
+    def validator_headers(self, entry: CacheEntry, encoding: str = None) -> dict:
+        """
+        ETag/Last-Modified/Cache-Control for a cached response. The ETag is weak since it's a hash of the content,
+        and the same content can be sent pretty-printed. Compressed bodies get the encoding added to it
+        (W/"<hash>-gzip"), so caches that key on the ETag never mix up the encodings.
+        """
+        return {
+            "ETag": f'W/"{entry.etag}-{encoding}"' if encoding else f'W/"{entry.etag}"',
+            "Last-Modified": formatdate(entry.last_modified, usegmt=True),
+            "Cache-Control": f"public, max-age={get_client_max_age(entry.data, self.pinned)}",
+        }
+
+    def is_not_modified(self, entry: CacheEntry) -> bool:
+        """
+        True if the client's If-None-Match (or, without one, If-Modified-Since) says it already has this content.
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or any(tag in tags for tag in [f'"{entry.etag}"'] + [f'"{entry.etag}-{encoding}"' for encoding in supported_encodings()])
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                return int(entry.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_not_modified(self, entry: CacheEntry) -> None:
+        self.last_status_code = 304
+        self.send_response(304)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_server_timing()
+        self.send_header("Vary", "Accept-Encoding")
+        for name, value in self.validator_headers(entry, self.choose_response_encoding(entry.body)).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def send_server_timing(self) -> None:
+        'Add the Server-Timing header when the request is being traced'
+        server_timing = tracing.server_timing()
+        if server_timing is not None:
+            self.send_header("Server-Timing", server_timing)
+
+    def send_response_with_body(self, status_code: int, body: Union[str, bytes, dict], headers: dict = None) -> None:
         """
-        Send an HTTP response with the given status code and body. Supports plaintext string or dict to be serialized as json.
+        Send an HTTP response with the given status code and body. Supports plaintext string (or already encoded bytes) or dict to be serialized as json.
         """
 
+        self.last_status_code = status_code
         self.send_response(status_code)
-        if type(body) == str:
+        if type(body) in (str, bytes):
+            if type(body) == str:
+                body = body.encode()
             self.send_header("Content-type", "text/plain")
             self.send_header("Access-Control-Allow-Origin", "*") # this lets the browser know it's okay to make a cross origin request from any origin.
-            self.end_headers()
-            self.wfile.write(body.encode())
         else:
+            body = json.dumps(body).encode()
             self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dump(body))
\ No newline at end of file
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_server_timing()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
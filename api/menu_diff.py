@@ -0,0 +1,103 @@
+'''
+Compares a freshly built menu against the cached one, so refreshes only write what changed and leave a change log.
+
+diff_paths gives the Firebase paths (relative to the menu node) whose values changed, for a multi-path update.
+describe_changes gives what changed for people: dishes added to, removed from or changed at a station,
+and stations that appeared or went away.
+'''
+import time
+
+from .util import get_irvine_time, EMPTY_MENU_OBJECT, MENU_DATA_ERROR_OBJECT
+
+
+def _is_empty(value) -> bool:
+    'Firebase doesn\'t store None or empty lists and dicts, so they all read back as missing'
+    return value is None or value == [] or value == {}
+
+
+def _as_dict(value) -> dict:
+    'Firebase stores lists as nodes with keys 0, 1, 2..., so lists are compared the same way'
+    if isinstance(value, list):
+        return {str(i): child for i, child in enumerate(value)}
+    return {str(key): child for key, child in value.items()}
+
+
+def diff_paths(old, new, path: str = '') -> dict:
+    '''
+    {path: new value} for every part of new that's different from old (None for parts that were removed).
+    The paths never overlap, so they can all go in one multi-path update.
+    '''
+    if _is_empty(new):
+        return {} if _is_empty(old) else {path: None}
+    if isinstance(new, (dict, list)) and isinstance(old, (dict, list)):
+        old_children, new_children = _as_dict(old), _as_dict(new)
+        changes = {}
+        for key in old_children.keys() | new_children.keys():
+            changes.update(diff_paths(old_children.get(key), new_children.get(key), f"{path}/{key}" if path else key))
+        return changes
+    if old != new:
+        return {path: new}
+    return {}
+
+
+def same_shape(old: dict, new: dict) -> bool:
+    '''
+    Whether two nodes have the same top level fields (and are both packed or both not, see dish_table.py),
+    so writing diff_paths(old, new) on top of old gives a complete node
+    '''
+    def fields(node):
+        return {key for key, value in node.items() if not _is_empty(value)}
+    return fields(old) == fields(new) and bool(old.get('dishRefs')) == bool(new.get('dishRefs'))
+
+
+def _items_by_station(body: dict) -> dict:
+    'station name -> (category, dish name) -> dish'
+    stations = {}
+    for station in body.get('all') or []:
+        items = stations.setdefault(station['station'], {})
+        for category in station.get('menu') or []:
+            for dish in category.get('items') or []:
+                items[(category['category'], dish.get('name'))] = dish
+    return stations
+
+
+def _change(change: str, now: float, station: str, category: str = None, item: str = None) -> dict:
+    clock = time.strftime('%H:%M', get_irvine_time(now))
+    if item is None:
+        message = f"{station} {'opened' if change == 'stationAdded' else 'closed'} at {clock}"
+    else:
+        message = f"{item} {change} {'to' if change == 'added' else 'at' if change == 'changed' else 'from'} {station} at {clock}"
+    record = {'time': int(now), 'change': change, 'station': station, 'message': message}
+    if item is not None:
+        record.update(category=category, item=item)
+    return record
+
+
+def describe_changes(old_body: dict, new_body: dict, now: float = None) -> list:
+    '''
+    What changed between two response bodies, as records like
+    {"time": ..., "change": "added", "station": "Grubb / Mainline", "category": ..., "item": "Pizza", "message": "Pizza added to Grubb / Mainline at 10:42"}.
+    change is added, removed or changed (same name, different details) for dishes, and stationAdded or stationRemoved for stations.
+    Nothing is reported when either menu is an error or empty placeholder.
+    '''
+    placeholders = (MENU_DATA_ERROR_OBJECT, EMPTY_MENU_OBJECT)
+    if old_body is None or old_body.get('all') in placeholders or new_body.get('all') in placeholders:
+        return []
+    now = now or time.time()
+    old_stations, new_stations = _items_by_station(old_body), _items_by_station(new_body)
+    changes = []
+    for station, new_items in new_stations.items():
+        old_items = old_stations.get(station)
+        if old_items is None:
+            changes.append(_change('stationAdded', now, station))
+            continue
+        for key, dish in new_items.items():
+            if key not in old_items:
+                changes.append(_change('added', now, station, *key))
+            elif diff_paths(old_items[key], dish):
+                changes.append(_change('changed', now, station, *key))
+        for key in old_items.keys() - new_items.keys():
+            changes.append(_change('removed', now, station, *key))
+    for station in old_stations.keys() - new_stations.keys():
+        changes.append(_change('stationRemoved', now, station))
+    return changes
@@ -0,0 +1,390 @@
+'''
+Nutrition analytics over menu history.
+
+NutritionStore holds one row per dish served (a dish on one location's menu for one meal on one day), stored as
+NumPy columns: one float column per nutrition value (NaN where campusdish didn't have it), one bool column per
+dietary flag, and integer-coded location/station/dish/meal/date keys. The reports group and filter those columns
+with vectorized operations, so they stay fast on years of menus. Stores can be saved to and loaded from .npz files.
+
+The Firebase cache only keeps CACHE_RETENTION_DAYS of menus (see sweeper.py), so the history lives in an archive:
+`build` adds what's in the cache to the NUTRITION_ARCHIVE file, and the api reports over the archive plus the cache.
+Run it from cron more often than the retention period (before the sweeper) so no days get lost.
+
+Build the archive from the Firebase cache (or from `weekMenu.py --format ndjson` exports) and run reports from the command line:
+    python -m api.nutrition build --output nutrition.npz
+    python -m api.nutrition report station-weekly --input nutrition.npz --column Calories
+    python -m api.nutrition report high-sodium --ndjson week.ndjson --threshold 1200
+'''
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import date as Date, datetime, timedelta
+
+import numpy as np
+
+from .search import NUMERIC_NUTRITION, FLAGS
+from .util import LOCATION_INFO, MEAL_TO_PERIOD, EMPTY_MENU_OBJECT, MENU_DATA_ERROR_OBJECT
+
+SODIUM_ALERT_MG = 1000
+# seconds the api reuses a store built from the Firebase cache before building a new one
+NUTRITION_STORE_TTL = float(os.getenv("NUTRITION_STORE_TTL", 60 * 60))
+# store saved by `build`, with the menus from before the cache's retention period
+NUTRITION_ARCHIVE = os.getenv("NUTRITION_ARCHIVE", "nutrition.npz")
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _to_number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class _Codes:
+    'Interns strings as small ints, so keys can be stored in integer columns'
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.codes = {name: i for i, name in enumerate(self.names)}
+
+    def code(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+class NutritionStore:
+
+    KEY_COLUMNS = ('location', 'station', 'dish', 'meal', 'date')
+
+    def __init__(self, columns: dict, locations: list, stations: list, dishes: list):
+        self.columns = columns  # column name -> numpy array, all the same length
+        self.locations = locations  # location code -> name
+        self.stations = stations
+        self.dishes = dishes
+
+    def __len__(self) -> int:
+        return len(self.columns['date'])
+
+    @classmethod
+    def from_bodies(cls, bodies) -> 'NutritionStore':
+        '''
+        Build a store from (location, meal id, response body) tuples.
+        Bodies whose menu failed to load, or was empty, add no rows.
+        '''
+        locations, stations, dishes = _Codes(), _Codes(), _Codes()
+        keys = {name: [] for name in cls.KEY_COLUMNS}
+        numbers = {name: [] for name in NUMERIC_NUTRITION}
+        flags = {flag: [] for flag in FLAGS}
+
+        for location, meal, body in bodies:
+            menu = body.get('all') or []
+            if menu in (MENU_DATA_ERROR_OBJECT, EMPTY_MENU_OBJECT):
+                continue
+            day = (datetime.strptime(body['date'], '%m/%d/%Y').date() - Date(1970, 1, 1)).days
+            location_code = locations.code(location)
+            for station in menu:
+                station_code = stations.code(station['station'])
+                for category in station.get('menu') or []:
+                    for dish in category.get('items') or []:
+                        nutrition = dish.get('nutrition') or {}
+                        keys['location'].append(location_code)
+                        keys['station'].append(station_code)
+                        keys['dish'].append(dishes.code(dish['name']))
+                        keys['meal'].append(int(meal))
+                        keys['date'].append(day)
+                        for name, key in NUMERIC_NUTRITION.items():
+                            numbers[name].append(_to_number(nutrition.get(key)))
+                        for flag in FLAGS:
+                            flags[flag].append(bool(nutrition.get(flag)))
+
+        columns = {
+            'location': np.array(keys['location'], dtype=np.int32),
+            'station': np.array(keys['station'], dtype=np.int32),
+            'dish': np.array(keys['dish'], dtype=np.int32),
+            'meal': np.array(keys['meal'], dtype=np.int16),
+            'date': _EPOCH + np.array(keys['date'], dtype=np.int64),
+        }
+        columns.update({name: np.array(values, dtype=np.float64) for name, values in numbers.items()})
+        columns.update({flag: np.array(values, dtype=bool) for flag, values in flags.items()})
+        return cls(columns, locations.names, stations.names, dishes.names)
+
+    def _menu_keys(self, columns: dict = None) -> np.ndarray:
+        'One int64 per row for its (location, meal, date)'
+        columns = columns or self.columns
+        days = (columns['date'] - _EPOCH).astype(np.int64)
+        return ((columns['location'].astype(np.int64) << 8) + columns['meal']) << 32 | days
+
+    def merge(self, newer: 'NutritionStore') -> 'NutritionStore':
+        'A store with the rows of both. Menus (location, meal and date) that are in both come from newer'
+        locations, stations, dishes = _Codes(self.locations), _Codes(self.stations), _Codes(self.dishes)
+        remapped = dict(newer.columns)
+        for column, codes, names in (('location', locations, newer.locations), ('station', stations, newer.stations), ('dish', dishes, newer.dishes)):
+            mapping = np.array([codes.code(name) for name in names], dtype=np.int32)
+            remapped[column] = mapping[newer.columns[column]]
+        keep = ~np.isin(self._menu_keys(), self._menu_keys(remapped))
+        columns = {name: np.concatenate([self.columns[name][keep], remapped[name]]) for name in self.columns}
+        return NutritionStore(columns, locations.names, stations.names, dishes.names)
+
+    def save(self, path) -> None:
+        np.savez_compressed(
+            path,
+            _locations=np.array(self.locations, dtype=str),
+            _stations=np.array(self.stations, dtype=str),
+            _dishes=np.array(self.dishes, dtype=str),
+            **self.columns,
+        )
+
+    @classmethod
+    def load(cls, path) -> 'NutritionStore':
+        with np.load(path) as saved:
+            columns = {name: saved[name] for name in saved.files if not name.startswith('_')}
+            return cls(columns, saved['_locations'].tolist(), saved['_stations'].tolist(), saved['_dishes'].tolist())
+
+    def _mask(self, location: str = None, since: str = None, until: str = None) -> np.ndarray:
+        'Rows for the location (if given) between since and until (mm/dd/yyyy, inclusive, if given)'
+        mask = np.ones(len(self), dtype=bool)
+        if location is not None:
+            if location not in self.locations:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.columns['location'] == self.locations.index(location)
+        if since is not None:
+            mask &= self.columns['date'] >= np.datetime64(datetime.strptime(since, '%m/%d/%Y').date(), 'D')
+        if until is not None:
+            mask &= self.columns['date'] <= np.datetime64(datetime.strptime(until, '%m/%d/%Y').date(), 'D')
+        return mask
+
+    def station_weekly_average(self, column: str = 'Calories', location: str = None, since: str = None, until: str = None) -> list:
+        '''
+        Average of a nutrition value per location, station and week (weeks start on monday),
+        over the dishes that have the value.
+        '''
+        values = self.columns[column]
+        mask = self._mask(location, since, until) & ~np.isnan(values)
+        days = (self.columns['date'][mask] - _EPOCH).astype(np.int64)
+        if not len(days):
+            return []
+        weeks = (days + 3) // 7  # weeks since the monday before 1970-01-01 (a thursday)
+        first_week = weeks.min()
+        week_count = int(weeks.max() - first_week) + 1
+        # one int64 per (location, station, week), so grouping is a 1-d unique instead of a row-wise one
+        groups = (self.columns['location'][mask].astype(np.int64) * len(self.stations) + self.columns['station'][mask]) * week_count + (weeks - first_week)
+        unique, inverse = np.unique(groups, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique))
+        means = np.bincount(inverse, weights=values[mask], minlength=len(unique)) / counts
+        location_station, week_offsets = np.divmod(unique, week_count)
+        location_codes, station_codes = np.divmod(location_station, len(self.stations))
+        week_starts = (week_offsets + first_week) * 7 - 3
+        return [
+            {
+                'location': self.locations[location_code],
+                'station': self.stations[station_code],
+                'week': _format_day(week_start),
+                'average': round(float(mean), 2),
+                'dishes': int(count),
+            }
+            for location_code, station_code, week_start, mean, count in zip(location_codes.tolist(), station_codes.tolist(), week_starts.tolist(), means.tolist(), counts.tolist())
+        ]
+
+    def protein_per_calorie(self, top: int = 20, min_calories: float = 50, location: str = None, since: str = None, until: str = None) -> list:
+        'Dishes with the most grams of protein per calorie (averaged over every time they were served)'
+        calories, protein = self.columns['Calories'], self.columns['Protein']
+        mask = self._mask(location, since, until) & ~np.isnan(calories) & ~np.isnan(protein) & (calories >= min_calories)
+        dishes = self.columns['dish'][mask]
+        if not len(dishes):
+            return []
+        size = len(self.dishes)
+        served = np.bincount(dishes, minlength=size)
+        average_calories = np.bincount(dishes, weights=calories[mask], minlength=size)
+        average_protein = np.bincount(dishes, weights=protein[mask], minlength=size)
+        seen = served > 0
+        average_calories[seen] /= served[seen]
+        average_protein[seen] /= served[seen]
+        ratio = np.full(size, -np.inf)
+        ratio[seen] = average_protein[seen] / average_calories[seen]
+        best = np.argsort(-ratio, kind='stable')[:min(top, int(seen.sum()))]
+        return [
+            {
+                'dish': self.dishes[code],
+                'proteinPerCalorie': round(float(ratio[code]), 4),
+                'protein': round(float(average_protein[code]), 2),
+                'calories': round(float(average_calories[code]), 2),
+                'timesServed': int(served[code]),
+            }
+            for code in best.tolist()
+        ]
+
+    def high_sodium(self, threshold: float = SODIUM_ALERT_MG, location: str = None, since: str = None, until: str = None) -> list:
+        'Every serving of a dish with at least `threshold` mg of sodium, saltiest first'
+        sodium = self.columns['Sodium']
+        rows = np.flatnonzero(self._mask(location, since, until) & (sodium >= threshold))
+        rows = rows[np.argsort(-sodium[rows], kind='stable')]
+        return [
+            {
+                'location': self.locations[self.columns['location'][row]],
+                'date': _format_day(int((self.columns['date'][row] - _EPOCH).astype(np.int64))),
+                'meal': MEAL_TO_PERIOD[int(self.columns['meal'][row])][1],
+                'station': self.stations[self.columns['station'][row]],
+                'dish': self.dishes[self.columns['dish'][row]],
+                'sodium': float(sodium[row]),
+            }
+            for row in rows.tolist()
+        ]
+
+    def summary(self) -> dict:
+        dates = self.columns['date']
+        return {
+            'rows': len(self),
+            'dishes': len(self.dishes),
+            'stations': len(self.stations),
+            'locations': self.locations,
+            'from': _format_day(int((dates.min() - _EPOCH).astype(np.int64))) if len(dates) else None,
+            'to': _format_day(int((dates.max() - _EPOCH).astype(np.int64))) if len(dates) else None,
+        }
+
+
+def _format_day(days_since_epoch: int) -> str:
+    return (Date(1970, 1, 1) + timedelta(days=int(days_since_epoch))).strftime('%m/%d/%Y')
+
+
+REPORTS = {
+    'station-weekly': NutritionStore.station_weekly_average,
+    'protein-per-calorie': NutritionStore.protein_per_calorie,
+    'high-sodium': NutritionStore.high_sodium,
+}
+
+
+def read_cached_bodies() -> list:
+    '''
+    Every (location, meal, body) in the Firebase cache, once per menu: today's menus can be cached under both
+    the padded and the unpadded date, and only the most recently refreshed one is used.
+    '''
+    from .firebase_utils import get_reference, get_children, join_menu_body
+
+    menus = {}
+    for location in LOCATION_INFO:
+        for meals in get_children(get_reference(location).get()).values():
+            for meal, node in get_children(meals).items():
+                body = join_menu_body(node) if isinstance(node, dict) else None
+                if body is None or 'date' not in body:
+                    continue
+                try:
+                    day = datetime.strptime(body['date'], '%m/%d/%Y').date()
+                except (TypeError, ValueError):
+                    continue  # left over from before the api checked dates, it isn't a real menu
+                key = (location, int(meal), day)
+                if key not in menus or body.get('refreshTime', 0) > menus[key][2].get('refreshTime', 0):
+                    menus[key] = (location, int(meal), body)
+    return list(menus.values())
+
+
+_store = None
+_store_built = 0
+_store_lock = threading.Lock()
+_builder = None  # the thread building the next store, if one is
+
+
+def load_archive(path: str = None):
+    'The store saved at path (defaults to NUTRITION_ARCHIVE), or None if there isn\'t one'
+    path = path or NUTRITION_ARCHIVE
+    if not path or not os.path.exists(path):
+        return None
+    return NutritionStore.load(path)
+
+
+def build_store() -> NutritionStore:
+    'The archive plus everything in the Firebase cache'
+    recent = NutritionStore.from_bodies(read_cached_bodies())
+    archive = load_archive()
+    return archive.merge(recent) if archive is not None else recent
+
+
+def get_cached_store():
+    '''
+    The last store built by build_store. It gets rebuilt in the background at most every NUTRITION_STORE_TTL seconds,
+    and until the first build is done it's the archive on its own, so requests never wait on reading the whole cache.
+    None if there's neither yet.
+    '''
+    global _store, _builder
+    with _store_lock:
+        if _store is None and _store_built == 0:
+            _store = load_archive()  # a local file, quick next to reading the cache
+        if _builder is None and (_store_built == 0 or time.monotonic() - _store_built > NUTRITION_STORE_TTL):
+            _builder = threading.Thread(target=_rebuild_store, name="nutrition-build", daemon=True)
+            _builder.start()
+        return _store
+
+
+def _rebuild_store() -> None:
+    global _store, _store_built, _builder
+    try:
+        store = build_store()
+        with _store_lock:
+            _store, _store_built = store, time.monotonic()
+    except Exception:
+        traceback.print_exc()  # the last store is kept, and the next request tries again
+    finally:
+        with _store_lock:
+            _builder = None
+
+
+def read_ndjson_bodies(path: str):
+    'Every (location, meal, body) in a weekMenu.py --format ndjson export'
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield row['location'], row['meal'], row['body']
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Nutrition analytics over menu history")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="add the Firebase cache (or an ndjson export) to the archive")
+    build.add_argument("--ndjson", help="read bodies from this export instead of Firebase")
+    build.add_argument("--output", "-o", default=NUTRITION_ARCHIVE)
+    build.add_argument("--replace", action="store_true", help="start a new archive instead of adding to the one at --output")
+
+    report = commands.add_parser("report", help="run a report")
+    report.add_argument("name", choices=list(REPORTS) + ["summary"])
+    report.add_argument("--input", help="a store saved by build (default: the archive plus the Firebase cache)")
+    report.add_argument("--ndjson", help="an ndjson export (used if there's no --input)")
+    report.add_argument("--location")
+    report.add_argument("--since", help="mm/dd/yyyy")
+    report.add_argument("--until", help="mm/dd/yyyy")
+    report.add_argument("--column", default="Calories", choices=list(NUMERIC_NUTRITION), help="for station-weekly")
+    report.add_argument("--top", type=int, default=20, help="for protein-per-calorie")
+    report.add_argument("--threshold", type=float, default=SODIUM_ALERT_MG, help="for high-sodium (mg)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        store = NutritionStore.from_bodies(read_ndjson_bodies(args.ndjson) if args.ndjson else read_cached_bodies())
+        archive = None if args.replace else load_archive(args.output)
+        if archive is not None:
+            store = archive.merge(store)
+        store.save(args.output)
+        print(json.dumps(store.summary(), indent=4))
+    else:
+        if args.input:
+            store = NutritionStore.load(args.input)
+        elif args.ndjson:
+            store = NutritionStore.from_bodies(read_ndjson_bodies(args.ndjson))
+        else:
+            store = build_store()
+        filters = {"location": args.location, "since": args.since, "until": args.until}
+        if args.name == "summary":
+            result = store.summary()
+        elif args.name == "station-weekly":
+            result = store.station_weekly_average(args.column, **filters)
+        elif args.name == "protein-per-calorie":
+            result = store.protein_per_calorie(args.top, **filters)
+        else:
+            result = store.high_sodium(args.threshold, **filters)
+        print(json.dumps(result, indent=4))
@@ -1,12 +1,25 @@
 import traceback
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os
 import time
+from datetime import datetime, timedelta
 
-from .util import read_schedule_UTC, get_current_meal, get_meal_name, get_irvine_date, get_name, NUTRITION_PROPERTIES, DEFAULT_PRICES, EMPTY_MENU_OBJECT, MENU_DATA_ERROR_OBJECT
+from .util import read_schedule_UTC, get_current_meal, get_meal_name, get_irvine_date, get_meals_for_weekday, get_name, NUTRITION_PROPERTIES, DEFAULT_PRICES, EMPTY_MENU_OBJECT, MENU_DATA_ERROR_OBJECT, EVENTS_PLACEHOLDER
 
-from .campusdish_interface import get_menu_data, get_schedule_data, get_themed_event_data
+from .campusdish_interface import get_menu_data, get_week_menu_data, split_menu_by_day, get_schedule_data, get_themed_event_data, get_location_page, get_default_schedule
 
-from .sorting import station_ordering_key
+from .sorting import get_station_sort_key
+from .projection import BODY_SECTIONS
+from . import tracing
+
+# When on, the menu call and the location page scrape run at the same time instead of one after another,
+# so a cache miss costs about as much as the slowest upstream call instead of the sum of them.
+CONCURRENT_FETCH = os.getenv("CONCURRENT_FETCH", "True") != "False"
+
+# How long make_response_body waits for each upstream branch before using that branch's fallback (seconds)
+UPSTREAM_CALL_TIMEOUT = float(os.getenv("UPSTREAM_CALL_TIMEOUT", 10))
+
+_fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("FETCH_WORKERS", 16)), thread_name_prefix="campusdish-fetch")
 
 
 def _lower_first_letter(s: str) -> str:
@@ -14,62 +27,145 @@ def _lower_first_letter(s: str) -> str:
     return s[0].lower() + s[1:]
 
 
+# (campusdish property name, key in our nutrition dict), worked out once instead of for every dish
+_NUTRITION_KEYS = tuple((property_name, _lower_first_letter(property_name)) for property_name in NUTRITION_PROPERTIES)
+
+
+def _transform_dish(details: dict) -> dict:
+    'Turns a campusdish product into a dish object, looking at the dietary information images only once'
+    eat_well = plant_forward = whole_grain = False
+    for diet_info in details["DietaryInformation"]:
+        icon_url = diet_info["IconUrl"]
+        eat_well = eat_well or 'EatWell' in icon_url
+        plant_forward = plant_forward or 'PlantForward' in icon_url
+        whole_grain = whole_grain or 'WholeGrain' in icon_url
+
+    nutrition = {key: details.get(property_name) for property_name, key in _NUTRITION_KEYS}
+    nutrition['isEatWell'] = eat_well
+    nutrition['isPlantForward'] = plant_forward
+    nutrition['isWholeGrain'] = whole_grain
+
+    return {
+        'name': details['MarketingName'],
+        'description': details['ShortDescription'],
+        'nutrition': nutrition,
+    }
+
+
+def _shape_menu(menu_data: dict, location: str = None) -> list:
+    '''
+    Turns the campusdish menu data (the dict at diner_json['Menu']) into the menu we send:
+    a list of stations, each of which contains multiple dishes, in the location's station order.
+    '''
+    station_id_to_name = {entry['StationId']: entry['Name'].replace('/ ', ' / ') for entry in menu_data["MenuStations"]}
+
+    # station name -> category name -> dishes, in the order campusdish lists them
+    station_dict = {}
+    for dish in menu_data["MenuProducts"]:
+        details = dish['Product']
+        station_name = station_id_to_name[dish['StationId']]
+        categories = station_dict.get(station_name)
+        if categories is None:
+            categories = station_dict[station_name] = {}
+        category_name = details['Categories'][0]['DisplayName']
+        items = categories.get(category_name)
+        if items is None:
+            items = categories[category_name] = []
+        items.append(_transform_dish(details))
+
+    # iterate over station names in custom order
+    menu = [
+        {
+            'station': station_name,
+            'menu': [{'category': category, 'items': items} for category, items in station_dict[station_name].items()]
+        }
+        for station_name in sorted(station_dict, key=get_station_sort_key(location))
+    ]
+    return menu or EMPTY_MENU_OBJECT
+
+
 def _get_menu(location, meal_id, date):
     '''
     Gets the menu (list of stations, each of which contains multiple dishes) for a given dining hall, meal, and date.
     '''
+    try:
+        menu_data = get_menu_data(location, meal_id, date)
+        with tracing.phase('transform'):
+            return _shape_menu(menu_data, location)
+    except:
+        traceback.print_exc()
+        return MENU_DATA_ERROR_OBJECT
 
-    def _find_icon(icon_property: str, food_info: dict) -> bool:
-        'Return true if the badge can be found in any of the dietary information images'
-        return any(map(lambda diet_info: icon_property in diet_info["IconUrl"], food_info["DietaryInformation"]))
 
-    station_dict = defaultdict(lambda: defaultdict(lambda: []))
+# set the first time a weekly response comes back without product dates (see split_menu_by_day), after which
+# get_week_menus stops making the weekly call, since every day would fall back to a daily call anyways
+_weekly_undated = False
 
+
+def get_week_menus(location: str, meal_id: int, start_date: str, days: int = 7, only: set = None) -> dict:
+    '''
+    Gets the menus for `days` days starting at start_date (mm/dd/yyyy) for one location and meal, as {date: menu},
+    skipping the days that meal isn't served on (see get_meals_for_weekday), and the days not in `only` if it's given.
+    Uses one weekly campusdish call, and only falls back to daily calls (run concurrently) for days the weekly data doesn't cover.
+    '''
+    global _weekly_undated
+    start = datetime.strptime(start_date, '%m/%d/%Y')
+    days = [start + timedelta(days=i) for i in range(days)]
+    dates = [day.strftime('%m/%d/%Y') for day in days if meal_id in get_meals_for_weekday(day.weekday())]
+    if only is not None:
+        dates = [date for date in dates if date in only]
+
+    menus = {}
+    if len(dates) > 1 and not _weekly_undated:
+        try:
+            menu_data = get_week_menu_data(location, meal_id, start_date)
+            by_day = split_menu_by_day(menu_data)
+            if menu_data["MenuProducts"] and not by_day:
+                print("Weekly menu data has no product dates, using daily calls from now on")
+                _weekly_undated = True
+            for date in dates:
+                if date in by_day:
+                    menus[date] = _shape_menu(by_day[date], location)
+        except:
+            traceback.print_exc()
+
+    missing = [date for date in dates if date not in menus]
+    if missing:
+        print(f"Weekly menu data didn't cover {missing}, getting them one day at a time")
+        for date, menu in zip(missing, _fetch_executor.map(tracing.bind(lambda date: _get_menu(location, meal_id, date)), missing)):
+            menus[date] = menu
+    return menus
+
+def get_location_details(restaurant: str) -> tuple:
+    '''
+    Returns (schedule, themed events) for the restaurant. They're both on the same location page,
+    so it only gets downloaded and parsed once.
+    '''
     try:
-        menu_data = get_menu_data(location, meal_id, date)
+        location_page = get_location_page(restaurant)
+    except:
+        traceback.print_exc()
+        return get_default_schedule(), EVENTS_PLACEHOLDER
+    return get_schedule_data(restaurant, location_page), get_themed_event_data(restaurant, location_page)
 
-        station_id_to_name = dict(
-            [(entry['StationId'], entry['Name']) for entry in menu_data["MenuStations"]])
-        dish_list = menu_data["MenuProducts"]
-
-        for dish in dish_list:
-            details = dish['Product']
-            station_name = station_id_to_name[dish['StationId']].replace(
-                '/ ', ' / ')
-            category_name = details['Categories'][0]['DisplayName']
-
-            dish_object = {
-                'name': details['MarketingName'],
-                'description': details['ShortDescription'],
-                'nutrition': dict([(_lower_first_letter(property_name), details.get(property_name)) for property_name in NUTRITION_PROPERTIES]) |
-                {
-                    'isEatWell': _find_icon('EatWell', details),
-                    'isPlantForward': _find_icon('PlantForward', details),
-                    'isWholeGrain': _find_icon('WholeGrain', details),
-                },
-            }
-
-            station_dict[station_name][category_name].append(dish_object)
-
-        menu = []
-
-        # iterate over station names in custom order
-        for station_name in sorted(station_dict, key=station_ordering_key):
-            menu.append(
-                {
-                    'station': station_name,
-                    'menu': [{'category': category, 'items': items} for category, items in station_dict[station_name].items()]
-                }
-            )
-        return menu or EMPTY_MENU_OBJECT
+
+def _result_or_fallback(future, deadline: float, fallback, branch: str):
+    'Wait for the future until the deadline (time.monotonic() value), returning the fallback if it times out or fails'
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        print(f"Timed out waiting for {branch}, using fallback")
     except:
         traceback.print_exc()
-        return MENU_DATA_ERROR_OBJECT
+    return fallback
 
 
-def make_response_body(location: str, meal_id: int = None, date: str = None) -> dict:
+def make_response_body(location: str, meal_id: int = None, date: str = None, concurrent: bool = None, schedule: dict = None, themed: list = None, menu: list = None) -> dict:
     ''' 
     Makes the dict with all the details in the response. 
+    The menu and the location page are fetched at the same time unless concurrent=False (defaults to CONCURRENT_FETCH).
+    If the schedule and themed events are passed in (e.g. from get_location_details when building many bodies for the same location),
+    the location page isn't fetched at all. Same for the menu (e.g. from get_week_menus).
 
     Needs to match this enum on the iOS client: https://github.com/shengyuan-lu/ZotMeal-iOS/blob/main/ZotMeal/Data%20Structure/Restaurant.swift#L21-L30
 
@@ -80,9 +176,26 @@ def make_response_body(location: str, meal_id: int = None, date: str = None) ->
         meal_id = get_current_meal()
 
     restaurant = get_name(location)
-    schedule = get_schedule_data(restaurant)
-
     date = date or get_irvine_date()
+
+    if concurrent is None:
+        concurrent = CONCURRENT_FETCH
+
+    if schedule is not None and themed is not None:
+        if menu is None:
+            menu = _get_menu(location, meal_id, date)
+    elif menu is not None:
+        schedule, themed = get_location_details(restaurant)
+    elif concurrent:
+        deadline = time.monotonic() + UPSTREAM_CALL_TIMEOUT
+        menu_future = _fetch_executor.submit(tracing.bind(_get_menu), location, meal_id, date)
+        details_future = _fetch_executor.submit(tracing.bind(get_location_details), restaurant)
+        schedule, themed = _result_or_fallback(details_future, deadline, (get_default_schedule(), EVENTS_PLACEHOLDER), 'schedule and themed events')
+        menu = _result_or_fallback(menu_future, deadline, MENU_DATA_ERROR_OBJECT, 'menu')
+    else:
+        schedule, themed = get_location_details(restaurant)
+        menu = _get_menu(location, meal_id, date)
+
     return {
         'date': date,
         'restaurant': restaurant,
@@ -90,6 +203,37 @@ def make_response_body(location: str, meal_id: int = None, date: str = None) ->
         'schedule': schedule,
         'currentMeal': get_meal_name(schedule, meal_id),
         'price': DEFAULT_PRICES,
-        'themed': get_themed_event_data(restaurant),
-        'all': _get_menu(location, meal_id, date)
+        'themed': themed,
+        'all': menu
+    }
+
+
+def make_partial_body(location: str, meal_id: int = None, date: str = None, sections: tuple = BODY_SECTIONS) -> dict:
+    '''
+    Makes only the given sections of the response body, and only fetches what they need:
+    no menu call unless "all" is asked for, and no location page unless schedule, currentMeal or themed is.
+    For the whole body, make_response_body is faster since it fetches both at the same time.
+    '''
+    if meal_id is None:
+        meal_id = get_current_meal()
+    restaurant = get_name(location)
+    date = date or get_irvine_date()
+
+    details = []  # filled the first time the schedule or themed events are needed
+
+    def get_details():
+        if not details:
+            details.extend(get_location_details(restaurant))
+        return details
+
+    builders = {
+        'date': lambda: date,
+        'restaurant': lambda: restaurant,
+        'refreshTime': lambda: int(time.time()),
+        'schedule': lambda: get_details()[0],
+        'currentMeal': lambda: get_meal_name(get_details()[0], meal_id),
+        'price': lambda: DEFAULT_PRICES,
+        'themed': lambda: get_details()[1],
+        'all': lambda: _get_menu(location, meal_id, date),
     }
+    return {section: builders[section]() for section in BODY_SECTIONS if section in sections}
@@ -0,0 +1,42 @@
+'''
+The fields= parameter: lets clients ask for only some parts of the response body, like fields=schedule,currentMeal
+or fields=date,all.station (the station names without their menus). Dotted fields pick keys inside a section,
+and inside every element of it when it's a list.
+'''
+
+# the top level sections of a response body, in the order they're sent
+BODY_SECTIONS = ('date', 'restaurant', 'refreshTime', 'schedule', 'currentMeal', 'price', 'themed', 'all')
+
+
+def parse_fields(fields: str) -> dict:
+    '''
+    Turn "schedule,all.station" into {"schedule": True, "all": {"station": True}}.
+    Raises ValueError for sections a response body doesn't have.
+    '''
+    tree = {}
+    for field in fields.split(","):
+        parts = [part for part in field.strip().split(".") if part]
+        if not parts:
+            continue
+        if parts[0] not in BODY_SECTIONS:
+            raise ValueError(f"Unknown field {parts[0]}. Valid fields: {list(BODY_SECTIONS)}")
+        node = tree
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:  # already asked for the whole thing
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    if not tree:
+        raise ValueError(f"No fields given. Valid fields: {list(BODY_SECTIONS)}")
+    return tree
+
+
+def project(data, fields: dict):
+    'Only the parts of data that are in the fields tree from parse_fields'
+    if isinstance(data, list):
+        return [project(item, fields) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {key: value if fields[key] is True else project(value, fields[key]) for key, value in data.items() if key in fields}
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Hashable, Optional, Tuple
+
+# In-process cache of finished responses, keyed by (location, meal, date).
+# It lives as long as the (warm) instance does, so repeat requests skip Firebase and campusdish
+# entirely and don't have to re-serialize the body either.
+
+
+def content_hash(data: dict) -> str:
+    'Hash of the response content, leaving out refreshTime so rebuilding an unchanged menu gives the same hash'
+    content = {key: value for key, value in data.items() if key != 'refreshTime'}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:20]
+
+
+@dataclass
+class CacheEntry:
+    data: dict  # the response body as a dict
+    body: bytes  # the serialized response body, ready to be written to the socket
+    stored_at: float  # time.time() when the entry was stored
+    expires_at: float  # after this the entry is stale, but can still be served while it's refreshed
+    stale_until: float  # after this the entry isn't served at all
+    revalidating: bool = field(default=False)
+    encodings: dict = field(default_factory=dict)  # content-encoding -> compressed body, filled in the first time a client asks for it
+    etag: str = ''  # content_hash of the data
+    last_modified: float = 0  # time.time() when the content (going by the etag) last changed
+
+
+class ResponseCache:
+    '''
+    Size-bounded LRU cache with a per-entry TTL and stale-while-revalidate.
+    get() returns the entry along with one of 'fresh', 'stale' or 'miss'. Stale entries should be served
+    as-is while the caller refreshes them (see begin_revalidate).
+    '''
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300, stale_ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[Optional[CacheEntry], str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry.stale_until:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None, 'miss'
+            self._entries.move_to_end(key)
+            if now < entry.expires_at:
+                self.hits += 1
+                return entry, 'fresh'
+            self.stale_hits += 1
+            return entry, 'stale'
+
+    def peek(self, key: Hashable) -> Optional[CacheEntry]:
+        'Returns the entry (even if stale) without counting it as a hit or miss or touching the LRU order'
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: Hashable, data: dict, body: bytes, ttl: float = None) -> CacheEntry:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        entry = CacheEntry(data=data, body=body, stored_at=now, expires_at=now + ttl, stale_until=now + ttl + self.stale_ttl,
+                           etag=content_hash(data), last_modified=now)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous.etag == entry.etag:
+                entry.last_modified = previous.last_modified
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def begin_revalidate(self, key: Hashable) -> bool:
+        'Marks a stale entry as being refreshed. Returns False if someone else is already refreshing it.'
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.revalidating:
+                return False
+            entry.revalidating = True
+            return True
+
+    def end_revalidate(self, key: Hashable) -> None:
+        'Clears the refreshing flag, for when a refresh failed and the old entry is still in place'
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.revalidating = False
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'hits': self.hits,
+                'staleHits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRatio': (self.hits + self.stale_hits) / lookups if lookups else 0,
+                'size': len(self._entries),
+                'maxEntries': self.max_entries,
+            }
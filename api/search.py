@@ -0,0 +1,296 @@
+'''
+In-memory search over the menus of every location for the next few days, so clients can ask things like
+"where is vegan food tonight" or "when is pizza served this week" in one request.
+
+The index maps each word of a dish's name and description to the dishes that have it. It's filled by a background
+refresh every SEARCH_REFRESH_INTERVAL seconds, which starts from the menus that are still fresh in the Firebase cache
+and only asks campusdish for the rest (one weekly call per location and meal). Every menu the api builds for a normal
+request also replaces that menu's entries right away. Queries only read the index, and never wait for the refresh.
+'''
+import bisect
+import os
+import re
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable
+
+from .util import LOCATION_INFO, MEAL_TO_PERIOD, NUTRITION_PROPERTIES, EMPTY_MENU_OBJECT, MENU_DATA_ERROR_OBJECT, get_irvine_date, get_meals_for_weekday
+
+SEARCH_INDEX_DAYS = int(os.getenv("SEARCH_INDEX_DAYS", 7))
+SEARCH_REFRESH_INTERVAL = float(os.getenv("SEARCH_REFRESH_INTERVAL", 30 * 60))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 200))
+
+FLAGS = ('isVegan', 'isVegetarian', 'isEatWell', 'isPlantForward', 'isWholeGrain')
+# nutrition values that can be filtered on with min/max, by their campusdish name (like "Calories") -> key in the dish
+NUMERIC_NUTRITION = {name: name[0].lower() + name[1:] for name in NUTRITION_PROPERTIES if name not in ('IsVegan', 'IsVegetarian', 'ServingUnit')}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_PATTERN.findall((text or '').lower())
+
+
+def _parse_date(date: str) -> tuple:
+    '(year, month, day) for a mm/dd/yyyy date, with or without the zero padding'
+    month, day, year = (int(part) for part in date.split('/'))
+    return year, month, day
+
+
+def _normalize_date(date: str) -> str:
+    'Dates are padded (10/05/2026) everywhere but in some cache keys, so the same menu never gets indexed twice'
+    year, month, day = _parse_date(date)
+    return f"{month:02d}/{day:02d}/{year}"
+
+
+def _to_number(value):
+    'Campusdish sends nutrition values as strings like "60" or "0.5" (or None, or "-")'
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Doc:
+    'One dish on one menu'
+
+    __slots__ = ('location', 'meal', 'date', 'station', 'category', 'dish', 'flags', 'numbers', 'tokens', 'sort_key')
+
+    def __init__(self, location, meal, date, station, category, dish):
+        self.location = location
+        self.meal = meal
+        self.date = date
+        self.station = station
+        self.category = category
+        self.dish = dish
+        nutrition = dish.get('nutrition') or {}
+        self.flags = frozenset(flag for flag in FLAGS if nutrition.get(flag))
+        self.numbers = {name: _to_number(nutrition.get(key)) for name, key in NUMERIC_NUTRITION.items()}
+        self.tokens = set(tokenize(dish.get('name')) + tokenize(dish.get('description')) + tokenize(station))
+        self.sort_key = (_parse_date(date), meal, location, station)
+
+    def to_result(self) -> dict:
+        return {
+            'location': self.location,
+            'date': self.date,
+            'meal': MEAL_TO_PERIOD[self.meal][1],
+            'mealId': self.meal,
+            'station': self.station,
+            'category': self.category,
+            'dish': self.dish,
+        }
+
+
+class SearchIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}  # doc id -> _Doc
+        self._postings = {}  # token -> set of doc ids
+        self._menus = {}  # (location, meal, date) -> doc ids, so a menu's entries can be replaced
+        self._vocabulary = []  # sorted tokens, for prefix matching. rebuilt on the next query after it changes
+        self._vocabulary_dirty = False
+        self._next_id = 0
+        self.last_refresh = None
+
+    def update(self, location: str, meal: int, date: str, menu: list) -> None:
+        'Replace the entries for one menu (from _get_menu / the "all" field of a response body)'
+        date = _normalize_date(date)
+        if menu == MENU_DATA_ERROR_OBJECT:
+            return  # keep what we had rather than forgetting the menu because campusdish failed once
+        if menu == EMPTY_MENU_OBJECT:
+            menu = []
+        docs = []
+        for station in menu or []:
+            for category in station.get('menu') or []:
+                for dish in category.get('items') or []:
+                    docs.append(_Doc(location, meal, date, station['station'], category['category'], dish))
+
+        with self._lock:
+            self._remove(self._menus.pop((location, meal, date), ()))
+            ids = []
+            for doc in docs:
+                doc_id = self._next_id
+                self._next_id += 1
+                self._docs[doc_id] = doc
+                ids.append(doc_id)
+                for token in doc.tokens:
+                    postings = self._postings.get(token)
+                    if postings is None:
+                        postings = self._postings[token] = set()
+                        self._vocabulary_dirty = True
+                    postings.add(doc_id)
+            self._menus[(location, meal, date)] = ids
+
+    def _remove(self, doc_ids) -> None:
+        for doc_id in doc_ids:
+            doc = self._docs.pop(doc_id)
+            for token in doc.tokens:
+                postings = self._postings.get(token)
+                if postings is not None:
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._postings[token]
+                        self._vocabulary_dirty = True
+
+    def prune(self, before: str) -> None:
+        'Forget menus for dates before `before` (mm/dd/yyyy)'
+        cutoff = _parse_date(before)
+        with self._lock:
+            for key in [key for key in self._menus if _parse_date(key[2]) < cutoff]:
+                self._remove(self._menus.pop(key))
+
+    def _matching(self, token: str) -> set:
+        'Doc ids for every indexed word starting with the token (so "pizz" and "pizza" find "pizzas")'
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        matches = set()
+        i = bisect.bisect_left(self._vocabulary, token)
+        while i < len(self._vocabulary) and self._vocabulary[i].startswith(token):
+            matches |= self._postings[self._vocabulary[i]]
+            i += 1
+        return matches
+
+    def search(self, text: str = None, location: str = None, meal: int = None, date: str = None,
+               flags: tuple = (), ranges: dict = None, limit: int = SEARCH_MAX_RESULTS) -> list:
+        '''
+        Dishes matching every word in text (all dishes if there's none) that have all the flags (like "isVegan"),
+        and whose nutrition values are within ranges ({campusdish name: (min or None, max or None)}, like {"Calories": (None, 500)}).
+        Results are sorted by date, meal, location and station.
+        '''
+        ranges = ranges or {}
+        if date is not None:
+            date = _normalize_date(date)
+        with self._lock:
+            tokens = tokenize(text)
+            if tokens:
+                candidates = None
+                for token in sorted(tokens, key=len, reverse=True):  # longer words usually match fewer dishes
+                    matches = self._matching(token)
+                    candidates = matches if candidates is None else candidates & matches
+                    if not candidates:
+                        return []
+            else:
+                candidates = self._docs.keys()
+
+            required = frozenset(flags)
+            results = []
+            for doc_id in candidates:
+                doc = self._docs[doc_id]
+                if location is not None and doc.location != location:
+                    continue
+                if meal is not None and doc.meal != meal:
+                    continue
+                if date is not None and doc.date != date:
+                    continue
+                if not required <= doc.flags:
+                    continue
+                if any(not _in_range(doc.numbers.get(name), low, high) for name, (low, high) in ranges.items()):
+                    continue
+                results.append(doc)
+
+        results.sort(key=lambda doc: doc.sort_key)
+        return [doc.to_result() for doc in results[:limit]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'menus': len(self._menus),
+                'dishes': len(self._docs),
+                'words': len(self._postings),
+                'lastRefresh': self.last_refresh,
+            }
+
+
+def _in_range(value, low, high) -> bool:
+    if value is None:
+        return low is None and high is None
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+SEARCH_INDEX = SearchIndex()
+
+_refresher = None
+_refresher_lock = threading.Lock()
+_first_refresh = threading.Event()
+
+
+def refresh_index(index: SearchIndex = SEARCH_INDEX, days: int = SEARCH_INDEX_DAYS, read_cached: Callable = None) -> None:
+    '''
+    Index every location and meal from today through the next `days` days, skipping meals that aren't served on a day.
+    read_cached(location, meal, date) can give a fresh cached body for a menu (or None), and only the menus it
+    doesn't have get fetched from campusdish.
+    '''
+    from .parsing import get_week_menus  # imported here so the index can be used without pulling in the campusdish client
+
+    today = get_irvine_date()
+    start = datetime.strptime(today, '%m/%d/%Y')
+    days_to_index = [start + timedelta(days=i) for i in range(days)]
+    for location in LOCATION_INFO:
+        missing = {}  # meal -> dates that weren't in the cache
+        for day in days_to_index:
+            date = day.strftime('%m/%d/%Y')
+            for meal in get_meals_for_weekday(day.weekday()):
+                body = None
+                if read_cached is not None:
+                    try:
+                        body = read_cached(location, meal, date)
+                    except Exception:
+                        traceback.print_exc()
+                if body is not None:
+                    index.update(location, meal, date, body['all'])
+                else:
+                    missing.setdefault(meal, set()).add(date)
+
+        for meal, meal_dates in missing.items():
+            try:
+                menus = get_week_menus(location, meal, today, days, only=meal_dates)
+            except Exception:
+                traceback.print_exc()
+                continue
+            for date, menu in menus.items():
+                index.update(location, meal, date, menu)
+    index.prune(today)
+    index.last_refresh = int(time.time())
+
+
+def _refresh_forever(read_cached: Callable = None) -> None:
+    while True:
+        try:
+            refresh_index(read_cached=read_cached)
+        except Exception:
+            traceback.print_exc()
+        _first_refresh.set()
+        time.sleep(SEARCH_REFRESH_INTERVAL)
+
+
+def ensure_refreshing(wait: float = 0, read_cached: Callable = None) -> bool:
+    '''
+    Start the background refresh if it isn't running yet (see refresh_index for read_cached),
+    and wait up to `wait` seconds for its first pass. Returns whether the first pass is done.
+    '''
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_forever, args=(read_cached,), name="search-refresh", daemon=True)
+            _refresher.start()
+    return _first_refresh.wait(wait)
+
+
+def parse_ranges(query: dict) -> dict:
+    '''
+    Nutrition ranges from query parameters like minProtein=20 or maxCalories=500
+    (min/max followed by the campusdish name of the value). Raises ValueError for values that aren't numbers.
+    '''
+    ranges = {}
+    for param, values in query.items():
+        for prefix in ('min', 'max'):
+            name = param[len(prefix):]
+            if param.startswith(prefix) and name in NUMERIC_NUTRITION:
+                low, high = ranges.get(name, (None, None))
+                value = float(values[0])
+                ranges[name] = (value, high) if prefix == 'min' else (low, value)
+    return ranges
@@ -0,0 +1,274 @@
+'''
+Long-running server for self-hosting outside Vercel, using the same handler as the serverless function.
+
+Connections are kept alive (HTTP/1.1) and handled on a bounded pool of worker threads, so one slow campusdish call
+doesn't hold up other clients. Between requests, kept-alive connections wait in a selector instead of on a worker,
+so idle clients can't take up the pool. When every worker is busy and the backlog is full, new connections get a 503
+right away instead of piling up. SIGTERM/SIGINT stop accepting connections and let in-flight requests finish before exiting.
+
+Run it from the project root:
+    python -m api.server --port 3000 --workers 32
+'''
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+from .index import handler, USE_CACHE
+
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 32))
+# connections that can wait for a worker on top of the ones being handled
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 64))
+# seconds a connection can sit idle (or a client can take to send a request) before it gets closed
+SERVER_IDLE_TIMEOUT = float(os.getenv("SERVER_IDLE_TIMEOUT", 5))
+# seconds to wait for in-flight requests when shutting down
+SERVER_DRAIN_TIMEOUT = float(os.getenv("SERVER_DRAIN_TIMEOUT", 20))
+
+_OVERLOADED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 24\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b"Server is busy, retry.\r\n"
+)
+
+
+class KeepAliveHandler(handler):
+    '''
+    The api handler with HTTP/1.1 keep-alive and an idle timeout on the socket.
+    Instead of waiting for the next request on a kept-alive connection it sets parked, so the server
+    can hand the connection back to its selector until the client sends something.
+    '''
+
+    protocol_version = "HTTP/1.1"  # every response has a Content-Length, so connections can be reused
+    timeout = SERVER_IDLE_TIMEOUT
+    parked = False
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self._request_waiting():
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if self.server.draining:
+            self.close_connection = True
+
+    def _request_waiting(self) -> bool:
+        'Whether the next request (or part of it) is already here, without blocking'
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class PooledHTTPServer(HTTPServer):
+    '''
+    HTTPServer that hands each connection to a fixed pool of worker threads,
+    turning connections away with a 503 when the pool and its backlog are full.
+    '''
+
+    daemon_threads = False
+    request_queue_size = 128
+
+    def __init__(self, server_address, RequestHandlerClass=KeepAliveHandler, workers: int = SERVER_WORKERS, backlog: int = SERVER_BACKLOG):
+        super().__init__(server_address, RequestHandlerClass)
+        self.draining = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        # idle kept-alive connections, watched by the _watch_idle thread. workers hand them over through _to_park
+        self._selector = selectors.DefaultSelector()
+        self._parked = {}  # socket -> (client address, time.monotonic() it gets closed at)
+        self._to_park = []
+        self._park_lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._stopping = False
+        self._watcher = threading.Thread(target=self._watch_idle, name="http-idle", daemon=True)
+        self._watcher.start()
+
+    def process_request(self, request, client_address):
+        if self.draining or not self._slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        self._executor.submit(self._process, request, client_address)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _process(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        parked = False
+        try:
+            parked = getattr(self.finish_request(request, client_address), "parked", False) and not self.draining
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+            if parked:
+                self._park(request, client_address)
+            else:
+                self.shutdown_request(request)
+            self._slots.release()
+
+    def _park(self, request, client_address):
+        with self._park_lock:
+            self._to_park.append((request, client_address))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(b"x")
+        except OSError:
+            pass
+
+    def _watch_idle(self):
+        'Hand parked connections back to the pool when they get a request, and close them after SERVER_IDLE_TIMEOUT'
+        while not self._stopping:
+            for key, _events in self._selector.select(timeout=1):
+                if key.fileobj is self._wakeup_reader:
+                    try:
+                        while self._wakeup_reader.recv(512):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                client_address, _deadline = self._parked.pop(key.fileobj)
+                self._resume(key.fileobj, client_address)
+
+            with self._park_lock:
+                to_park, self._to_park = self._to_park, []
+            now = time.monotonic()
+            for request, client_address in to_park:
+                self._parked[request] = (client_address, now + self.RequestHandlerClass.timeout)
+                self._selector.register(request, selectors.EVENT_READ)
+            for request, (_client_address, deadline) in list(self._parked.items()):
+                if deadline <= now or self.draining:
+                    self._selector.unregister(request)
+                    del self._parked[request]
+                    self.shutdown_request(request)
+
+        for request in list(self._parked) + [request for request, _client_address in self._to_park]:
+            self.shutdown_request(request)
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _resume(self, request, client_address):
+        if self.draining:
+            self.shutdown_request(request)
+        elif not self._slots.acquire(blocking=False):
+            self._reject(request)
+        else:
+            try:
+                self._executor.submit(self._process, request, client_address)
+            except RuntimeError:  # the pool was shut down by drain() in the meantime
+                self._slots.release()
+                self.shutdown_request(request)
+
+    def idle_connections(self) -> int:
+        'Number of idle kept-alive connections waiting for their next request'
+        return len(self._parked)
+
+    def _reject(self, request):
+        try:
+            request.sendall(_OVERLOADED_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def drain(self, timeout: float = SERVER_DRAIN_TIMEOUT) -> bool:
+        '''
+        Stop serving and wait (up to timeout seconds) for the requests being handled to finish.
+        Call it from a different thread than serve_forever. Returns False if requests were still running after the timeout.
+        '''
+        self.draining = True
+        self.shutdown()
+        # stop reading from open connections, so idle keep-alive connections close now instead of after the idle timeout.
+        # requests already being handled still get their response, since GETs are done being read before they're handled.
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        done = threading.Event()
+        threading.Thread(target=lambda: (self._executor.shutdown(wait=True), done.set()), daemon=True).start()
+        self._wake()  # closes the parked connections
+        finished = done.wait(timeout)
+        self.server_close()
+        return finished
+
+    def server_close(self):
+        super().server_close()
+        self._stopping = True
+        self._wake()
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionError, socket.timeout)):
+            return  # clients going away isn't worth a traceback
+        super().handle_error(request, client_address)
+
+
+def serve(host: str = "", port: int = 3000, workers: int = SERVER_WORKERS, backlog: int = SERVER_BACKLOG) -> None:
+    'Serve until SIGTERM/SIGINT, then finish the in-flight requests and flush the buffered analytics'
+    server = PooledHTTPServer((host, port), workers=workers, backlog=backlog)
+    drained = threading.Event()
+
+    def drain():
+        if not server.drain():
+            print("Some requests were still running after the drain timeout")
+        drained.set()
+
+    def stop(signum, frame):
+        if server.draining:
+            return
+        server.draining = True
+        print(f"Got signal {signum}, shutting down")
+        # shutdown() waits for serve_forever to return, so it can't run on this (the serving) thread
+        threading.Thread(target=drain, name="http-drain").start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Serving on port {port} with {workers} workers")
+    server.serve_forever()
+    drained.wait()
+
+    if USE_CACHE:
+        from .firebase_utils import ANALYTICS
+        ANALYTICS.flush()
+    print("Server stopped")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the api as a long-running server")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 3000)))
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--backlog", type=int, default=SERVER_BACKLOG)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.backlog)
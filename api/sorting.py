@@ -1,3 +1,10 @@
+import functools
+import json
+import os
+import threading
+import time
+import traceback
+
 ORDERINGS = [
     'Home',# anteatery main dish
     'Oven',# anteatery pizza
@@ -18,12 +25,88 @@ ORDERINGS = [
     'The Farm Stand / Salad Bar'# brandywine salad
 ]
 
-def station_ordering_key(station_name: str) -> int:
+# Per-location orderings. Stations that aren't listed for a location use ORDERINGS.
+LOCATION_ORDERINGS = {}
+
+# JSON file to load orderings from instead, shaped like {"default": [...], "locations": {"anteatery": [...]}}.
+# It gets re-read when it changes, so the order can be adjusted without a redeploy.
+ORDERINGS_FILE = os.getenv("STATION_ORDERINGS_FILE")
+RELOAD_INTERVAL = 10  # seconds between checks of the file's modification time
+
+# at most this many unknown-station warnings get printed per WARNING_WINDOW seconds, and each station only once
+MAX_WARNINGS = 10
+WARNING_WINDOW = 60
+
+_ranks = {}  # location (None for the default) -> {station name: rank}
+_file_mtime = None
+_last_reload_check = 0
+_warned_stations = set()
+_warning_times = []
+_lock = threading.Lock()
+
+
+def _build_ranks(default: list, location_orderings: dict) -> dict:
+    ranks = {None: {name: i for i, name in enumerate(default)}}
+    for location, ordering in location_orderings.items():
+        ranks[location] = {name: i for i, name in enumerate(ordering)}
+    return ranks
+
+
+def _maybe_reload() -> None:
+    'Re-read ORDERINGS_FILE if it changed since we last looked (checked at most every RELOAD_INTERVAL seconds)'
+    global _ranks, _file_mtime, _last_reload_check
+    now = time.monotonic()
+    if now - _last_reload_check < RELOAD_INTERVAL:
+        return
+    with _lock:
+        _last_reload_check = now
+        try:
+            mtime = os.path.getmtime(ORDERINGS_FILE)
+            if mtime == _file_mtime:
+                return
+            with open(ORDERINGS_FILE) as f:
+                config = json.load(f)
+            _ranks = _build_ranks(config.get("default", ORDERINGS), config.get("locations", {}))
+            _file_mtime = mtime
+            print(f"Loaded station orderings from {ORDERINGS_FILE}")
+        except (OSError, ValueError):
+            traceback.print_exc()
+
+
+def _warn_unknown_station(station_name: str) -> None:
+    with _lock:
+        if station_name in _warned_stations:
+            return
+        now = time.monotonic()
+        _warning_times[:] = [t for t in _warning_times if now - t < WARNING_WINDOW]
+        if len(_warning_times) >= MAX_WARNINGS:
+            return
+        _warned_stations.add(station_name)
+        _warning_times.append(now)
+    print(f"(NON-BREAKING) Station {station_name} is not in the station orderings, it'll go after the known stations")
+
+
+def station_ordering_key(station_name: str, location: str = None) -> tuple:
     '''
-    Returns an integer used to sort station names by relevance (basically Eric's personal preferences 😋)
+    Returns a key used to sort station names by relevance (basically Eric's personal preferences 😋)
+    Stations in the location's ordering come first, then the rest of ORDERINGS, then unknown stations alphabetically.
     '''
-    try:
-        return ORDERINGS.index(station_name)
-    except ValueError:# if 
-        print(f"ValueError (NON-BREAKING) on station orderings. Key {station_name} is not in list")
-        return -1
\ No newline at end of file
+    if ORDERINGS_FILE:
+        _maybe_reload()
+    ranks = _ranks
+    location_ranks = ranks.get(location)
+    if location_ranks is not None and station_name in location_ranks:
+        return (0, location_ranks[station_name], '')
+    rank = ranks[None].get(station_name)
+    if rank is not None:
+        return (1, rank, '')
+    _warn_unknown_station(station_name)
+    return (2, 0, station_name)
+
+
+def get_station_sort_key(location: str = None):
+    'station_ordering_key for a location, for use as a sorted() key'
+    return functools.partial(station_ordering_key, location=location)
+
+
+_ranks = _build_ranks(ORDERINGS, LOCATION_ORDERINGS)
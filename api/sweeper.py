@@ -0,0 +1,102 @@
+'''
+Removes cached menus from Firebase that we don't want to serve or keep anymore:
+whole days (and their change logs) older than CACHE_RETENTION_DAYS, bodies that expired going by the ttl in freshness.py
+(so the next request rebuilds them instead of reading them first), and build leases left behind by crashed instances.
+With --dishes, it also removes dishes in the dish table that no menu refers to anymore.
+Everything is removed with multi-path updates, a few hundred nodes per write.
+
+Run it from the project root (with the same env vars as the server), e.g. from cron every hour:
+    python -m api.sweeper
+'''
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from .util import LOCATION_INFO
+from .firebase_utils import get_reference, get_children
+from .freshness import is_expired, RETENTION_DAYS
+from .dish_table import is_packed, get_dish_ids
+
+UPDATE_BATCH_SIZE = 500  # paths per multi-path update
+
+
+def _parse_date_key(date_key: str):
+    'The date for a firebase date key like "10|19|2026" (or unpadded "1|5|2026"), None if it isn\'t one'
+    try:
+        return datetime.strptime(date_key, "%m|%d|%Y").date()
+    except ValueError:
+        return None
+
+
+def find_expired(retention_days: int = RETENTION_DAYS) -> list:
+    'Paths (relative to the root) of every node the sweep should remove'
+    today = datetime.now(pytz.timezone("America/Los_Angeles")).date()
+    cutoff = today - timedelta(days=retention_days)
+    now = time.time()
+    paths = []
+
+    for location in LOCATION_INFO:
+        # shallow, so only the date keys get downloaded and not every menu under them
+        for date_key in get_children(get_reference(location).get(shallow=True)):
+            day = _parse_date_key(date_key)
+            if day is None:
+                continue
+            if day < cutoff:
+                paths.append(f"{location}/{date_key}")
+                paths.append(f"changes/{location}/{date_key}")
+                continue
+            for meal, data in get_children(get_reference(f"{location}/{date_key}").get()).items():
+                if isinstance(data, dict) and is_expired(data, now):
+                    paths.append(f"{location}/{date_key}/{meal}")
+
+    for location, dates in get_children(get_reference("leases").get()).items():
+        for date_key, meals in get_children(dates).items():
+            for meal, lease in get_children(meals).items():
+                if not isinstance(lease, dict) or lease.get("expires", 0) < now:
+                    paths.append(f"leases/{location}/{date_key}/{meal}")
+    return paths
+
+
+def find_unreferenced_dishes() -> list:
+    'Paths of the dishes in the dish table that none of the cached menus refer to'
+    referenced = set()
+    for location in LOCATION_INFO:
+        for dates in get_children(get_reference(location).get()).values():
+            for data in get_children(dates).values():
+                if isinstance(data, dict) and is_packed(data):
+                    referenced |= get_dish_ids(data)
+    return [f"dishes/{dish_id}" for dish_id in get_children(get_reference("dishes").get(shallow=True)) if dish_id not in referenced]
+
+
+def sweep(retention_days: int = RETENTION_DAYS, dry_run: bool = False, dishes: bool = False) -> list:
+    'Remove the nodes found by find_expired (and find_unreferenced_dishes if dishes=True) and return their paths'
+    paths = find_expired(retention_days)
+    if not dry_run:
+        _remove(paths)
+    if dishes:
+        # after the menus are gone, so dishes only they used get removed too
+        dish_paths = find_unreferenced_dishes()
+        if not dry_run:
+            _remove(dish_paths)
+        paths += dish_paths
+    return paths
+
+
+def _remove(paths: list) -> None:
+    root = get_reference("/")
+    for i in range(0, len(paths), UPDATE_BATCH_SIZE):
+        root.update({path: None for path in paths[i:i + UPDATE_BATCH_SIZE]})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove old and expired menus from the Firebase cache")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="remove days older than this")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would be removed")
+    parser.add_argument("--dishes", action="store_true", help="also remove dishes no cached menu refers to")
+    args = parser.parse_args()
+
+    removed = sweep(args.retention_days, args.dry_run, args.dishes)
+    print(json.dumps({"dryRun": args.dry_run, "removed": removed}, indent=4))
@@ -0,0 +1,244 @@
+'''
+Lightweight per-request phase timing.
+
+A request calls start() when it begins and finish() when it's done. Code in between wraps its work in
+`with phase('upstream'):` (or 'parse', 'transform', 'serialize', 'cache', ...) and the durations are added up per phase.
+Listeners registered with add_listener get every finished trace. When tracing is off, phase() hands back
+a shared no-op context manager, so the instrumentation costs next to nothing.
+
+With tracing on, responses get a Server-Timing header with the phases so far (browser devtools show it).
+TRACING_LOG=1 also prints one JSON line per request, and TRACING_METRICS=1 keeps in-process latency
+histograms that /api?metrics=1 serves. Either of those turns tracing on too.
+'''
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+LOG_ENABLED = bool(os.getenv("TRACING_LOG"))
+METRICS_ENABLED = bool(os.getenv("TRACING_METRICS"))
+ENABLED = bool(os.getenv("TRACING")) or LOG_ENABLED or METRICS_ENABLED
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_listeners = []
+_NULL_PHASE = nullcontext()
+
+
+class Trace:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.phases = {}  # phase name -> total seconds (phases running in parallel threads are added up)
+        self.attributes = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+
+class _Phase:
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable(enabled: bool = True) -> None:
+    global ENABLED
+    ENABLED = enabled
+
+
+def add_listener(listener) -> None:
+    'listener(trace) gets called with every finished trace'
+    _listeners.append(listener)
+
+
+def remove_listener(listener) -> None:
+    _listeners.remove(listener)
+
+
+def start():
+    'Start a trace for the current request. Returns a token for finish(), or None when tracing is off.'
+    if not ENABLED:
+        return None
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def current() -> Trace:
+    return _current_trace.get()
+
+
+def phase(name: str):
+    'Context manager that adds the time spent inside it to the current trace'
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_PHASE
+    return _Phase(trace, name)
+
+
+def annotate(**attributes) -> None:
+    'Attach extra information (like the cache outcome) to the current trace'
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def finish(token) -> Trace:
+    'End the trace started with start() and hand it to the listeners'
+    if token is None:
+        return None
+    trace, context_token = token
+    trace.duration = time.perf_counter() - trace.started
+    _current_trace.reset(context_token)
+    for listener in list(_listeners):
+        listener(trace)
+    return trace
+
+
+def bind(fn):
+    '''
+    Wrap fn so it runs with the current trace, for handing work to a thread pool
+    (threads don't inherit the caller's context on their own).
+    '''
+    trace = _current_trace.get()
+    if trace is None:
+        return fn
+
+    def run_with_trace(*args, **kwargs):
+        token = _current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+    return run_with_trace
+
+
+def server_timing() -> str:
+    '''
+    Server-Timing header value for the current trace, like "upstream;dur=120.4, transform;dur=3.1, total;dur=130.2",
+    or None when tracing is off. Phases still running (or that run after the headers go out) aren't in it.
+    '''
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    with trace._lock:
+        phases = list(trace.phases.items())
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases]
+    parts.append(f"total;dur={(time.perf_counter() - trace.started) * 1000:.1f}")
+    cache = trace.attributes.get("cache")
+    if cache is not None:
+        parts.append(f'cache-outcome;desc="{cache}"')
+    return ", ".join(parts)
+
+
+def log_trace(trace: Trace) -> None:
+    'Print the trace as one JSON line, for log search'
+    print(json.dumps({
+        "event": "request",
+        **trace.attributes,
+        "durationMs": round(trace.duration * 1000, 2),
+        "phasesMs": {name: round(seconds * 1000, 2) for name, seconds in trace.phases.items()},
+    }, default=str))
+
+
+# upper bounds (ms) of the histogram buckets, plus one more bucket for everything slower
+HISTOGRAM_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    'Counts of durations per bucket, with percentiles estimated from the bucket bounds'
+
+    def __init__(self, buckets: tuple = HISTOGRAM_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0
+        self.max_ms = 0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> float:
+        'Upper bound of the bucket the percentile falls in (the max for the last bucket)'
+        if not self.count:
+            return 0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return round(min(self.buckets[i], self.max_ms) if i < len(self.buckets) else self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "meanMs": round(self.total_ms / self.count, 2) if self.count else 0,
+            "maxMs": round(self.max_ms, 2),
+            "p50Ms": self.percentile(50),
+            "p95Ms": self.percentile(95),
+            "p99Ms": self.percentile(99),
+            "buckets": {f"le{bound}": count for bound, count in zip(self.buckets, self.counts)} | {"inf": self.counts[-1]},
+        }
+
+
+class Metrics:
+    'Histograms of request and phase durations, and counts of statuses and cache outcomes'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = Histogram()
+            self.phases = {}
+            self.statuses = {}
+            self.cache = {}
+
+    def record(self, trace: Trace) -> None:
+        with self._lock:
+            self.requests.observe(trace.duration * 1000)
+            for name, seconds in trace.phases.items():
+                if name not in self.phases:
+                    self.phases[name] = Histogram()
+                self.phases[name].observe(seconds * 1000)
+            status = str(trace.attributes.get("status"))
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            cache = str(trace.attributes.get("cache"))
+            self.cache[cache] = self.cache.get(cache, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": METRICS_ENABLED,
+                "requests": self.requests.snapshot(),
+                "phases": {name: histogram.snapshot() for name, histogram in sorted(self.phases.items())},
+                "statuses": dict(self.statuses),
+                "cache": dict(self.cache),
+            }
+
+
+METRICS = Metrics()
+
+if LOG_ENABLED:
+    add_listener(log_trace)
+if METRICS_ENABLED:
+    add_listener(METRICS.record)
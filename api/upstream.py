@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP client for everything we fetch from campusdish.
+# The session is module-level so warm serverless instances reuse the pooled keep-alive
+# connections instead of doing a new TCP + TLS handshake on every request.
+
+# (connect, read) timeouts in seconds. Without these one slow campusdish response can hang the request forever.
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", 8))
+
+# retries for connection errors and 429/5xx responses, with exponential backoff between attempts
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+BACKOFF_FACTOR = float(os.getenv("UPSTREAM_BACKOFF_FACTOR", 0.3))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# connections kept open per host (we only talk to a couple of hosts)
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", 16))
+
+# live: talk to campusdish. record: talk to campusdish and save every response to UPSTREAM_FIXTURES_DIR.
+# replay: serve the saved responses from disk and never touch the network (see upstream_fixtures.py).
+MODE = os.getenv("UPSTREAM_MODE", "live")
+FIXTURES_DIR = os.getenv("UPSTREAM_FIXTURES_DIR")
+# extra delay (seconds) before every replayed response, to make replay behave like a slow network
+REPLAY_LATENCY = float(os.getenv("UPSTREAM_LATENCY_MS", 0)) / 1000
+# send requests to this scheme://host[:port] instead of campusdish (e.g. the stand-in server in upstream_fixtures.py)
+BASE_URL = os.getenv("UPSTREAM_BASE_URL")
+
+_session = None
+_session_lock = threading.Lock()
+_fixtures = None
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # hand the last response back so the caller can look at the error body
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session() -> requests.Session:
+    'Returns the shared session, creating it on first use'
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _make_session()
+    return _session
+
+
+def configure(mode: str = None, fixtures_dir: str = None, latency: float = None, base_url: str = None) -> None:
+    'Change the upstream mode at runtime (for tests and benchmarks). Arguments left as None keep their current value.'
+    global MODE, FIXTURES_DIR, REPLAY_LATENCY, BASE_URL, _fixtures
+    if mode is not None:
+        MODE = mode
+    if fixtures_dir is not None:
+        FIXTURES_DIR = fixtures_dir
+        _fixtures = None
+    if latency is not None:
+        REPLAY_LATENCY = latency
+    if base_url is not None:
+        BASE_URL = base_url or None
+
+
+def _get_fixtures():
+    global _fixtures
+    if _fixtures is None:
+        from .upstream_fixtures import FixtureStore, DEFAULT_FIXTURES_DIR
+        _fixtures = FixtureStore(FIXTURES_DIR or DEFAULT_FIXTURES_DIR)
+    return _fixtures
+
+
+def _replay(url: str) -> requests.Response:
+    'Build a requests.Response from the recording for the url (or a 404 if there is none)'
+    if REPLAY_LATENCY:
+        time.sleep(REPLAY_LATENCY)
+    fixture = _get_fixtures().load(url)
+    response = requests.Response()
+    response.url = url
+    if fixture is None:
+        print(f"No upstream recording for {url}")
+        response.status_code = 404
+        response._content = b'{"error": "no recording"}'
+        return response
+    response.status_code = fixture["status"]
+    response.headers.update(fixture["headers"])
+    response.encoding = "utf-8"
+    response._content = fixture["body"].encode("utf-8")
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    '''
+    GET the url through the shared session. Uses the default (connect, read) timeouts unless a timeout is passed in.
+    In replay mode the response comes from the recordings instead, and in record mode it also gets saved to them.
+    '''
+    if MODE == "replay":
+        return _replay(url)
+
+    request_url = url
+    if BASE_URL:
+        parsed = urllib.parse.urlsplit(url)
+        request_url = BASE_URL.rstrip("/") + parsed.path + ("?" + parsed.query if parsed.query else "")
+
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    response = get_session().get(request_url, **kwargs)
+    if MODE == "record":
+        _get_fixtures().save(url, response.status_code, response.headers, response.text)
+    return response
@@ -0,0 +1,126 @@
+'''
+Recorded campusdish responses on disk, so the server can run (and be tested and benchmarked) without the network.
+
+Each fixture is one JSON file: {"url": ..., "status": ..., "headers": {...}, "body": "..."}.
+upstream.py records into a FixtureStore when UPSTREAM_MODE=record and replays from it when UPSTREAM_MODE=replay.
+The stand-in server below serves the same fixtures over HTTP, for load tests that should go through real sockets:
+    python -m api.upstream_fixtures --port 8081 --latency-ms 150
+and then run the server with UPSTREAM_BASE_URL=http://localhost:8081
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_FIXTURES_DIR = Path(__file__).resolve().parent.parent / "tests" / "fixtures" / "upstream"
+
+
+def _loose_key(url: str) -> str:
+    '''
+    The url without the host and without any query params other than locationId, for replaying a
+    recording on a different date or meal than it was recorded for.
+    '''
+    parsed = urllib.parse.urlsplit(url)
+    params = [(name, value) for name, value in urllib.parse.parse_qsl(parsed.query) if name == "locationId"]
+    return parsed.path + "?" + urllib.parse.urlencode(params)
+
+
+def _exact_key(url: str) -> str:
+    'The url without the host, so recordings work no matter which host (or stand-in) served them'
+    parsed = urllib.parse.urlsplit(url)
+    return parsed.path + "?" + parsed.query
+
+
+class FixtureStore:
+    '''
+    Recorded responses in a directory. Lookups try the exact url first and then fall back to the loose match
+    (same path and locationId), so recorded menus still get served when the date in the request changes.
+    '''
+
+    def __init__(self, directory=DEFAULT_FIXTURES_DIR):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._exact = None
+        self._loose = None
+
+    def _index(self) -> None:
+        exact, loose = {}, {}
+        for path in sorted(self.directory.glob("*.json")):
+            fixture = json.loads(path.read_text(encoding="utf-8"))
+            exact[_exact_key(fixture["url"])] = fixture
+            loose.setdefault(_loose_key(fixture["url"]), fixture)
+        self._exact, self._loose = exact, loose
+
+    def load(self, url: str) -> Optional[dict]:
+        with self._lock:
+            if self._exact is None:
+                self._index()
+            return self._exact.get(_exact_key(url)) or self._loose.get(_loose_key(url))
+
+    def save(self, url: str, status: int, headers: dict, body: str) -> Path:
+        fixture = {
+            "url": url,
+            "status": status,
+            "headers": {name: value for name, value in headers.items() if name.lower() == "content-type"},
+            "body": body,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{hashlib.sha1(url.encode()).hexdigest()[:16]}.json"
+        path.write_text(json.dumps(fixture, ensure_ascii=False, indent=1), encoding="utf-8")
+        with self._lock:
+            self._exact = None  # re-index on the next load
+        return path
+
+
+def make_standin_handler(store: FixtureStore, latency: float = 0):
+    'Request handler class that answers GETs with the recorded responses, after waiting `latency` seconds'
+
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            fixture = store.load(self.path)
+            if fixture is None:
+                status, headers, body = 404, {"Content-Type": "text/plain"}, f"No recording for {self.path}"
+            else:
+                status, headers, body = fixture["status"], fixture["headers"], fixture["body"]
+            body = body.encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandinHandler
+
+
+def serve_standin(port: int = 8081, directory=DEFAULT_FIXTURES_DIR, latency: float = 0) -> ThreadingHTTPServer:
+    'Start the stand-in server in a background thread and return it (call .shutdown() to stop it)'
+    server = ThreadingHTTPServer(("", port), make_standin_handler(FixtureStore(directory), latency))
+    threading.Thread(target=server.serve_forever, name="campusdish-standin", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve recorded campusdish responses over HTTP")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fixtures", default=os.getenv("UPSTREAM_FIXTURES_DIR", DEFAULT_FIXTURES_DIR))
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every response")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("", args.port), make_standin_handler(FixtureStore(args.fixtures), args.latency_ms / 1000))
+    print(f"Serving recordings from {args.fixtures} on port {args.port}")
+    server.serve_forever()
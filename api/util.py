@@ -69,9 +69,9 @@ def read_schedule_UTC(utc_time: str) -> int:
     return normalize_time(local_struct)
 
 
-def get_irvine_time() -> time.struct_time:
-    'Return the local time in normalized format'
-    irvine_time = time.gmtime(time.time() + IRVINE_OFFSET)
+def get_irvine_time(now: float = None) -> time.struct_time:
+    'Return the local time (now, or the given time.time() value) in normalized format'
+    irvine_time = time.gmtime((time.time() if now is None else now) + IRVINE_OFFSET)
     return irvine_time
 
 
@@ -109,6 +109,11 @@ def get_current_meal():
         return 0
 
 
+def get_meals_for_weekday(weekday: int) -> list:
+    'Meal ids served on the given weekday (0=monday): breakfast, lunch (brunch on weekends) and dinner'
+    return [0, 3 if weekday >= 5 else 1, 2]
+
+
 def get_meal_name(schedule: dict, meal_id: int) -> str:
 
     if schedule:
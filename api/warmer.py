@@ -0,0 +1,96 @@
+'''
+Pre-populates the Firebase cache for every location and meal, today and the next few days,
+so user-facing requests don't have to wait for campusdish after a meal boundary.
+
+Run it from the project root (with the same env vars as the server), e.g. from cron:
+    python -m api.warmer --days 2
+'''
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+
+from .util import LOCATION_INFO, MEAL_TO_PERIOD, get_meals_for_weekday
+from .parsing import make_response_body
+from .firebase_utils import get_menu_body, set_menu_body
+from .freshness import get_seconds_until_expiry
+
+# entries that stay valid for longer than this (seconds, going by the ttl in freshness.py) are left alone.
+# should be at least as long as the time between warmer runs, so nothing expires before the next run gets to it
+WARM_AHEAD = float(os.getenv("WARM_AHEAD", 30 * 60))
+
+
+def get_warm_targets(days: int) -> list:
+    '''
+    Every (location, meal, date) for today and the next `days` days, only for the meals served that weekday.
+    Today's date is None, which is the Firebase key clients hit when they don't pass a date.
+    '''
+    today = datetime.now(pytz.timezone("America/Los_Angeles"))
+    targets = []
+    for offset in range(days + 1):
+        day = today + timedelta(days=offset)
+        date = None if offset == 0 else day.strftime('%m/%d/%Y')
+        for location in LOCATION_INFO:
+            for meal in get_meals_for_weekday(day.weekday()):
+                targets.append((location, meal, date))
+    return targets
+
+
+def is_fresh(data: dict, ahead: float) -> bool:
+    'True if the cached body is still valid `ahead` seconds from now'
+    if data is None:
+        return False
+    remaining = get_seconds_until_expiry(data)
+    return remaining is None or remaining > ahead
+
+
+def warm_entry(location: str, meal: int, date: str, ahead: float = WARM_AHEAD, force: bool = False) -> str:
+    '''
+    Rebuild one cache entry unless it's still fresh. Returns 'refreshed' or 'skipped'.
+    '''
+    cached = get_menu_body(location, meal, date, join=False)
+    if not force and is_fresh(cached, ahead):
+        return 'skipped'
+    set_menu_body(location, meal, date, make_response_body(location, meal, date), previous=cached)
+    return 'refreshed'
+
+
+def warm_cache(days: int = 1, max_workers: int = 4, ahead: float = WARM_AHEAD, force: bool = False) -> dict:
+    '''
+    Warm every location and meal for today and the next `days` days, at most `max_workers` at a time.
+    Returns a report with the entries that were refreshed, skipped (still fresh) or failed.
+    '''
+    report = {'refreshed': [], 'skipped': [], 'failed': []}
+
+    def warm(target):
+        location, meal, date = target
+        label = f"{location} {MEAL_TO_PERIOD[meal][1]} {date or 'today'}"
+        try:
+            return warm_entry(location, meal, date, ahead, force), label
+        except Exception:
+            traceback.print_exc()
+            return 'failed', label
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for outcome, label in executor.map(warm, get_warm_targets(days)):
+            report[outcome].append(label)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-populate the Firebase cache for upcoming meals")
+    parser.add_argument("--days", type=int, default=1, help="how many days after today to warm (default 1)")
+    parser.add_argument("--workers", type=int, default=4, help="how many entries to build at the same time")
+    parser.add_argument("--ahead", type=float, default=WARM_AHEAD, help="skip entries that are still valid this many seconds from now")
+    parser.add_argument("--force", action="store_true", help="rebuild entries even if they're fresh")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    report = warm_cache(args.days, args.workers, args.ahead, args.force)
+    report['seconds'] = round(time.monotonic() - start, 2)
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,54 @@
+'''
+Fills the Firebase cache a week at a time: one weekly campusdish call per location and meal
+instead of one call per day.
+
+Run it from the project root (with the same env vars as the server):
+    python -m api.weekly --start 01/08/2024 --days 7
+'''
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from .util import LOCATION_INFO, MEAL_TO_PERIOD, get_name
+from .parsing import get_week_menus, get_location_details, make_response_body
+from .firebase_utils import set_menu_body
+
+
+def ingest_week(location: str, start_date: str, days: int = 7, meals: list = None) -> list:
+    '''
+    Builds and stores the response body for every meal and day for the location, starting at start_date (mm/dd/yyyy).
+    The schedule and themed events are scraped once, and each meal is one weekly menu call.
+    Meals are only stored on the days they're served (get_week_menus skips the rest, e.g. brunch on weekdays).
+    Returns the (meal, date) pairs that were stored.
+    '''
+    schedule, themed = get_location_details(get_name(location))
+    stored = []
+    for meal in meals or MEAL_TO_PERIOD:
+        for date, menu in get_week_menus(location, meal, start_date, days).items():
+            body = make_response_body(location, meal, date, schedule=schedule, themed=themed, menu=menu)
+            set_menu_body(location, meal, date, body)
+            stored.append((meal, date))
+    return stored
+
+
+def ingest_all(start_date: str, days: int = 7, max_workers: int = 2) -> dict:
+    'Runs ingest_week for every location, at most max_workers at a time. Returns {location: number of entries stored}'
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda location: (location, len(ingest_week(location, start_date, days))), LOCATION_INFO)
+        return dict(results)
+
+
+if __name__ == "__main__":
+    today = datetime.now(pytz.timezone("America/Los_Angeles")).strftime('%m/%d/%Y')
+    parser = argparse.ArgumentParser(description="Fill the Firebase cache a week at a time")
+    parser.add_argument("--start", default=today, help="first day to store, mm/dd/yyyy (default today)")
+    parser.add_argument("--days", type=int, default=7, help="how many days to store (default 7)")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    report = ingest_all(args.start, args.days)
+    print(json.dumps({'stored': report, 'seconds': round(time.monotonic() - start, 2)}, indent=4))
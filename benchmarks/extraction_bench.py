@@ -0,0 +1,51 @@
+'''
+Compares the location page extraction backends (api.extraction.BACKENDS) on saved pages,
+checking they give the same result.
+
+Run from the project root:
+    python -m benchmarks.extraction_bench [page.html ...]
+With no pages, it uses the fixtures in tests/fixtures, padded out to about the size of a real campusdish page.
+'''
+import json
+import timeit
+from pathlib import Path
+
+from api.extraction import BACKENDS, extract_location_page
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+
+# filler markup (navigation, menus, scripts) so the fixture pages are about as big as the real ones
+FILLER = '<div class="card"><a href="/menu/{i}">Item {i}</a><p>Lorem ipsum <b>dolor</b> sit amet</p></div>\n'
+
+
+def load_pages(paths: list, pad_to: int = 250_000) -> dict:
+    pages = {}
+    for path in paths or sorted(FIXTURES.glob("*.html")):
+        html = Path(path).read_text(encoding="utf-8")
+        if not paths:
+            filler = "".join(FILLER.format(i=i) for i in range(max(0, pad_to - len(html)) // len(FILLER.format(i=0))))
+            html = html.replace("<main>", "<main>" + filler, 1)
+        pages[Path(path).name] = html
+    return pages
+
+
+def main(paths: list = None, number: int = 5) -> dict:
+    results = {}
+    for name, html in load_pages(paths).items():
+        extracted = {backend: extract_location_page(html, backend) for backend in BACKENDS}
+        assert all(page == extracted["stream"] for page in extracted.values()), f"backends disagree on {name}"
+        results[name] = {"bytes": len(html.encode())}
+        for backend in BACKENDS:
+            seconds = min(timeit.repeat(lambda: extract_location_page(html, backend), number=number, repeat=3)) / number
+            results[name][f"{backend}Milliseconds"] = round(seconds * 1e3, 2)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="saved location pages (default: the test fixtures)")
+    parser.add_argument("--number", type=int, default=5, help="runs per timing")
+    args = parser.parse_args()
+    print(json.dumps(main(args.pages, args.number), indent=4))
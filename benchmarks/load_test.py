@@ -0,0 +1,175 @@
+'''
+Load test for the /api handler against the recorded campusdish responses (tests/fixtures/upstream), so it's reproducible
+and needs no network. Reports throughput, end-to-end latency percentiles, and per-phase latency percentiles
+(upstream, parse, transform, serialize, cache, ...) from api.tracing, and writes them to a JSON file for comparing commits.
+
+Run from the project root:
+    python -m benchmarks.load_test --concurrency 16 --requests 500 --upstream-latency-ms 150
+    python -m benchmarks.load_test --firebase   # with USE_CACHE on, against the in-memory Firebase fake
+'''
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+
+import requests
+
+
+def percentile(values: list, pct: float) -> float:
+    'Nearest-rank percentile of an unsorted list'
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(seconds: list) -> dict:
+    return {
+        "count": len(seconds),
+        "p50Ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95Ms": round(percentile(seconds, 95) * 1000, 3),
+        "p99Ms": round(percentile(seconds, 99) * 1000, 3),
+        "meanMs": round(sum(seconds) / len(seconds) * 1000, 3) if seconds else 0,
+    }
+
+
+def make_request_mix(total: int, days: int, seed: int) -> list:
+    'Random /api paths over every location, meal and the next `days` days (plus plain "current meal" requests)'
+    from api.util import LOCATION_INFO, MEAL_TO_PERIOD
+
+    rng = random.Random(seed)
+    today = datetime.now()
+    paths = []
+    for _ in range(total):
+        location = rng.choice(list(LOCATION_INFO))
+        if rng.random() < 0.3:
+            paths.append(f"/api?location={location}")
+            continue
+        meal = rng.choice(list(MEAL_TO_PERIOD))
+        date = (today + timedelta(days=rng.randrange(days))).strftime("%m/%d/%Y")
+        paths.append(f"/api?location={location}&meal={meal}&date={date}")
+    return paths
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(concurrency: int, total: int, days: int, upstream_latency: float, firebase: bool, seed: int, compressed: bool) -> dict:
+    if firebase:
+        # these are read when api.index is imported
+        os.environ["USE_CACHE"] = "True"
+        os.environ["FIREBASE_FAKE"] = "True"
+    from api import tracing, upstream
+    from api.index import handler, RESPONSE_CACHE
+
+    upstream.configure(mode="replay", latency=upstream_latency)
+    tracing.enable()
+    RESPONSE_CACHE.clear()
+
+    traces = []
+    traces_lock = threading.Lock()
+
+    def collect(trace):
+        with traces_lock:
+            traces.append(trace)
+    tracing.add_listener(collect)
+
+    class LoadTestHandler(handler):
+        protocol_version = "HTTP/1.1"  # so each worker's session reuses its connection, like clients behind a CDN would
+
+        def log_message(self, *args):
+            pass  # keep the per-request log lines out of the output
+
+    server = ThreadingHTTPServer(("localhost", 0), LoadTestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://localhost:{server.server_port}"
+
+    paths = make_request_mix(total, days, seed)
+    next_index = iter(range(total))
+    index_lock = threading.Lock()
+    latencies = []
+    statuses = Counter()
+    results_lock = threading.Lock()
+    headers = {"Accept-Encoding": "gzip"} if compressed else {"Accept-Encoding": "identity"}
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            response = session.get(base_url + paths[i], headers=headers)
+            elapsed = time.perf_counter() - start
+            with results_lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+    tracing.remove_listener(collect)
+
+    phases = defaultdict(list)
+    cache_outcomes = Counter()
+    for trace in traces:
+        for name, seconds in trace.phases.items():
+            phases[name].append(seconds)
+        cache_outcomes[str(trace.attributes.get("cache"))] += 1
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "concurrency": concurrency,
+            "requests": total,
+            "days": days,
+            "upstreamLatencyMs": upstream_latency * 1000,
+            "firebase": firebase,
+            "compressed": compressed,
+            "seed": seed,
+        },
+        "throughputRps": round(total / wall, 2),
+        "wallSeconds": round(wall, 3),
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "cache": dict(cache_outcomes),
+        "latency": summarize(latencies),
+        "serverLatency": summarize([trace.duration for trace in traces]),
+        "phases": {name: summarize(seconds) for name, seconds in sorted(phases.items())},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="clients sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=200, help="total number of requests")
+    parser.add_argument("--days", type=int, default=7, help="spread requests over this many days from today")
+    parser.add_argument("--upstream-latency-ms", type=float, default=100, help="delay added to every recorded campusdish response")
+    parser.add_argument("--firebase", action="store_true", help="turn on USE_CACHE with the in-memory Firebase fake")
+    parser.add_argument("--gzip", action="store_true", help="ask for gzip-compressed responses")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the request mix")
+    parser.add_argument("--output", "-o", default="load_test_results.json", help="where to write the results")
+    args = parser.parse_args()
+
+    results = run(args.concurrency, args.requests, args.days, args.upstream_latency_ms / 1000, args.firebase, args.seed, args.gzip)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,111 @@
+'''
+Micro-benchmark for the menu transformer (parsing._shape_menu) on a payload the size of public/example.json.
+
+Run from the project root:
+    python -m benchmarks.transform_bench
+'''
+import json
+import timeit
+from collections import defaultdict
+from pathlib import Path
+
+from api.parsing import _shape_menu, _lower_first_letter
+from api.sorting import station_ordering_key
+from api.util import NUTRITION_PROPERTIES, EMPTY_MENU_OBJECT
+
+EXAMPLE_PATH = Path(__file__).resolve().parent.parent / "public" / "example.json"
+
+ICON_URL = "https://images.elevate-dxp.com/campusdish/icons/{}.png"
+
+# badge in the icon url -> flag in the example dishes
+BADGE_FLAGS = (("EatWell", "isEatWell"), ("PlantForward", "isPlantForward"), ("WholeGrain", "isWholeGrains"))
+
+
+def _upper_first_letter(s: str) -> str:
+    return s[0].upper() + s[1:]
+
+
+def make_campusdish_payload(copies: int = 1) -> dict:
+    '''
+    Rebuilds a campusdish menu payload (the dict at diner_json['Menu']) from the dishes in public/example.json.
+    copies > 1 repeats the dishes to make a bigger payload.
+    '''
+    example = json.loads(EXAMPLE_PATH.read_text())
+    stations = []
+    products = []
+    for station_id, station in enumerate(example["all"]):
+        stations.append({"StationId": station_id, "Name": station["station"].replace(" / ", "/ ")})
+        for _ in range(copies):
+            for category in station["menu"]:
+                for item in category["items"]:
+                    nutrition = item["nutrition"]
+                    badge_flags = {flag for _, flag in BADGE_FLAGS}
+                    product = {_upper_first_letter(key): value for key, value in nutrition.items() if key not in badge_flags}
+                    badges = [badge for badge, flag in BADGE_FLAGS if nutrition.get(flag)]
+                    product.update({
+                        "MarketingName": item["name"],
+                        "ShortDescription": item["description"],
+                        "Categories": [{"DisplayName": category["category"]}],
+                        "DietaryInformation": [{"IconUrl": ICON_URL.format(badge)} for badge in ["Vegetarian", *badges]],
+                    })
+                    products.append({"StationId": station_id, "Product": product})
+    return {"MenuStations": stations, "MenuProducts": products}
+
+
+def reference_shape_menu(menu_data: dict) -> list:
+    'The per-dish dict building _shape_menu replaced, kept here to check the output is identical and to compare speed'
+
+    def _find_icon(icon_property: str, food_info: dict) -> bool:
+        return any(map(lambda diet_info: icon_property in diet_info["IconUrl"], food_info["DietaryInformation"]))
+
+    station_dict = defaultdict(lambda: defaultdict(lambda: []))
+    station_id_to_name = dict([(entry['StationId'], entry['Name']) for entry in menu_data["MenuStations"]])
+    for dish in menu_data["MenuProducts"]:
+        details = dish['Product']
+        station_name = station_id_to_name[dish['StationId']].replace('/ ', ' / ')
+        category_name = details['Categories'][0]['DisplayName']
+        dish_object = {
+            'name': details['MarketingName'],
+            'description': details['ShortDescription'],
+            'nutrition': dict([(_lower_first_letter(property_name), details.get(property_name)) for property_name in NUTRITION_PROPERTIES]) |
+            {
+                'isEatWell': _find_icon('EatWell', details),
+                'isPlantForward': _find_icon('PlantForward', details),
+                'isWholeGrain': _find_icon('WholeGrain', details),
+            },
+        }
+        station_dict[station_name][category_name].append(dish_object)
+    menu = []
+    for station_name in sorted(station_dict, key=station_ordering_key):
+        menu.append({
+            'station': station_name,
+            'menu': [{'category': category, 'items': items} for category, items in station_dict[station_name].items()]
+        })
+    return menu or EMPTY_MENU_OBJECT
+
+
+def main(copies: int = 1, number: int = 200) -> dict:
+    payload = make_campusdish_payload(copies)
+    expected = json.dumps(reference_shape_menu(payload), ensure_ascii=False)
+    actual = json.dumps(_shape_menu(payload), ensure_ascii=False)
+    assert actual == expected, "_shape_menu output differs from the reference implementation"
+
+    reference = min(timeit.repeat(lambda: reference_shape_menu(payload), number=number, repeat=5)) / number
+    current = min(timeit.repeat(lambda: _shape_menu(payload), number=number, repeat=5)) / number
+    return {
+        "dishes": len(payload["MenuProducts"]),
+        "outputBytes": len(actual.encode()),
+        "referenceMicroseconds": round(reference * 1e6, 1),
+        "shapeMenuMicroseconds": round(current * 1e6, 1),
+        "speedup": round(reference / current, 2),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=1, help="repeat the example dishes this many times")
+    parser.add_argument("--number", type=int, default=200, help="runs per timing")
+    args = parser.parse_args()
+    print(json.dumps(main(args.copies, args.number), indent=4))
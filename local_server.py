@@ -3,10 +3,9 @@ import os
 
 load_dotenv()
 
-from http.server import HTTPServer
-from api.index import handler
+from api.server import serve
 
 
 
 
-HTTPServer(("",3000),handler).serve_forever()
\ No newline at end of file
+serve(port=int(os.getenv("PORT", 3000)))
@@ -0,0 +1,53 @@
+import threading
+
+from api.analytics import AnalyticsBuffer, apply_counts
+
+
+def test_apply_counts_merges_into_existing_node():
+    current = {"visitcount": 10, "status": {"200": 9, "500": 1}, "meals": ["ignored", 3]}
+    counts = {("visitcount",): 2, ("status", "200"): 1, ("status", "404"): 1, ("meals", "1"): 1, ("cache", "fresh"): 2}
+    assert apply_counts(current, counts) == {
+        "visitcount": 12,
+        "status": {"200": 10, "500": 1, "404": 1},
+        "meals": {"0": "ignored", "1": 4},  # firebase read it back as a list
+        "cache": {"fresh": 2},
+    }
+    assert apply_counts(None, {("visitcount",): 1}) == {"visitcount": 1}
+
+
+def test_never_flushes_inline_without_background():
+    flushed = []
+    buffer = AnalyticsBuffer(flushed.append, threshold=1, background=False)
+    buffer.record_request("brandywine", 1, 200)
+    buffer.record_request("brandywine", 1, 500)
+    assert flushed == []  # left for the caller, after its response is sent
+    buffer.flush()
+    assert flushed == [{("visitcount",): 2, ("errorcount",): 1, ("status", "200"): 1, ("status", "500"): 1,
+                        ("locations", "brandywine"): 2, ("meals", "lunch"): 2}]
+    assert buffer.pending() == {}
+
+
+def test_background_flush_on_threshold_and_interval():
+    flushed = []
+    done = threading.Event()
+    buffer = AnalyticsBuffer(lambda counts: (flushed.append(counts), done.set()), interval=60, threshold=2)
+    buffer.record_request()
+    buffer.record_request()
+    assert done.wait(5)  # woken up by the threshold long before the interval
+    assert flushed[0][("visitcount",)] == 2
+
+    flushed.clear()
+    done.clear()
+    buffer = AnalyticsBuffer(lambda counts: (flushed.append(counts), done.set()), interval=0.1, threshold=50)
+    buffer.record_request()
+    assert done.wait(5)
+    assert flushed[0][("visitcount",)] == 1
+
+
+def test_failed_flush_keeps_counts():
+    def fail(counts):
+        raise RuntimeError("firebase is down")
+    buffer = AnalyticsBuffer(fail, threshold=1, background=False)
+    buffer.record_request()
+    buffer.flush()
+    assert buffer.pending()[("visitcount",)] == 1
@@ -0,0 +1,70 @@
+import gzip
+from http.server import HTTPServer
+from threading import Thread
+
+import requests
+
+from api import compression, upstream
+from api.compression import choose_encoding, accepts_identity, compress
+from api.index import handler, RESPONSE_CACHE
+
+
+def test_choose_encoding_q_values(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())  # pretend it's installed
+    assert choose_encoding(None) is None
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("br;q=0, gzip;q=0.5") == "gzip"
+    assert choose_encoding("br;q=0,gzip;q=0") is None
+    assert choose_encoding("*") == "br"
+    assert choose_encoding("*;q=0.1, br;q=0") == "gzip"
+    assert choose_encoding("gzip;level=9;q=0.8") == "gzip"
+    assert choose_encoding("gzip;q=abc, deflate") is None
+
+
+def test_identity_refused():
+    assert accepts_identity(None)
+    assert accepts_identity("gzip")
+    assert not accepts_identity("gzip, identity;q=0")
+    assert not accepts_identity("gzip, *;q=0")
+    assert accepts_identity("gzip, *;q=0, identity")
+
+
+def test_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert compression.supported_encodings() == ("gzip",)
+    assert choose_encoding("br") is None
+    assert choose_encoding("br, gzip") == "gzip"
+    assert gzip.decompress(compress(b"{}", "gzip")) == b"{}"
+
+
+def test_vary_and_etag_per_encoding():
+    upstream.configure(mode="replay")
+    RESPONSE_CACHE.clear()
+    server = HTTPServer(("localhost", 0), handler)
+    p = Thread(target=lambda: [server.handle_request() for _ in range(5)])
+    p.start()
+    try:
+        url = f"http://localhost:{server.server_port}/api?location=brandywine&meal=1&date=10/19/2026"
+        plain = requests.get(url, headers={"Accept-Encoding": "identity"})
+        gzipped = requests.get(url, headers={"Accept-Encoding": "gzip"})
+        assert plain.headers["Vary"] == gzipped.headers["Vary"] == "Accept-Encoding"
+        assert "Content-Encoding" not in plain.headers
+        assert gzipped.headers["Content-Encoding"] == "gzip"
+        assert gzipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+        assert plain.json() == gzipped.json()
+
+        # either tag is the same content, so it's a 304 for both
+        not_modified = requests.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == gzipped.headers["ETag"]
+        assert not_modified.headers["Vary"] == "Accept-Encoding"
+        assert requests.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": gzipped.headers["ETag"]}).status_code == 304
+
+        # small bodies are only compressed when identity is refused
+        stats_url = f"http://localhost:{server.server_port}/api?cachestats=1"
+        assert requests.get(stats_url, headers={"Accept-Encoding": "gzip, identity;q=0"}).headers["Content-Encoding"] == "gzip"
+    finally:
+        p.join()
+        server.server_close()
+        upstream.configure(mode="live")
+        RESPONSE_CACHE.clear()
@@ -0,0 +1,88 @@
+import os
+import time
+
+os.environ.setdefault("FIREBASE_FAKE", "True")  # has to be set before firebase_utils gets imported
+
+from api import firebase_fake, firebase_utils
+from api.dish_table import DishCache, pack_body
+from api.util import MENU_DATA_ERROR_OBJECT
+
+
+def dish(name: str) -> dict:
+    return {"name": name, "description": "", "nutrition": {"calories": "100", "isVegan": False}}
+
+
+def body(date: str, dishes: list) -> dict:
+    return {
+        "date": date,
+        "restaurant": "Brandywine",
+        "refreshTime": 1,
+        "all": [{"station": "Home", "menu": [{"category": "Entrees", "items": dishes}]}],
+    }
+
+
+def test_menus_share_stored_dishes():
+    firebase_fake.reset()
+    firebase_utils.DISHES = DishCache(firebase_utils.DISHES.fetch_dish, firebase_utils.DISHES.fetch_table)
+    monday = body("10/19/2026", [dish("Pizza"), dish("Soup")])
+    tuesday = body("10/20/2026", [dish("Pizza"), dish("Salad")])
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", monday)
+    firebase_utils.set_menu_body("brandywine", 1, "10/20/2026", tuesday)
+
+    assert len(firebase_fake.reference("dishes").get(shallow=True)) == 3
+    stored = firebase_utils.get_menu_body("brandywine", 1, "10/20/2026", join=False)
+    assert all(isinstance(dish_id, str) for dish_id in stored["all"][0]["menu"][0]["items"])
+
+    # a new instance (with nothing cached) gets the same bodies back
+    firebase_utils.DISHES = DishCache(firebase_utils.DISHES.fetch_dish, firebase_utils.DISHES.fetch_table)
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026") == monday
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/20/2026") == tuesday
+    firebase_fake.reset()
+
+
+def test_placeholder_menus_are_not_packed():
+    error_body = body("10/19/2026", [])
+    error_body["all"] = MENU_DATA_ERROR_OBJECT
+    assert pack_body(error_body) == (error_body, {})
+
+
+def test_refresh_after_the_sweeper_removed_dishes():
+    from api.sweeper import sweep
+
+    firebase_fake.reset()
+    firebase_utils.DISHES = DishCache(firebase_utils.DISHES.fetch_dish, firebase_utils.DISHES.fetch_table)
+    monday = body("10/19/2026", [dish("Pizza"), dish("Soup")])
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", monday)
+
+    # the menu goes away (like an expired one being swept) and takes its dishes with it
+    firebase_fake.reference("brandywine").delete()
+    sweep(dishes=True)
+    assert not firebase_fake.reference("dishes").get(shallow=True)
+
+    # the same instance (which has the dishes cached) writes the menu again, and everyone can still read it
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", monday)
+    firebase_utils.DISHES = DishCache(firebase_utils.DISHES.fetch_dish, firebase_utils.DISHES.fetch_table)
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026") == monday
+
+    # the dishes go away but the menu stays: it can't be joined anymore, and rebuilding it on top of itself puts them back
+    monday = {**monday, "refreshTime": int(time.time())}
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", monday)
+    firebase_fake.reference("dishes").delete()
+    firebase_utils.DISHES = DishCache(firebase_utils.DISHES.fetch_dish, firebase_utils.DISHES.fetch_table)
+    previous = firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False)
+    assert firebase_utils.join_menu_body(previous) is None
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", {**monday, "refreshTime": monday["refreshTime"] + 1}, previous=previous)
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026")["all"] == monday["all"]
+    firebase_fake.reset()
+
+
+def test_cold_join_reads_the_table_once():
+    dishes = {f"{i:020d}": dish(f"Dish {i}") for i in range(30)}
+    calls = []
+    cache = DishCache(lambda dish_id: calls.append(dish_id) or dishes.get(dish_id), lambda: calls.append("table") or dishes)
+    node = {"date": "10/19/2026", "dishRefs": True, "all": [{"station": "Home", "menu": [{"category": "Entrees", "items": list(dishes)}]}]}
+
+    assert cache.join(node)["all"][0]["menu"][0]["items"] == list(dishes.values())
+    assert calls == ["table"]
+    cache.join(node)
+    assert calls == ["table"]  # everything is cached now
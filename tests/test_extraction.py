@@ -0,0 +1,22 @@
+from pathlib import Path
+
+import pytest
+
+from api.campusdish_interface import get_themed_event_data
+from api.extraction import BACKENDS, extract_location_page
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+@pytest.mark.parametrize("fixture", sorted(FIXTURES.glob("*.html")), ids=lambda path: path.name)
+def test_backends_agree(fixture: Path):
+    html = fixture.read_text(encoding="utf-8")
+    pages = {backend: extract_location_page(html, backend) for backend in BACKENDS}
+    assert pages["stream"] == pages["soup"]
+
+
+def test_location_page_fixture():
+    page = extract_location_page((FIXTURES / "location_page.html").read_text(encoding="utf-8"))
+    assert page.meal_periods == ["Breakfast", "Brunch", "Lunch", "Dinner", "Latenight"]
+    assert page.location_times[0] == "7:15AM - 11:00AM"
+    assert [event["name"] for event in get_themed_event_data("Brandywine", page)] == ["Halloween & Harvest Dinner", "Thanksgiving Feast"]
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from api import freshness
+from api.util import MENU_DATA_ERROR_OBJECT, EMPTY_MENU_OBJECT, EVENTS_PLACEHOLDER
+
+SCHEDULE = {"breakfast": {"start": 715, "end": 1100}, "lunch": {"start": 1100, "end": 1630}}
+
+
+@pytest.fixture
+def irvine_noon(monkeypatch):
+    'Pretend it\'s 12:00 on 10/19/2026 in Irvine'
+    monkeypatch.setattr(freshness, "get_irvine_time", lambda: time.strptime("10/19/2026 12:00", "%m/%d/%Y %H:%M"))
+
+
+def body(date: str, meal: str, refreshed_ago: float = 0) -> dict:
+    return {"date": date, "currentMeal": meal, "schedule": SCHEDULE, "refreshTime": int(time.time() - refreshed_ago), "all": []}
+
+
+def test_cache_ttl_follows_the_schedule(irvine_noon):
+    assert freshness.get_cache_ttl(body("10/18/2026", "lunch")) is None  # past day
+    assert freshness.get_cache_ttl(body("10/19/2026", "breakfast")) == freshness.FUTURE_TTL  # today, breakfast is over
+    assert freshness.get_cache_ttl(body("10/19/2026", "lunch")) == freshness.CURRENT_MEAL_TTL
+    assert freshness.get_cache_ttl(body("10/20/2026", "lunch")) == freshness.FUTURE_TTL
+
+    # never kept for good when parts of it are placeholders
+    empty_body = {**body("10/18/2026", "lunch"), "all": EMPTY_MENU_OBJECT}
+    assert freshness.get_cache_ttl(empty_body) == freshness.FUTURE_TTL
+    invalid_time = {"breakfast": {"start": 0, "end": 1}, "lunch": {"start": 2, "end": 3}, "dinner": {"start": 4, "end": 5}}
+    assert freshness.get_cache_ttl({**body("10/18/2026", "lunch"), "schedule": invalid_time}) == freshness.FUTURE_TTL
+    assert freshness.get_cache_ttl({**body("10/18/2026", "lunch"), "themed": EVENTS_PLACEHOLDER}) == freshness.FUTURE_TTL
+
+    error_body = body("10/18/2026", "lunch")
+    error_body["all"] = MENU_DATA_ERROR_OBJECT
+    assert freshness.get_cache_ttl(error_body) == freshness.ERROR_TTL
+
+
+def test_is_expired(irvine_noon):
+    assert not freshness.is_expired(body("10/18/2026", "lunch", refreshed_ago=10 ** 7))
+    assert not freshness.is_expired(body("10/19/2026", "lunch", refreshed_ago=60))
+    assert freshness.is_expired(body("10/19/2026", "lunch", refreshed_ago=freshness.CURRENT_MEAL_TTL + 1))
+
+
+def test_client_max_age_for_the_implicit_meal(monkeypatch):
+    # at 10:50 breakfast has 10 minutes left, and the current meal url switches to lunch at the same time
+    monkeypatch.setattr(freshness, "get_irvine_time", lambda: time.strptime("10/19/2026 10:50", "%m/%d/%Y %H:%M"))
+    breakfast = body("10/19/2026", "breakfast")
+    assert freshness.get_client_max_age(breakfast) == freshness.MIN_MAX_AGE * 10
+    assert freshness.get_client_max_age(body("10/20/2026", "lunch")) == freshness.FUTURE_MAX_AGE
+    assert freshness.get_client_max_age(breakfast, pinned=False) == 10 * 60
+
+    # late at night, dinner is over for good, but the url serves tomorrow's breakfast after midnight
+    monkeypatch.setattr(freshness, "get_irvine_time", lambda: time.strptime("10/19/2026 23:45", "%m/%d/%Y %H:%M"))
+    dinner = {**body("10/19/2026", "dinner"), "schedule": {"dinner": {"start": 1630, "end": 2000}}}
+    assert freshness.get_client_max_age(dinner) == freshness.FUTURE_MAX_AGE
+    assert freshness.get_client_max_age(dinner, pinned=False) == 15 * 60
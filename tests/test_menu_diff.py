@@ -0,0 +1,136 @@
+import calendar
+import json
+import os
+import time
+
+os.environ.setdefault("FIREBASE_FAKE", "True")  # has to be set before firebase_utils gets imported
+
+from api import firebase_fake, firebase_utils
+from api.dish_table import get_dish_id
+from api.menu_diff import diff_paths, describe_changes
+from api.util import IRVINE_OFFSET
+
+
+def dish(name: str, calories: str = "100") -> dict:
+    return {"name": name, "description": "", "nutrition": {"calories": calories, "sodium": None}}
+
+
+def body(refresh_time: int, *stations) -> dict:
+    return {"date": "10/19/2026", "refreshTime": refresh_time, "all": [
+        {"station": name, "menu": [{"category": "Entrees", "items": list(items)}]} for name, items in stations
+    ]}
+
+
+def test_diff_paths():
+    old = {"refreshTime": 1, "all": [{"station": "Grill", "items": ["a", "b", "c"]}], "themed": []}
+    new = {"refreshTime": 2, "all": [{"station": "Grill", "items": ["a", "d"]}], "themed": None}
+    assert diff_paths(old, new) == {"refreshTime": 2, "all/0/items/1": "d", "all/0/items/2": None}
+    assert diff_paths(old, old) == {}
+
+
+def test_describe_changes():
+    old = body(1, ("Grill", [dish("Burger"), dish("Fries")]), ("Deli", [dish("Wrap")]))
+    new = body(2, ("Grill", [dish("Burger", "650"), dish("Hot Dog")]), ("Oven", [dish("Pizza")]))
+    changes = {(change["change"], change["station"], change.get("item")) for change in describe_changes(old, new)}
+    assert changes == {
+        ("changed", "Grill", "Burger"),
+        ("added", "Grill", "Hot Dog"),
+        ("removed", "Grill", "Fries"),
+        ("stationAdded", "Oven", None),
+        ("stationRemoved", "Deli", None),
+    }
+
+
+def record_writes():
+    'Collects every Reference.update value (undone by the returned function)'
+    writes = []
+    original_update = firebase_fake.Reference.update
+    firebase_fake.Reference.update = lambda self, value: (writes.append(value), original_update(self, value))[1]
+    return writes, lambda: setattr(firebase_fake.Reference, "update", original_update)
+
+
+NODE_PATH = "brandywine/10|19|2026/1"
+
+
+def test_refresh_writes_only_changes():
+    firebase_fake.reset()
+    now = int(time.time())
+    old = body(now - 60, ("Grill", [dish("Burger"), dish("Fries")]))
+    new = body(now, ("Grill", [dish("Burger"), dish("Hot Dog")]))
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", old)
+    previous = firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False)
+
+    writes, undo = record_writes()
+    try:
+        changes = firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", new, previous=previous)
+    finally:
+        undo()
+
+    written = {path for path in writes[0] if path.startswith(NODE_PATH)}
+    assert written == {f"{NODE_PATH}/all/0/menu/0/items/1"}  # refreshTime was already moved by the claim
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026") == new
+    assert [change["message"].split(" at ")[0] for change in changes] == ["Hot Dog added to Grill", "Fries removed from Grill"]
+    assert firebase_utils.get_menu_changes("brandywine", 1, "10/19/2026") == changes
+    firebase_fake.reset()
+
+
+def test_full_write_when_previous_is_expired_or_gone():
+    firebase_fake.reset()
+    now = int(time.time())
+    new = body(now, ("Grill", [dish("Burger"), dish("Hot Dog")]))
+
+    # expired: the sweeper could remove it any time, so only writing the changes isn't safe
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", body(1, ("Grill", [dish("Burger")])))
+    previous = firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False)
+    writes, undo = record_writes()
+    try:
+        firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", new, previous=previous)
+    finally:
+        undo()
+    assert NODE_PATH in writes[0]
+
+    # removed (or rewritten) after previous was read
+    previous = firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False)
+    firebase_fake.reference(NODE_PATH).delete()
+    newer = body(now + 1, ("Grill", [dish("Burger")]))
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", newer, previous=previous)
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026") == newer
+    firebase_fake.reset()
+
+
+def test_partial_nodes_count_as_missing():
+    firebase_fake.reset()
+    firebase_fake.reference(NODE_PATH).update({"refreshTime": int(time.time()), "dishRefs": True})
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False) is None
+    firebase_fake.reset()
+
+
+def test_change_messages_use_the_change_time():
+    old = body(1, ("Grill", [dish("Burger")]))
+    new = body(2, ("Grill", [dish("Burger"), dish("Hot Dog")]))
+    now = calendar.timegm((2026, 10, 19, 17, 42, 0)) - IRVINE_OFFSET  # 17:42 in Irvine
+    [change] = describe_changes(old, new, now=now)
+    assert change["time"] == int(now)
+    assert change["message"] == "Hot Dog added to Grill at 17:42"
+
+
+def test_unchanged_refresh_writes_nothing_but_the_claim():
+    firebase_fake.reset()
+    now = int(time.time())
+    menu = [dish(f"Dish {i}") for i in range(30)]
+    firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", body(now - 60, ("Grill", menu)))
+    previous = firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False)
+
+    writes, undo = record_writes()
+    try:
+        assert firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", body(now, ("Grill", menu)), previous=previous) == []
+        assert sum(len(json.dumps(update)) for update in writes) == 0
+
+        # one new dish: only it gets written to the dish table, not the 30 that are already stored
+        previous = firebase_utils.get_menu_body("brandywine", 1, "10/19/2026", join=False)
+        firebase_utils.set_menu_body("brandywine", 1, "10/19/2026", body(now + 1, ("Grill", menu + [dish("Pizza")])), previous=previous)
+    finally:
+        undo()
+    assert [path for path in writes[0] if path.startswith("dishes/")] == [f"dishes/{get_dish_id(dish('Pizza'))}"]
+    assert firebase_utils.get_menu_body("brandywine", 1, "10/19/2026")["refreshTime"] == now + 1
+    firebase_fake.reset()
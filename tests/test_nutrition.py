@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from api.nutrition import NutritionStore
+
+
+def dish(name: str, calories, protein, sodium) -> dict:
+    return {"name": name, "description": "", "nutrition": {"calories": calories, "protein": protein, "sodium": sodium, "isVegan": False}}
+
+
+def body(date: str, station: str, *dishes) -> dict:
+    return {"date": date, "all": [{"station": station, "menu": [{"category": "Entrees", "items": list(dishes)}]}]}
+
+
+@pytest.fixture
+def store():
+    return NutritionStore.from_bodies([
+        ("brandywine", 1, body("10/19/2026", "Grill", dish("Burger", "600", "30", "1200"), dish("Fries", "400", "4", "300"))),
+        ("brandywine", 1, body("10/20/2026", "Grill", dish("Burger", "600", "30", "1200"), dish("Salad", None, "2", "-"))),
+        ("brandywine", 1, body("10/26/2026", "Grill", dish("Chicken", "300", "35", "500"))),
+        ("anteatery", 2, body("10/19/2026", "Oven", dish("Pizza", "300", "12", "700"))),
+    ])
+
+
+def test_station_weekly_average(store):
+    assert store.station_weekly_average("Calories", location="brandywine") == [
+        {"location": "brandywine", "station": "Grill", "week": "10/19/2026", "average": 533.33, "dishes": 3},  # salad has no calories
+        {"location": "brandywine", "station": "Grill", "week": "10/26/2026", "average": 300.0, "dishes": 1},
+    ]
+
+
+def test_protein_per_calorie_and_high_sodium(store):
+    assert [row["dish"] for row in store.protein_per_calorie(top=2)] == ["Chicken", "Burger"]
+    assert store.protein_per_calorie(top=1)[0]["timesServed"] == 1
+
+    alerts = store.high_sodium(threshold=1000)
+    assert [(row["dish"], row["date"], row["meal"]) for row in alerts] == [("Burger", "10/19/2026", "lunch"), ("Burger", "10/20/2026", "lunch")]
+    assert store.high_sodium(threshold=1000, since="10/20/2026")[0]["date"] == "10/20/2026"
+
+
+def test_save_and_load(store, tmp_path):
+    store.save(tmp_path / "nutrition.npz")
+    loaded = NutritionStore.load(tmp_path / "nutrition.npz")
+    assert loaded.summary() == store.summary()
+    assert loaded.station_weekly_average("Protein") == store.station_weekly_average("Protein")
+
+
+def test_merge_keeps_history_and_replaces_menus_in_both(store, tmp_path):
+    recent = NutritionStore.from_bodies([
+        ("brandywine", 1, body("10/26/2026", "Grill", dish("Chicken", "350", "35", "500"))),  # refreshed since the archive was built
+        ("brandywine", 2, body("11/02/2026", "Deli", dish("Wrap", "450", "20", "900"))),
+    ])
+    merged = store.merge(recent)
+    assert len(merged) == len(store) + 1  # the 10/26 lunch is replaced, not added
+    assert merged.summary()["to"] == "11/02/2026" and merged.summary()["from"] == "10/19/2026"
+    chicken = [row for row in merged.protein_per_calorie(top=10) if row["dish"] == "Chicken"]
+    assert chicken[0]["calories"] == 350 and chicken[0]["timesServed"] == 1
+
+    merged.save(tmp_path / "nutrition.npz")
+    assert NutritionStore.load(tmp_path / "nutrition.npz").summary() == merged.summary()
+
+
+def test_cached_bodies_count_each_menu_once(store, tmp_path, monkeypatch):
+    os.environ.setdefault("FIREBASE_FAKE", "True")
+    from api import firebase_fake, nutrition
+
+    firebase_fake.reset()
+    menu = body("01/05/2027", "Grill", dish("Burger", "600", "30", "1200"))
+    firebase_fake.reference().update({
+        # today's menu under the date clients send and under the key used when they don't send one
+        "brandywine/01|05|2027/1": {**menu, "refreshTime": 1},
+        "brandywine/1|5|2027/1": {**menu, "refreshTime": 2},
+        "brandywine/1|5|2027/2": {**menu, "refreshTime": 2},
+    })
+    try:
+        bodies = nutrition.read_cached_bodies()
+        assert sorted((location, meal, body["refreshTime"]) for location, meal, body in bodies) == [("brandywine", 1, 2), ("brandywine", 2, 2)]
+        assert NutritionStore.from_bodies(bodies).protein_per_calorie()[0]["timesServed"] == 2
+
+        # the api reports over the archive (which has the menus the sweeper already removed) plus the cache
+        store.save(tmp_path / "nutrition.npz")
+        monkeypatch.setattr(nutrition, "NUTRITION_ARCHIVE", str(tmp_path / "nutrition.npz"))
+        monkeypatch.setattr(nutrition, "_store", None)
+        monkeypatch.setattr(nutrition, "_store_built", 0)
+        # the cache is read in the background, meanwhile it's the archive on its own
+        assert len(nutrition.get_cached_store()) == len(store)
+        builder = nutrition._builder
+        if builder is not None:
+            builder.join(5)
+        summary = nutrition.get_cached_store().summary()
+        assert (summary["from"], summary["to"], summary["rows"]) == ("10/19/2026", "01/05/2027", len(store) + 2)
+
+        # and dates that aren't real don't break it
+        firebase_fake.reference().update({"brandywine/bad/1": {**menu, "date": "bad", "refreshTime": 3}})
+        assert len(nutrition.read_cached_bodies()) == 2
+    finally:
+        firebase_fake.reset()
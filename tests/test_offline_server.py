@@ -0,0 +1,181 @@
+from http.server import HTTPServer
+from threading import Thread
+import json
+import time
+
+import pytest
+import requests
+
+from api import upstream, tracing
+from api.index import handler, RESPONSE_CACHE
+from api.util import APIResponse
+
+
+@pytest.fixture
+def replay_upstream():
+    """
+    Serve campusdish from the recordings in tests/fixtures/upstream instead of the network.
+    """
+    upstream.configure(mode="replay")
+    RESPONSE_CACHE.clear()
+    yield
+    upstream.configure(mode="live")
+    RESPONSE_CACHE.clear()
+
+
+@pytest.mark.parametrize("location", ["anteatery", "brandywine"])
+def test_server_with_recorded_upstream(replay_upstream, location):
+    """
+    Same as test_server, but against the recorded campusdish responses so it runs without the network.
+    """
+    server = HTTPServer(("localhost", 0), handler)
+    p = Thread(target=server.handle_request)
+    p.start()
+    try:
+        res = requests.get(f"http://localhost:{server.server_port}/api?location={location}&meal=1&date=10/19/2026")
+
+        assert res.status_code == 200
+        body = json.loads(res.content)
+        parsed_body = APIResponse(**body)
+
+        assert parsed_body.all[0]["station"] != "Error"
+        assert parsed_body.themed[0]["name"] == "Halloween & Harvest Dinner"
+    finally:
+        p.join()
+        server.server_close()
+
+
+def test_server_timing_and_metrics(replay_upstream):
+    tracing.enable()
+    tracing.add_listener(tracing.METRICS.record)
+    tracing.METRICS.reset()
+    server = HTTPServer(("localhost", 0), handler)
+    p = Thread(target=server.handle_request)
+    p.start()
+    try:
+        res = requests.get(f"http://localhost:{server.server_port}/api?location=brandywine&meal=1&date=10/19/2026")
+        p.join()
+
+        server_timing = res.headers["Server-Timing"]
+        assert "upstream;dur=" in server_timing
+        assert "total;dur=" in server_timing
+        assert 'cache-outcome;desc="miss"' in server_timing
+
+        metrics = tracing.METRICS.snapshot()
+        assert metrics["requests"]["count"] == 1
+        assert metrics["phases"]["transform"]["count"] == 1
+        assert metrics["cache"] == {"miss": 1}
+    finally:
+        p.join()
+        server.server_close()
+        tracing.remove_listener(tracing.METRICS.record)
+        tracing.enable(False)
+
+
+def test_pooled_server_keep_alive_and_drain(replay_upstream):
+    """
+    Several requests over one kept-alive connection, then a graceful shutdown.
+    """
+    from api.server import PooledHTTPServer
+
+    server = PooledHTTPServer(("localhost", 0), workers=4, backlog=4)
+    serving = Thread(target=server.serve_forever)
+    serving.start()
+    try:
+        session = requests.Session()
+        for location in ("anteatery", "brandywine", "anteatery"):
+            res = session.get(f"http://localhost:{server.server_port}/api?location={location}&meal=1&date=10/19/2026")
+            assert res.status_code == 200
+            assert res.headers.get("Connection") != "close"
+            APIResponse(**res.json())
+    finally:
+        assert server.drain(timeout=10)
+        serving.join()
+
+
+def test_fields_projection(replay_upstream, monkeypatch):
+    import api.parsing
+    menu_calls = []
+    get_menu = api.parsing._get_menu
+    monkeypatch.setattr(api.parsing, "_get_menu", lambda *args: menu_calls.append(args) or get_menu(*args))
+    server = HTTPServer(("localhost", 0), handler)
+    p = Thread(target=lambda: [server.handle_request() for _ in range(3)])
+    p.start()
+    try:
+        base = f"http://localhost:{server.server_port}/api?location=brandywine&meal=1&date=10/19/2026"
+        body = requests.get(base + "&fields=schedule,currentMeal").json()
+        assert set(body) == {"schedule", "currentMeal"}
+        assert not menu_calls  # the menu wasn't needed
+
+        body = requests.get(base + "&fields=date,all.station").json()
+        assert set(body) == {"date", "all"}
+        assert all(set(station) == {"station"} for station in body["all"])
+
+        assert requests.get(base + "&fields=nope").status_code == 400
+    finally:
+        p.join()
+        server.server_close()
+
+
+def test_malformed_date_is_rejected(replay_upstream):
+    server = HTTPServer(("localhost", 0), handler)
+    p = Thread(target=server.handle_request)
+    p.start()
+    try:
+        res = requests.get(f"http://localhost:{server.server_port}/api?location=brandywine&meal=1&date=bad")
+        assert res.status_code == 400
+        assert not RESPONSE_CACHE.stats()["size"]  # never built or cached
+    finally:
+        p.join()
+        server.server_close()
+
+
+def test_implicit_meal_max_age(replay_upstream):
+    from api.freshness import get_seconds_until_meal_switch
+    server = HTTPServer(("localhost", 0), handler)
+    p = Thread(target=lambda: [server.handle_request() for _ in range(2)])
+    p.start()
+    try:
+        base = f"http://localhost:{server.server_port}/api?location=brandywine"
+        implicit = requests.get(base)
+        max_age = int(implicit.headers["Cache-Control"].split("max-age=")[1])
+        assert max_age <= get_seconds_until_meal_switch()
+        pinned = requests.get(base + "&meal=1&date=10/19/2020")  # a past day can be cached for long
+        assert pinned.headers["Cache-Control"].endswith("max-age=86400")
+    finally:
+        p.join()
+        server.server_close()
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_idle_keep_alive_connections_dont_hold_workers(replay_upstream):
+    """
+    More idle kept-alive connections than workers, and new requests (and the idle connections) still get served.
+    """
+    from api.server import PooledHTTPServer
+
+    server = PooledHTTPServer(("localhost", 0), workers=4, backlog=4)
+    serving = Thread(target=server.serve_forever)
+    serving.start()
+    url = f"http://localhost:{server.server_port}/api?location=brandywine&meal=1&date=10/19/2026"
+    sessions = [requests.Session() for _ in range(40)]
+    try:
+        for session in sessions:
+            assert session.get(url, timeout=5).status_code == 200
+        wait_for(lambda: server.idle_connections() == 40)
+
+        assert requests.get(url, timeout=2).status_code == 200
+        for session in sessions[:5]:
+            assert session.get(url, timeout=2).status_code == 200  # same connection, picked back up from the selector
+        wait_for(lambda: server.idle_connections() == 40)
+    finally:
+        for session in sessions:
+            session.close()
+        assert server.drain(timeout=10)
+        serving.join()
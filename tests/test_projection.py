@@ -0,0 +1,45 @@
+import pytest
+
+from api.projection import parse_fields, project
+
+
+def test_parse_fields():
+    assert parse_fields("schedule, all.station") == {"schedule": True, "all": {"station": True}}
+    assert parse_fields("all,all.station") == {"all": True}
+    with pytest.raises(ValueError):
+        parse_fields("menu")
+    with pytest.raises(ValueError):
+        parse_fields(",")
+
+
+def test_project():
+    data = {"date": "10/19/2026", "price": {}, "all": [{"station": "Grill", "menu": []}, {"station": "Oven", "menu": []}]}
+    assert project(data, parse_fields("date,all.station")) == {"date": "10/19/2026", "all": [{"station": "Grill"}, {"station": "Oven"}]}
+
+
+def test_partial_data_checks_the_in_memory_cache(monkeypatch):
+    import time
+    import api.index
+    from api import upstream
+    from api.index import RESPONSE_CACHE, get_partial_data
+
+    upstream.configure(mode="replay")
+    RESPONSE_CACHE.clear()
+    revalidated = []
+    monkeypatch.setattr(api.index._revalidate_executor, "submit", lambda fn, *args: revalidated.append(args))
+    key = ("brandywine", 1, "10/19/2026")
+    fields = parse_fields("restaurant,schedule")
+    try:
+        entry = RESPONSE_CACHE.set(key, {"restaurant": "cached", "schedule": {}}, b"{}")
+        assert get_partial_data(*key, fields)["restaurant"] == "cached"
+        assert not revalidated
+
+        entry.expires_at = time.time() - 1  # stale: still served, and refreshed in the background
+        assert get_partial_data(*key, fields)["restaurant"] == "cached"
+        assert revalidated == [(key, *key)]
+
+        entry.stale_until = time.time() - 1  # too old to serve
+        assert get_partial_data(*key, fields)["restaurant"] == "Brandywine"
+    finally:
+        upstream.configure(mode="live")
+        RESPONSE_CACHE.clear()
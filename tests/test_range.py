@@ -0,0 +1,48 @@
+import pytest
+
+from api import upstream
+from api.index import parse_range_query, get_range_response, InvalidQueryException, RANGE_MAX_DAYS, RESPONSE_CACHE
+
+
+def test_range_entries_skip_meals_not_served():
+    # friday through sunday: lunch on friday, brunch on the weekend
+    entries = parse_range_query({"location": ["brandywine"], "meals": ["1,3"], "start": ["10/23/2026"], "end": ["10/25/2026"]})
+    assert entries == [("brandywine", 1, "10/23/2026"), ("brandywine", 3, "10/24/2026"), ("brandywine", 3, "10/25/2026")]
+
+    entries = parse_range_query({"location": ["all"], "meals": ["all"], "start": ["10/24/2026"]})
+    assert {meal for _location, meal, _date in entries} == {0, 2, 3}
+
+
+@pytest.mark.parametrize("query", [
+    {"start": ["10/25/2026"], "end": ["10/19/2026"]},  # reversed
+    {"start": ["10/01/2026"], "end": ["12/01/2026"]},  # too long
+    {"start": ["2026-10-19"]},  # not mm/dd/yyyy
+    {"start": ["10/19/2026"], "meals": ["lunch"]},
+    {"start": ["10/19/2026"], "meals": ["9"]},
+    {"location": ["nowhere"], "start": ["10/19/2026"]},
+])
+def test_invalid_range_queries(query):
+    with pytest.raises(InvalidQueryException):
+        parse_range_query({"location": ["brandywine"], **query})
+
+
+def test_longest_range_is_allowed():
+    entries = parse_range_query({"location": ["brandywine"], "meals": ["2"], "start": ["10/01/2026"], "end": [f"10/{RANGE_MAX_DAYS:02d}/2026"]})
+    assert len(entries) == RANGE_MAX_DAYS
+
+
+def test_range_response_groups_by_location_date_and_meal():
+    upstream.configure(mode="replay")
+    RESPONSE_CACHE.clear()
+    try:
+        entries = parse_range_query({"location": ["brandywine"], "meals": ["all"], "start": ["10/23/2026"], "end": ["10/24/2026"]})
+        menus = get_range_response(entries)["menus"]
+        assert set(menus) == {"brandywine"}
+        assert {date: set(meals) for date, meals in menus["brandywine"].items()} == {
+            "10/23/2026": {"breakfast", "lunch", "dinner"},
+            "10/24/2026": {"breakfast", "brunch", "dinner"},
+        }
+        assert menus["brandywine"]["10/24/2026"]["brunch"]["date"] == "10/24/2026"
+    finally:
+        upstream.configure(mode="live")
+        RESPONSE_CACHE.clear()
@@ -0,0 +1,35 @@
+import time
+
+from api.response_cache import ResponseCache
+
+
+def test_lru_eviction_and_counters():
+    cache = ResponseCache(max_entries=2, ttl=60, stale_ttl=60)
+    cache.set("a", {"a": 1}, b"a")
+    cache.set("b", {"b": 1}, b"b")
+    assert cache.get("a")[1] == "fresh"  # touching "a" makes "b" the least recently used
+    cache.set("c", {"c": 1}, b"c")
+
+    assert cache.get("b") == (None, "miss")
+    assert cache.get("c")[0].body == b"c"
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["size"] == 2
+
+
+def test_stale_while_revalidate(monkeypatch):
+    cache = ResponseCache(max_entries=8, ttl=10, stale_ttl=20)
+    now = time.time()
+    cache.set("key", {}, b"old")
+
+    monkeypatch.setattr(time, "time", lambda: now + 15)
+    entry, state = cache.get("key")
+    assert (entry.body, state) == (b"old", "stale")
+    assert cache.begin_revalidate("key")
+    assert not cache.begin_revalidate("key")  # only one refresh at a time
+
+    monkeypatch.setattr(time, "time", lambda: now + 31)
+    assert cache.get("key") == (None, "miss")
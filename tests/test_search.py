@@ -0,0 +1,88 @@
+import pytest
+
+from api.search import SearchIndex, parse_ranges
+
+
+def dish(name: str, calories: str, vegan: bool = False, description: str = "") -> dict:
+    return {"name": name, "description": description, "nutrition": {"calories": calories, "isVegan": vegan, "isEatWell": False}}
+
+
+def menu(*dishes) -> list:
+    return [{"station": "Oven", "menu": [{"category": "Entrees", "items": list(dishes)}]}]
+
+
+def test_search_words_flags_and_ranges():
+    index = SearchIndex()
+    index.update("brandywine", 2, "10/19/2026", menu(dish("Cheese Pizza", "300"), dish("Vegan Chili", "250", vegan=True, description="black beans")))
+    index.update("anteatery", 1, "10/20/2026", menu(dish("Pepperoni Pizzas", "400")))
+
+    assert [result["location"] for result in index.search("pizza")] == ["brandywine", "anteatery"]
+    assert index.search("pizz", location="anteatery")[0]["dish"]["name"] == "Pepperoni Pizzas"
+    assert [result["dish"]["name"] for result in index.search("beans", flags=["isVegan"])] == ["Vegan Chili"]
+    assert [result["dish"]["name"] for result in index.search("", ranges={"Calories": (None, 300)})] == ["Cheese Pizza", "Vegan Chili"]
+    assert index.search("pizza chili") == []
+
+
+def test_update_replaces_the_menu():
+    index = SearchIndex()
+    index.update("brandywine", 2, "10/19/2026", menu(dish("Cheese Pizza", "300")))
+    index.update("brandywine", 2, "10/19/2026", menu(dish("Tacos", "300")))
+    assert index.search("pizza") == []
+    assert index.search("tacos")[0]["meal"] == "dinner"
+
+    index.prune("10/20/2026")
+    assert index.stats()["dishes"] == 0
+
+
+def test_parse_ranges():
+    assert parse_ranges({"maxCalories": ["500"], "minCalories": ["100"], "minProtein": ["20"], "location": ["brandywine"]}) == {
+        "Calories": (100, 500),
+        "Protein": (20, None),
+    }
+
+
+def test_dates_sort_and_dedupe_with_or_without_padding():
+    index = SearchIndex()
+    index.update("brandywine", 2, "1/5/2027", menu(dish("Pizza", "300")))
+    index.update("brandywine", 2, "12/31/2026", menu(dish("Pizza", "300")))
+    index.update("brandywine", 2, "01/05/2027", menu(dish("Pizza", "300")))  # same menu as 1/5/2027
+    assert [result["date"] for result in index.search("pizza")] == ["12/31/2026", "01/05/2027"]
+    assert len(index.search("pizza", date="1/5/2027")) == 1
+    index.prune("1/1/2027")
+    assert [result["date"] for result in index.search("pizza")] == ["01/05/2027"]
+
+
+def test_refresh_starts_from_the_cache(monkeypatch):
+    import api.parsing
+    from api import search
+    from api.util import LOCATION_INFO, get_irvine_date
+
+    today = get_irvine_date()
+    fetched = []
+    monkeypatch.setattr(api.parsing, "get_week_menus",
+                        lambda location, meal, start, days, only=None: fetched.append((location, meal, only)) or {date: menu(dish("Soup", "100")) for date in only})
+
+    def read_cached(location, meal, date):
+        if (location, meal, date) == ("brandywine", 2, today):
+            return None
+        return {"all": menu(dish("Pizza", "300"))}
+
+    index = SearchIndex()
+    search.refresh_index(index, days=7, read_cached=read_cached)
+    assert fetched == [("brandywine", 2, {today})]
+    assert index.stats()["menus"] == 7 * 3 * len(LOCATION_INFO)  # only the meals served each day
+    assert index.search("soup")[0]["date"] == today
+
+
+def test_search_doesnt_wait_for_the_index(monkeypatch):
+    import api.index
+    from api.index import get_search_response, UnavailableException
+
+    monkeypatch.setattr(api.index, "ensure_refreshing", lambda wait=0, read_cached=None: False)
+    monkeypatch.setattr(api.index, "SEARCH_INDEX", SearchIndex())
+    with pytest.raises(UnavailableException):
+        get_search_response({"search": ["pizza"]})
+
+    api.index.SEARCH_INDEX.update("brandywine", 2, "10/19/2026", menu(dish("Cheese Pizza", "300")))
+    response = get_search_response({"search": ["pizza"]})
+    assert response["count"] == 1 and response["complete"] is False
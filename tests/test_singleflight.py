@@ -0,0 +1,77 @@
+import threading
+import time
+
+from api.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "menu"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("brandywine", slow))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [("menu", False)] + [("menu", True)] * 7
+    assert flight.coalesced == 7
+    assert flight.in_flight() == 0
+    # once it's done, the next call runs again
+    assert flight.do("brandywine", lambda: "new menu") == ("new menu", False)
+
+
+def test_waiters_get_the_error():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)  # keep the call running until every waiter has joined it
+        raise ValueError("campusdish is down")
+
+    def not_called():
+        raise AssertionError("waiters shouldn't run their own call")
+
+    errors = []
+
+    def wait():
+        try:
+            flight.do("key", not_called)
+        except ValueError as e:
+            errors.append(e)
+
+    leader_errors = []
+
+    def lead():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            leader_errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert started.wait(5)
+    waiters = [threading.Thread(target=wait) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    deadline = time.monotonic() + 5
+    while flight.coalesced < 3:
+        assert time.monotonic() < deadline, "waiters never joined the call"
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    for waiter in waiters:
+        waiter.join()
+
+    assert len(leader_errors) == 1
+    assert errors == leader_errors * 3  # the same exception, not one of their own
+    assert flight.in_flight() == 0
@@ -0,0 +1,32 @@
+import json
+import os
+import time
+
+from api import sorting
+from api.sorting import get_station_sort_key, station_ordering_key
+
+
+def test_unknown_stations_go_last_in_a_stable_order():
+    stations = ["Zebra Bar", "Soups", "Home", "Apple Stand"]
+    assert sorted(stations, key=station_ordering_key) == ["Home", "Soups", "Apple Stand", "Zebra Bar"]
+
+
+def test_orderings_file_is_reloaded(tmp_path, monkeypatch):
+    orderings_file = tmp_path / "orderings.json"
+    orderings_file.write_text(json.dumps({"default": ["Soups", "Home"], "locations": {"anteatery": ["Vegan"]}}))
+    monkeypatch.setattr(sorting, "ORDERINGS_FILE", str(orderings_file))
+    monkeypatch.setattr(sorting, "_last_reload_check", 0)
+    monkeypatch.setattr(sorting, "_ranks", sorting._ranks)
+    monkeypatch.setattr(sorting, "_file_mtime", None)
+
+    stations = ["Home", "Vegan", "Soups"]
+    assert sorted(stations, key=get_station_sort_key("anteatery")) == ["Vegan", "Soups", "Home"]
+    assert sorted(stations, key=get_station_sort_key("brandywine")) == ["Soups", "Home", "Vegan"]
+
+    # rewriting the file changes the order, once RELOAD_INTERVAL has passed since the last check
+    orderings_file.write_text(json.dumps({"default": ["Home", "Vegan", "Soups"]}))
+    os.utime(orderings_file, (1, 1))  # make sure the mtime differs even on filesystems with coarse timestamps
+    assert sorted(stations, key=get_station_sort_key("brandywine")) == ["Soups", "Home", "Vegan"]  # not checked again yet
+    monkeypatch.setattr(sorting, "_last_reload_check", time.monotonic() - sorting.RELOAD_INTERVAL)
+    assert sorted(stations, key=get_station_sort_key("brandywine")) == ["Home", "Vegan", "Soups"]
+    assert sorted(stations, key=get_station_sort_key("anteatery")) == ["Home", "Vegan", "Soups"]  # its own ordering is gone
@@ -0,0 +1,34 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("FIREBASE_FAKE", "True")  # has to be set before firebase_utils gets imported
+
+from api import firebase_fake
+from api.sweeper import sweep
+
+
+def test_sweep_removes_old_days_expired_menus_and_leases():
+    firebase_fake.reset()
+    root = firebase_fake.reference()
+    today = datetime.now()
+    old = (today - timedelta(days=30)).strftime("%m|%d|%Y")
+    future_date = today + timedelta(days=2)
+    future = future_date.strftime("%m|%d|%Y")
+    fresh_body = {"date": future_date.strftime("%m/%d/%Y"), "refreshTime": int(time.time()), "all": []}
+    expired_body = dict(fresh_body, refreshTime=0)
+    root.update({
+        f"brandywine/{old}/1": fresh_body,
+        f"brandywine/{future}/0": expired_body,
+        f"brandywine/{future}/1": fresh_body,
+        f"leases/brandywine/{future}/0": {"owner": "crashed", "expires": 0},
+        "analytics/count": 3,
+    })
+
+    removed = sweep(retention_days=14)
+
+    assert sorted(removed) == sorted([f"brandywine/{old}", f"changes/brandywine/{old}", f"brandywine/{future}/0", f"leases/brandywine/{future}/0"])
+    assert root.child("brandywine").get(shallow=True) == {future: True}
+    assert firebase_fake.reference(f"brandywine/{future}/1").get() is not None
+    assert firebase_fake.reference("analytics/count").get() == 3
+    firebase_fake.reset()
@@ -0,0 +1,17 @@
+import os
+from datetime import datetime
+
+os.environ.setdefault("FIREBASE_FAKE", "True")
+
+from api.util import LOCATION_INFO
+from api.warmer import get_warm_targets
+
+
+def test_only_warms_meals_served_that_day():
+    targets = get_warm_targets(days=6)
+    assert len(targets) == 7 * 3 * len(LOCATION_INFO)
+    for _location, meal, date in targets:
+        if date is None:
+            continue
+        weekend = datetime.strptime(date, "%m/%d/%Y").weekday() >= 5
+        assert meal != (1 if weekend else 3)
@@ -0,0 +1,38 @@
+import api.parsing
+from api import upstream
+from api.campusdish_interface import split_menu_by_day
+
+
+def test_split_menu_by_day():
+    menu_data = {
+        "MenuStations": [{"StationId": 1, "Name": "Grill"}],
+        "MenuProducts": [
+            {"StationId": 1, "AssignedDate": "2026-10-19T00:00:00", "Product": {}},
+            {"StationId": 1, "AssignedDate": "2026-10-20T00:00:00", "Product": {}},
+            {"StationId": 1, "AssignedDate": "2026-10-20T00:00:00", "Product": {}},
+            {"StationId": 1, "Product": {}},
+        ],
+    }
+    by_day = split_menu_by_day(menu_data)
+    assert sorted(by_day) == ["10/19/2026", "10/20/2026"]
+    assert len(by_day["10/20/2026"]["MenuProducts"]) == 2
+    assert by_day["10/19/2026"]["MenuStations"] == menu_data["MenuStations"]
+
+
+def test_undated_weekly_data_turns_weekly_calls_off(monkeypatch):
+    # the recordings are daily GetMenus responses, whose products have no dates, like a weekly response without them would
+    upstream.configure(mode="replay")
+    monkeypatch.setattr(api.parsing, "_weekly_undated", False)
+    weekly_calls = []
+    get_week_menu_data = api.parsing.get_week_menu_data
+    monkeypatch.setattr(api.parsing, "get_week_menu_data", lambda *args: weekly_calls.append(args) or get_week_menu_data(*args))
+    try:
+        menus = api.parsing.get_week_menus("brandywine", 1, "10/19/2026", 7)  # monday
+        assert sorted(menus) == ["10/19/2026", "10/20/2026", "10/21/2026", "10/22/2026", "10/23/2026"]  # no lunch on the weekend
+        assert all(menu[0]["station"] != "Error" for menu in menus.values())
+        assert api.parsing._weekly_undated
+
+        api.parsing.get_week_menus("brandywine", 2, "10/19/2026", 7)
+        assert len(weekly_calls) == 1
+    finally:
+        upstream.configure(mode="live")
@@ -1,45 +1,118 @@
 import api.parsing
+from api.util import LOCATION_INFO, get_name, get_meals_for_weekday
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+import argparse
+import json
+import sys
+import time
 import pytz
 
 
-def is_weekend(date: datetime) -> bool:
-    'Given a datetime object, returns true if date is a weekend'
-    return (date.weekday() == 5) or (date.weekday() == 6)
+def meals_for_day(date: datetime) -> list:
+    'Meal ids served on the given day: breakfast, lunch (brunch on weekends) and dinner'
+    return get_meals_for_weekday(date.weekday())
+
+
+def get_export_targets(today: datetime, days: int = 7, locations: list = None) -> list:
+    'Every (location, meal, date string) for the `days` days after today'
+    targets = []
+    for i in range(1, days + 1):
+        next_date = today + timedelta(days=i)
+        date_string = next_date.strftime('%m/%d/%Y')
+        for meal in meals_for_day(next_date):
+            for location in locations or LOCATION_INFO:
+                targets.append((location, meal, date_string))
+    return targets
+
+
+def export_menus(today: datetime, days: int = 7, locations: list = None, workers: int = 8):
+    '''
+    Builds the response body for every location and meal for the `days` days after today, fetching them concurrently.
+    The schedule and themed events only get scraped once per location instead of once per body.
+    Yields (location, meal, date, body) in the order they finish.
+    '''
+    targets = get_export_targets(today, days, locations)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        location_futures = {location: executor.submit(api.parsing.get_location_details, get_name(location))
+                            for location in {location for location, _, _ in targets}}
+        details = {location: future.result() for location, future in location_futures.items()}
+
+        futures = {}
+        for location, meal, date in targets:
+            schedule, themed = details[location]
+            future = executor.submit(api.parsing.make_response_body, location, meal, date, schedule=schedule, themed=themed)
+            futures[future] = (location, meal, date)
+        for future in as_completed(futures):
+            location, meal, date = futures[future]
+            yield location, meal, date, future.result()
+
+
+def _compact(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def write_ndjson(results, out) -> int:
+    'Write one line per body as soon as it is ready. Returns how many were written.'
+    count = 0
+    for location, meal, date, body in results:
+        out.write(_compact({'location': location, 'meal': meal, 'date': date, 'body': body}) + '\n')
+        out.flush()
+        count += 1
+    return count
+
+
+def write_json(results, out) -> int:
+    'Write everything as one compact document: {location: {date: {meal: body}}}. Returns how many bodies were written.'
+    document = {}
+    count = 0
+    for location, meal, date, body in results:
+        document.setdefault(location, {}).setdefault(date, {})[str(meal)] = body
+        count += 1
+    out.write(_compact(document))
+    return count
+
+
+def write_cache(results) -> int:
+    'Store every body under its Firebase cache key. Returns how many were written.'
+    from api.firebase_utils import set_menu_body  # only needs the firebase credentials if you're writing to the cache
+    count = 0
+    for location, meal, date, body in results:
+        set_menu_body(location, meal, date, body)
+        count += 1
+    return count
+
 
 # Can be used to return a List with all of the menu information in the future
 def week_menu(today: datetime) -> None:
     'Given a datetime object of a starting date, prints the following weeks menu for Anteatery and Brandywine'
-    # Can be changed to fetch different number of days into the future. Currently fetches 7 days into the future.
-    for i in range(1, 8):
-        next_date = today + timedelta(days=i)
-        date_string = next_date.strftime('%m/%d/%Y')
-        # 3 Meals
-        for x in range(3):
-            print()
-            if is_weekend(next_date) and x == 1:
-                x = 3
-            if x == 0:
-                print("\nBREAKFAST:\n")
-            elif x == 1:
-                print("\nLUNCH:\n")
-            elif x == 2:
-                print("\nDINNER:\n")
-            elif x == 3:
-                print("\nBRUNCH:\n")
-            print("Anteatery Menu:\n")
-            anteatery_response = api.parsing.make_response_body(
-                'anteatery', x, date_string)
-            print(anteatery_response)
-            brandywine_response = api.parsing.make_response_body(
-                'brandywine', x, date_string)
-            print("\nBrandywine Menu:\n")
-            print(brandywine_response)
+    write_ndjson(export_menus(today), sys.stdout)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the upcoming week of menus for every location")
+    parser.add_argument("--days", type=int, default=7, help="how many days after today to export (default 7)")
+    parser.add_argument("--location", action="append", choices=list(LOCATION_INFO), help="only export this location (can be repeated)")
+    parser.add_argument("--format", choices=("ndjson", "json"), default="ndjson", help="ndjson streams one body per line, json writes one document")
+    parser.add_argument("--output", "-o", help="file to write to (default stdout)")
+    parser.add_argument("--to-cache", action="store_true", help="store the bodies in the Firebase cache instead of writing them out")
+    parser.add_argument("--workers", type=int, default=8, help="how many upstream fetches to run at the same time")
+    args = parser.parse_args()
+
     # Set the time zone to Pacific Standard Time
     irvine_tz = pytz.timezone("America/Los_Angeles")
     # Get the current date and time in Irvine, California
     now = datetime.now(irvine_tz)
-    week_menu(now)
\ No newline at end of file
+
+    start = time.monotonic()
+    results = export_menus(now, args.days, args.location, args.workers)
+    if args.to_cache:
+        count = write_cache(results)
+    else:
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            count = (write_ndjson if args.format == "ndjson" else write_json)(results, out)
+        finally:
+            if args.output:
+                out.close()
+    print(f"Exported {count} menus in {time.monotonic() - start:.1f}s", file=sys.stderr)